@@ -39,10 +39,11 @@ from pox.lib.revent import Event, EventMixin
 from pox.openflow.libopenflow_01 import *
 import pox.openflow.libopenflow_01 as of
 from pox.openflow.util import make_type_to_unpacker_table
-from pox.openflow.flow_table import SwitchFlowTable
+from pox.openflow.flow_table import SwitchFlowTable, FlowTableModification
 from pox.lib.packet import *
 
 import logging
+from collections import OrderedDict
 
 
 class DpPacketOut (Event):
@@ -74,7 +75,37 @@ def _generate_ports (num_ports=4, dpid=0):
   return [_generate_port(i, dpid) for i in range(1, num_ports+1)]
 
 
+def _microflow_key (packet, in_port):
+  """
+  Returns a key for everything in a packet that ofp_match.from_packet()
+  looks at, so packets with the same key get classified the same way.
+  """
+  p = packet.next
+  if isinstance(p, vlan):
+    k = (in_port, packet.src, packet.dst, p.eth_type, p.id, p.pcp)
+    p = p.next
+  else:
+    k = (in_port, packet.src, packet.dst, packet.type)
+
+  if isinstance(p, ipv4):
+    k += (p.srcip, p.dstip, p.protocol, p.tos)
+    p = p.next
+    if isinstance(p, udp) or isinstance(p, tcp):
+      k += (p.srcport, p.dstport)
+    elif isinstance(p, icmp):
+      k += (p.type, p.code)
+  elif isinstance(p, arp):
+    if p.opcode <= 255:
+      k += (p.opcode, p.protosrc, p.protodst)
+  return k
+
+
 class SoftwareSwitchBase (object):
+  # Most flow table lookups remembered by rx_packet() (0 disables).  The
+  # cache is keyed on the header fields of packets and is cleared whenever
+  # the flow table changes.
+  microflow_cache_size = 1024
+
   def __init__ (self, dpid, name=None, ports=4, miss_send_len=128,
                 max_buffers=100, features=None):
     """
@@ -96,6 +127,12 @@ class SoftwareSwitchBase (object):
     self._lookup_count = 0
     self._matched_count = 0
 
+    # microflow key -> TableEntry (or None for a miss), least recently
+    # used first
+    self._microflows = OrderedDict()
+    self.table.addListener(FlowTableModification,
+                           self._handle_FlowTableModification)
+
     self.log = logging.getLogger(self.name)
     self._connection = None
 
@@ -216,6 +253,7 @@ class SoftwareSwitchBase (object):
     Handles flow mods
     """
     self.log.debug("Flow mod details: %s", ofp.show())
+    self._microflows.clear()
     self.table.process_flow_mod(ofp)
     if ofp.buffer_id is not None:
       self._process_actions_for_packet_from_buffer(ofp.actions, ofp.buffer_id,
@@ -431,7 +469,7 @@ class SoftwareSwitchBase (object):
       return
 
     self._lookup_count += 1
-    entry = self.table.entry_for_packet(packet, in_port)
+    entry = self._lookup(packet, in_port)
     if entry is not None:
       self._matched_count += 1
       entry.touch_packet(len(packet))
@@ -444,6 +482,27 @@ class SoftwareSwitchBase (object):
       self.send_packet_in(in_port, buffer_id, packet,
                           reason=OFPR_NO_MATCH, data_length=self.miss_send_len)
 
+  def _handle_FlowTableModification (self, event):
+    if event.added or event.removed:
+      self._microflows.clear()
+
+  def _lookup (self, packet, in_port):
+    """
+    Finds the flow table entry for a packet, using the microflow cache
+    """
+    if not self.microflow_cache_size:
+      return self.table.entry_for_packet(packet, in_port)
+    microflows = self._microflows
+    key = _microflow_key(packet, in_port)
+    try:
+      entry = microflows.pop(key)
+    except KeyError:
+      entry = self.table.entry_for_packet(packet, in_port)
+      if len(microflows) >= self.microflow_cache_size:
+        microflows.popitem(last=False)
+    microflows[key] = entry
+    return entry
+
   def delete_port (self, port):
     """
     Removes a port
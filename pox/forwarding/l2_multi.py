@@ -36,8 +36,16 @@ from pox.lib.revent import *
 from pox.lib.recoco import Timer
 from collections import defaultdict
 from pox.openflow.discovery import Discovery
-from pox.lib.util import dpid_to_str
+from pox.lib.util import dpid_to_str, str_to_bool
 import time
+import heapq
+import itertools
+
+try:
+  import numpy
+except ImportError:
+  # Only needed for DensePaths
+  numpy = None
 
 log = core.getLogger()
 
@@ -50,11 +58,43 @@ switches = {}
 # ethaddr -> (switch, port)
 mac_map = {}
 
-# [sw1][sw2] -> (distance, intermediate)
-path_map = defaultdict(lambda:defaultdict(lambda:(None,None)))
+# Shortest path trees.  [src] -> {dst: (distance, previous hop)}
+# These are computed lazily and only thrown away when a link change might
+# have affected them (see _link_removed() and _link_added()).
+path_trees = {}
+
+# If set, a DensePaths used instead of path_trees
+dense_paths = None
+
+# Spread flows over all equal-cost paths?
+_multipath = False
+
+# Cooked paths.  (src,dst,first_port,final_port,flow_hash) -> path
+# Cleared whenever links change.
+path_cache = {}
+
+# Install forwarding trees toward hosts as soon as we learn them?
+_proactive = False
+
+# Proactively installed trees.  ethaddr -> ((switch,port), set(switch))
+# The set is the switches which we think still have the tree's entry.
+installed_trees = {}
 
-# Waiting path.  (dpid,xid)->WaitingPath
-waiting_paths = {}
+# WaitingPaths whose flow batches haven't all finished yet
+waiting_paths = set()
+
+# Waiting paths in the order they expire.  (expires_at,seq,WaitingPath)
+# Paths stay in here after they're installed until their time is up.
+_waiting_heap = []
+_waiting_seq = itertools.count()
+
+# What became of paths we tried to set up
+path_stats = {
+  'installed' : 0, # All barriers came back
+  'failed'    : 0, # No path to install
+  'timed_out' : 0, # Barriers didn't come back in PATH_SETUP_TIME
+  'rejected'  : 0, # A switch sent an error or disconnected
+}
 
 # Time to not flood in seconds
 FLOOD_HOLDDOWN = 5
@@ -63,65 +103,264 @@ FLOOD_HOLDDOWN = 5
 FLOW_IDLE_TIMEOUT = 10
 FLOW_HARD_TIMEOUT = 30
 
+# Timeouts for proactively installed trees.  Trees forward traffic from
+# any host without it reaching the controller, so the hard timeout is what
+# makes us notice when a host has moved.
+TREE_IDLE_TIMEOUT = 60
+TREE_HARD_TIMEOUT = 30
+
+# Maximum number of entries in path_cache
+PATH_CACHE_SIZE = 10000
+
 # How long is allowable to set up a path?
 PATH_SETUP_TIME = 4
 
 
-def _calc_paths ():
+def _get_tree (src):
+  """
+  Get the shortest path tree rooted at src
+
+  Links all cost the same, so this is just a BFS.
   """
-  Essentially Floyd-Warshall algorithm
+  tree = path_trees.get(src)
+  if tree is not None: return tree
+
+  tree = {src:(0,None)} # distance, previous hop
+  frontier = [src]
+  distance = 0
+  while frontier:
+    distance += 1
+    next_frontier = []
+    for sw in frontier:
+      for neighbor,port in adjacency[sw].iteritems():
+        if port is None or neighbor in tree: continue
+        tree[neighbor] = (distance, sw)
+        next_frontier.append(neighbor)
+    frontier = next_frontier
+
+  path_trees[src] = tree
+  return tree
+
+
+class DensePaths (object):
   """
+  All-pairs shortest paths kept in NumPy arrays
 
-  def dump ():
-    for i in sws:
-      for j in sws:
-        a = path_map[i][j][0]
-        #a = adjacency[i][j]
-        if a is None: a = "*"
-        print a,
-      print
-
-  sws = switches.values()
-  path_map.clear()
-  for k in sws:
-    for j,port in adjacency[k].iteritems():
-      if port is None: continue
-      path_map[k][j] = (1,None)
-    path_map[k][k] = (0,None) # distance, intermediate
-
-  #dump()
-
-  for k in sws:
-    for i in sws:
-      for j in sws:
-        if path_map[i][k][0] is not None:
-          if path_map[k][j][0] is not None:
-            # i -> k -> j exists
-            ikj_dist = path_map[i][k][0]+path_map[k][j][0]
-            if path_map[i][j][0] is None or ikj_dist < path_map[i][j][0]:
-              # i -> k -> j is better than existing
-              path_map[i][j] = (ikj_dist, k)
-
-  #print "--------------------"
-  #dump()
+  Switches are mapped to dense indices, and the adjacency, hop counts,
+  and next hops are stored as matrices.  Hop counts are found with a
+  BFS over the whole network at once (a matrix product per level), and
+  next hops are then picked a row at a time.  Paths are read out of the
+  next hop matrix, so a lookup is O(path length).
+
+  Any link change just marks everything dirty; it all gets recomputed
+  on the next lookup.
+  """
+  def __init__ (self):
+    if numpy is None:
+      raise RuntimeError("DensePaths requires NumPy")
+    self.nodes = []    # index -> Switch
+    self.index = {}    # Switch -> index
+    self.distance = None # [i,j] -> hops from i to j, or -1
+    self.next_hop = None # [i,j] -> index of first hop from i to j, or -1
+
+  def invalidate (self):
+    self.distance = None
+    self.next_hop = None
+
+  def _build (self):
+    nodes = list(switches.itervalues())
+    index = dict((sw,i) for i,sw in enumerate(nodes))
+    for sw in adjacency:
+      if sw not in index:
+        index[sw] = len(nodes)
+        nodes.append(sw)
+    n = len(nodes)
+
+    adj = numpy.zeros((n,n), dtype=bool)
+    for sw1,ports in adjacency.iteritems():
+      i = index[sw1]
+      for sw2,port in ports.iteritems():
+        if port is None or sw2 not in index: continue
+        adj[i,index[sw2]] = True
+
+    # Breadth first from every node at once.  frontier[i,j] is set if j
+    # is exactly d-1 hops from i.
+    dist = numpy.empty((n,n), dtype=numpy.int32)
+    dist.fill(-1)
+    numpy.fill_diagonal(dist, 0)
+    reached = numpy.eye(n, dtype=bool)
+    frontier = numpy.eye(n, dtype=numpy.float32)
+    adj_f = adj.astype(numpy.float32)
+    d = 0
+    while True:
+      d += 1
+      step = (frontier.dot(adj_f) > 0) & ~reached
+      if not step.any(): break
+      dist[step] = d
+      reached |= step
+      frontier = step.astype(numpy.float32)
+
+    # The next hop from i to j is a neighbor of i one hop closer to j
+    next_hop = numpy.empty((n,n), dtype=numpy.int32)
+    next_hop.fill(-1)
+    for i in xrange(n):
+      neighbors = numpy.flatnonzero(adj[i])
+      if len(neighbors) == 0: continue
+      closer = dist[neighbors] == (dist[i] - 1)
+      row = neighbors[closer.argmax(axis=0)]
+      row[dist[i] <= 0] = -1 # Unreachable or ourself
+      next_hop[i] = row
+
+    self.nodes = nodes
+    self.index = index
+    self.distance = dist
+    self.next_hop = next_hop
+
+  def hops (self, src, dst):
+    """
+    Number of hops from src to dst or None
+    """
+    if self.distance is None: self._build()
+    i = self.index.get(src)
+    j = self.index.get(dst)
+    if i is None or j is None: return None
+    d = int(self.distance[i,j])
+    if d < 0: return None
+    return d
+
+  def next_hops_to (self, dst):
+    """
+    Get a dict of switch -> next switch toward dst
+    """
+    if self.next_hop is None: self._build()
+    j = self.index.get(dst)
+    if j is None: return {}
+    nodes = self.nodes
+    return dict((nodes[i],nodes[hop])
+                for i,hop in enumerate(self.next_hop[:,j].tolist())
+                if hop >= 0)
+
+  def raw_path (self, src, dst):
+    """
+    Get a raw path (just a list of nodes to traverse) or None
+    """
+    if self.next_hop is None: self._build()
+    i = self.index.get(src)
+    j = self.index.get(dst)
+    if i is None or j is None: return None
+    column = self.next_hop[:,j]
+    hop = int(column[i])
+    if hop < 0: return None
+    path = []
+    while hop != j:
+      path.append(self.nodes[hop])
+      hop = int(column[hop])
+    return path
+
+
+def _link_removed (sw1, sw2):
+  """
+  Forget shortest path trees which used the link between sw1 and sw2
+  """
+  path_cache.clear()
+  if dense_paths is not None:
+    dense_paths.invalidate()
+  for src,tree in path_trees.items():
+    if tree.get(sw2, (None,None))[1] is sw1:
+      del path_trees[src]
+    elif tree.get(sw1, (None,None))[1] is sw2:
+      del path_trees[src]
+
+
+def _link_added (sw1, sw2):
+  """
+  Forget shortest path trees which a new link between sw1 and sw2 improves
+
+  A tree only gets better if it didn't reach one of the ends before, or
+  if the new link is a shortcut (the ends were more than one hop apart).
+  """
+  path_cache.clear()
+  if dense_paths is not None:
+    dense_paths.invalidate()
+  for src,tree in path_trees.items():
+    d1 = tree.get(sw1, (None,None))[0]
+    d2 = tree.get(sw2, (None,None))[0]
+    if d1 is None and d2 is None: continue # Still can't get there
+    if d1 is None or d2 is None or abs(d1 - d2) > 1:
+      del path_trees[src]
 
 
 def _get_raw_path (src, dst):
   """
   Get a raw path (just a list of nodes to traverse)
   """
-  if len(path_map) == 0: _calc_paths()
   if src is dst:
     # We're here!
     return []
-  if path_map[src][dst][0] is None:
+  if dense_paths is not None:
+    return dense_paths.raw_path(src, dst)
+  tree = _get_tree(src)
+  if dst not in tree:
     return None
-  intermediate = path_map[src][dst][1]
-  if intermediate is None:
-    # Directly connected
+  path = []
+  hop = tree[dst][1]
+  while hop is not src:
+    path.append(hop)
+    hop = tree[hop][1]
+  path.reverse()
+  return path
+
+
+def _hop_counts (dst):
+  """
+  Get a function which returns how many hops a switch is from dst (or None)
+  """
+  if dense_paths is not None:
+    return lambda sw: dense_paths.hops(sw, dst)
+  # Links go both ways, so the tree rooted at dst has distances to it
+  tree = _get_tree(dst)
+  return lambda sw: tree.get(sw, (None,None))[0]
+
+
+def _flow_hash (match):
+  """
+  Hash a flow's 5-tuple (or its ethernet addresses if it's not IP)
+  """
+  if match.nw_src is None and match.nw_dst is None:
+    return hash((match.dl_src, match.dl_dst, match.dl_type))
+  return hash((match.nw_src, match.nw_dst, match.nw_proto,
+               match.tp_src, match.tp_dst))
+
+
+def _get_multipath_raw_path (src, dst, flow_hash):
+  """
+  Get a raw path, using flow_hash to pick among equal-cost next hops
+
+  At every hop, any neighbor which is one hop closer to dst will do.
+  The choice also depends on the switch making it, so flows which share
+  one hop don't all pick the same way at the next.
+  """
+  if src is dst:
+    # We're here!
     return []
-  return _get_raw_path(src, intermediate) + [intermediate] + \
-         _get_raw_path(intermediate, dst)
+  hop_counts = _hop_counts(dst)
+  hops = hop_counts(src)
+  if hops is None:
+    return None
+  path = []
+  sw = src
+  while hops > 1:
+    hops -= 1
+    candidates = [n for n,port in adjacency[sw].iteritems()
+                  if port is not None and hop_counts(n) == hops]
+    candidates.sort(key=lambda n: n.dpid)
+    sw = candidates[hash((flow_hash, sw.dpid)) % len(candidates)]
+    path.append(sw)
+  return path
+
+
+def _flip (link):
+  return Discovery.Link(link[2],link[3], link[0],link[1])
 
 
 def _check_path (p):
@@ -133,20 +372,29 @@ def _check_path (p):
   for a,b in zip(p[:-1],p[1:]):
     if adjacency[a[0]][b[0]] != a[2]:
       return False
-    if adjacency[b[0]][a[0]] != b[2]:
+    if adjacency[b[0]][a[0]] != b[1]:
       return False
   return True
 
 
-def _get_path (src, dst, first_port, final_port):
+def _get_path (src, dst, first_port, final_port, flow_hash = None):
   """
   Gets a cooked path -- a list of (node,in_port,out_port)
+
+  If flow_hash is given, it picks among equal-cost paths.
   """
+  key = (src, dst, first_port, final_port, flow_hash)
+  r = path_cache.get(key)
+  if r is not None: return r
+
   # Start with a raw path...
   if src == dst:
     path = [src]
   else:
-    path = _get_raw_path(src, dst)
+    if flow_hash is None:
+      path = _get_raw_path(src, dst)
+    else:
+      path = _get_multipath_raw_path(src, dst, flow_hash)
     if path is None: return None
     path = [src] + path + [dst]
 
@@ -161,43 +409,111 @@ def _get_path (src, dst, first_port, final_port):
 
   assert _check_path(r), "Illegal path!"
 
+  if len(path_cache) >= PATH_CACHE_SIZE: path_cache.clear()
+  path_cache[key] = r
   return r
 
 
+def _next_hops_to (dst):
+  """
+  Get the next hop toward dst for every switch which can reach it
+
+  Returns a dict of switch -> next switch
+  """
+  if dense_paths is not None:
+    return dense_paths.next_hops_to(dst)
+  # Links go both ways, so the tree rooted at dst leads back to it
+  return dict((sw,prev) for sw,(distance,prev) in _get_tree(dst).iteritems()
+              if prev is not None)
+
+
+def _install_tree (mac):
+  """
+  Install entries forwarding toward mac on all switches missing them
+
+  This is a tree rooted at the host's switch which matches only on the
+  destination address, so it works for traffic from any host.  Does
+  nothing if all the switches already have it.
+  """
+  loc = mac_map.get(mac)
+  if loc is None: return
+  tree = installed_trees.get(mac)
+  if tree is None or tree[0] != loc:
+    if tree is not None:
+      # Host moved.  Get rid of the old tree and any flows to it.
+      msg = of.ofp_flow_mod(command=of.OFPFC_DELETE,
+                            match=of.ofp_match(dl_dst=mac))
+      for sw in tree[1]:
+        if sw.connection is not None: sw.connection.send(msg)
+    tree = (loc, set())
+    installed_trees[mac] = tree
+
+  dst_sw,dst_port = loc
+  next_hops = None
+  for sw in switches.itervalues():
+    if sw in tree[1] or sw.connection is None: continue
+    if sw is dst_sw:
+      out_port = dst_port
+    else:
+      if next_hops is None: next_hops = _next_hops_to(dst_sw)
+      next_hop = next_hops.get(sw)
+      if next_hop is None: continue # Can't get there from here
+      out_port = adjacency[sw][next_hop]
+    msg = of.ofp_flow_mod()
+    msg.match = of.ofp_match(dl_dst=mac)
+    msg.idle_timeout = TREE_IDLE_TIMEOUT
+    msg.hard_timeout = TREE_HARD_TIMEOUT
+    msg.flags = of.OFPFF_SEND_FLOW_REM
+    msg.actions.append(of.ofp_action_output(port = out_port))
+    sw.connection.send(msg)
+    tree[1].add(sw)
+
+
 class WaitingPath (object):
   """
   A path which is waiting for its path to be established
   """
   def __init__ (self, path, packet):
     """
-    xids is a sequence of (dpid,xid)
     first_switch is the DPID where the packet came from
     packet is something that can be sent in a packet_out
     """
     self.expires_at = time.time() + PATH_SETUP_TIME
     self.path = path
     self.first_switch = path[0][0].dpid
-    self.xids = set()
+    self.batches = set()
     self.packet = packet
 
-    if len(waiting_paths) > 1000:
-      WaitingPath.expire_waiting_paths()
+    waiting_paths.add(self)
+    heapq.heappush(_waiting_heap,
+                   (self.expires_at, next(_waiting_seq), self))
 
-  def add_xid (self, dpid, xid):
-    self.xids.add((dpid,xid))
-    waiting_paths[(dpid,xid)] = self
+  def add_batch (self, batch):
+    """
+    Waits for a FlowBatch from the flow batcher
+    """
+    self.batches.add(batch)
+    batch.add_callback(self.notify)
 
   @property
   def is_expired (self):
     return time.time() >= self.expires_at
 
-  def notify (self, event):
+  def notify (self, batch):
     """
-    Called when a barrier has been received
+    Called when a batch has finished
     """
-    self.xids.discard((event.dpid,event.xid))
-    if len(self.xids) == 0:
+    if batch not in self.batches: return # Expired or rejected already
+    if not batch.ok:
+      log.warning("Path rejected by %s", dpid_to_str(batch.dpid))
+      path_stats['rejected'] += 1
+      self._cancel()
+      return
+    self.batches.discard(batch)
+    if len(self.batches) == 0:
       # Done!
+      waiting_paths.discard(self)
+      path_stats['installed'] += 1
       if self.packet:
         log.debug("Sending delayed packet out %s"
                   % (dpid_to_str(self.first_switch),))
@@ -207,17 +523,21 @@ class WaitingPath (object):
 
       core.l2_multi.raiseEvent(PathInstalled(self.path))
 
+  def _cancel (self):
+    self.batches.clear()
+    waiting_paths.discard(self)
 
   @staticmethod
   def expire_waiting_paths ():
-    packets = set(waiting_paths.values())
+    now = time.time()
     killed = 0
-    for p in packets:
-      if p.is_expired:
-        killed += 1
-        for entry in p.xids:
-          waiting_paths.pop(entry, None)
+    while _waiting_heap and _waiting_heap[0][0] <= now:
+      p = heapq.heappop(_waiting_heap)[2]
+      if not p.batches: continue # Installed (or rejected) already
+      killed += 1
+      p._cancel()
     if killed:
+      path_stats['timed_out'] += killed
       log.error("%i paths failed to install" % (killed,))
 
 
@@ -242,30 +562,35 @@ class Switch (EventMixin):
     return dpid_to_str(self.dpid)
 
   def _install (self, switch, in_port, out_port, match, buf = None):
+    """
+    Queues a flow mod for switch, returning the FlowBatch it goes in
+    """
     msg = of.ofp_flow_mod()
-    msg.match = match
+    # The batcher packs it later, so it needs a match of its own
+    msg.match = match.clone()
     msg.match.in_port = in_port
     msg.idle_timeout = FLOW_IDLE_TIMEOUT
     msg.hard_timeout = FLOW_HARD_TIMEOUT
     msg.actions.append(of.ofp_action_output(port = out_port))
     msg.buffer_id = buf
-    switch.connection.send(msg)
+    return core.openflow_flow_batcher.send(switch.connection, msg)
 
   def _install_path (self, p, match, packet_in=None):
     wp = WaitingPath(p, packet_in)
     for sw,in_port,out_port in p:
-      self._install(sw, in_port, out_port, match)
-      msg = of.ofp_barrier_request()
-      sw.connection.send(msg)
-      wp.add_xid(sw.dpid,msg.xid)
+      # The batcher sends one barrier for all the flow mods a switch gets
+      # in this go-round (e.g., both directions of this path)
+      wp.add_batch(self._install(sw, in_port, out_port, match))
 
   def install_path (self, dst_sw, last_port, match, event):
     """
     Attempts to install a path between this switch and some destination
     """
-    p = _get_path(self, dst_sw, event.port, last_port)
+    flow_hash = _flow_hash(match) if _multipath else None
+    p = _get_path(self, dst_sw, event.port, last_port, flow_hash)
     if p is None:
       log.warning("Can't get from %s to %s", match.dl_src, match.dl_dst)
+      path_stats['failed'] += 1
 
       import pox.lib.packet as pkt
 
@@ -349,6 +674,7 @@ class Switch (EventMixin):
       if packet.src.is_multicast == False:
         mac_map[packet.src] = loc # Learn position for ethaddr
         log.debug("Learned %s at %s.%i", packet.src, loc[0], loc[1])
+        if _proactive: _install_tree(packet.src)
     elif oldloc != loc:
       # ethaddr seen at different place!
       if loc[1] not in adjacency[loc[0]].values():
@@ -359,6 +685,7 @@ class Switch (EventMixin):
         if packet.src.is_multicast == False:
           mac_map[packet.src] = loc # Learn position for ethaddr
           log.debug("Learned %s at %s.%i", packet.src, loc[0], loc[1])
+          if _proactive: _install_tree(packet.src)
       elif packet.dst.is_multicast == False:
         # New place is a switch-to-switch port!
         #TODO: This should be a flood.  It'd be nice if we knew.  We could
@@ -379,7 +706,10 @@ class Switch (EventMixin):
         flood()
       else:
         dest = mac_map[packet.dst]
-        match = of.ofp_match.from_packet(packet)
+        # The tree (if any) was missing from this switch, so fill it in.
+        # We still set up a path for this flow so the packet gets there.
+        if _proactive: _install_tree(packet.dst)
+        match = of.ofp_match.from_raw(event.data)
         self.install_path(dest[0], dest[1], match, event)
 
   def disconnect (self):
@@ -425,67 +755,89 @@ class l2_multi (EventMixin):
       core.openflow_discovery.addListeners(self)
     core.call_when_ready(startup, ('openflow','openflow_discovery'))
 
-  def _handle_LinkEvent (self, event):
-    def flip (link):
-      return Discovery.Link(link[2],link[3], link[0],link[1])
-
-    l = event.link
-    sw1 = switches[l.dpid1]
-    sw2 = switches[l.dpid2]
+  @property
+  def stats (self):
+    """
+    Counts of installed, failed, timed out, and still waiting paths
+    """
+    r = dict(path_stats)
+    r['waiting'] = len(waiting_paths)
+    return r
 
-    # Invalidate all flows and path info.
+  def _handle_LinksChanged (self, event):
+    # Invalidate all flows.
     # For link adds, this makes sure that if a new link leads to an
     # improved path, we use it.
     # For link removals, this makes sure that we don't use a
     # path that may have been broken.
+    # Path info is invalidated below, but only where it's affected.
+    # We get one of these for a whole bunch of links at once, so at least
+    # we only do this once for all of them.
     #NOTE: This could be radically improved! (e.g., not *ALL* paths break)
     clear = of.ofp_flow_mod(command=of.OFPFC_DELETE)
     for sw in switches.itervalues():
       if sw.connection is None: continue
       sw.connection.send(clear)
-    path_map.clear()
-
-    if event.removed:
-      # This link no longer okay
-      if sw2 in adjacency[sw1]: del adjacency[sw1][sw2]
-      if sw1 in adjacency[sw2]: del adjacency[sw2][sw1]
-
-      # But maybe there's another way to connect these...
-      for ll in core.openflow_discovery.adjacency:
-        if ll.dpid1 == l.dpid1 and ll.dpid2 == l.dpid2:
-          if flip(ll) in core.openflow_discovery.adjacency:
-            # Yup, link goes both ways
-            adjacency[sw1][sw2] = ll.port1
-            adjacency[sw2][sw1] = ll.port2
-            # Fixed -- new link chosen to connect these
-            break
+    path_cache.clear()
+    installed_trees.clear()
+
+    for l in event.removed:
+      self._link_down(l)
+    for l in event.added:
+      self._link_up(l)
+
+  def _link_down (self, l):
+    sw1 = switches[l.dpid1]
+    sw2 = switches[l.dpid2]
+
+    # This link no longer okay
+    if sw2 in adjacency[sw1]: del adjacency[sw1][sw2]
+    if sw1 in adjacency[sw2]: del adjacency[sw2][sw1]
+
+    # But maybe there's another way to connect these...
+    for ll in core.openflow_discovery.adjacency:
+      if ll.dpid1 == l.dpid1 and ll.dpid2 == l.dpid2:
+        if _flip(ll) in core.openflow_discovery.adjacency:
+          # Yup, link goes both ways
+          adjacency[sw1][sw2] = ll.port1
+          adjacency[sw2][sw1] = ll.port2
+          # Fixed -- new link chosen to connect these
+          break
     else:
-      # If we already consider these nodes connected, we can
-      # ignore this link up.
-      # Otherwise, we might be interested...
-      if adjacency[sw1][sw2] is None:
-        # These previously weren't connected.  If the link
-        # exists in both directions, we consider them connected now.
-        if flip(l) in core.openflow_discovery.adjacency:
-          # Yup, link goes both ways -- connected!
-          adjacency[sw1][sw2] = l.port1
-          adjacency[sw2][sw1] = l.port2
-
-      # If we have learned a MAC on this port which we now know to
-      # be connected to a switch, unlearn it.
-      bad_macs = set()
-      for mac,(sw,port) in mac_map.iteritems():
-        #print sw,sw1,port,l.port1
-        if sw is sw1 and port == l.port1:
-          if mac not in bad_macs:
-            log.debug("Unlearned %s", mac)
-            bad_macs.add(mac)
-        if sw is sw2 and port == l.port2:
-          if mac not in bad_macs:
-            log.debug("Unlearned %s", mac)
-            bad_macs.add(mac)
-      for mac in bad_macs:
-        del mac_map[mac]
+      # Nope, they're really disconnected now
+      _link_removed(sw1, sw2)
+
+  def _link_up (self, l):
+    sw1 = switches[l.dpid1]
+    sw2 = switches[l.dpid2]
+
+    # If we already consider these nodes connected, we can
+    # ignore this link up.
+    # Otherwise, we might be interested...
+    if adjacency[sw1][sw2] is None:
+      # These previously weren't connected.  If the link
+      # exists in both directions, we consider them connected now.
+      if _flip(l) in core.openflow_discovery.adjacency:
+        # Yup, link goes both ways -- connected!
+        adjacency[sw1][sw2] = l.port1
+        adjacency[sw2][sw1] = l.port2
+        _link_added(sw1, sw2)
+
+    # If we have learned a MAC on this port which we now know to
+    # be connected to a switch, unlearn it.
+    bad_macs = set()
+    for mac,(sw,port) in mac_map.iteritems():
+      #print sw,sw1,port,l.port1
+      if sw is sw1 and port == l.port1:
+        if mac not in bad_macs:
+          log.debug("Unlearned %s", mac)
+          bad_macs.add(mac)
+      if sw is sw2 and port == l.port2:
+        if mac not in bad_macs:
+          log.debug("Unlearned %s", mac)
+          bad_macs.add(mac)
+    for mac in bad_macs:
+      del mac_map[mac]
 
   def _handle_ConnectionUp (self, event):
     sw = switches.get(event.dpid)
@@ -496,18 +848,46 @@ class l2_multi (EventMixin):
       sw.connect(event.connection)
     else:
       sw.connect(event.connection)
+      # It may not have kept its entries for our trees
+      for loc,sws in installed_trees.itervalues():
+        sws.discard(sw)
+
+  def _handle_FlowRemoved (self, event):
+    if not event.timeout: return
+    match = event.ofp.match
+    # Path entries are exact matches; only tree entries lack a dl_src
+    if match.dl_src is not None: return
+    tree = installed_trees.get(match.dl_dst)
+    if tree is None: return
+    # It'll get reinstalled if this switch sees traffic for the host again
+    tree[1].discard(switches.get(event.dpid))
+
+
+def launch (dense = False, multipath = False, proactive = False):
+  """
+  Starts l2_multi
+
+  --dense uses NumPy arrays for paths instead of per-switch trees (which
+  may be better for large, densely-connected networks).
+  --multipath spreads flows over all the shortest paths between two
+  switches rather than always using the same one.
+  --proactive installs forwarding toward each host on all switches as
+  soon as it's learned, so most new flows never reach the controller.
+  """
+  global _multipath, _proactive, dense_paths
+  _multipath = str_to_bool(multipath)
+  _proactive = str_to_bool(proactive)
 
-  def _handle_BarrierIn (self, event):
-    wp = waiting_paths.pop((event.dpid,event.xid), None)
-    if not wp:
-      #log.info("No waiting packet %s,%s", event.dpid, event.xid)
-      return
-    #log.debug("Notify waiting packet %s,%s", event.dpid, event.xid)
-    wp.notify(event)
+  if str_to_bool(dense):
+    if numpy is None:
+      log.warn("NumPy is not available -- using per-switch path trees")
+    else:
+      dense_paths = DensePaths()
 
+  import pox.openflow.flow_batcher
+  pox.openflow.flow_batcher.launch()
 
-def launch ():
   core.registerNew(l2_multi)
 
-  timeout = min(max(PATH_SETUP_TIME, 5) * 2, 15)
-  Timer(timeout, WaitingPath.expire_waiting_paths, recurring=True)
+  # Expiring is cheap when there's nothing to expire, so do it often
+  Timer(1, WaitingPath.expire_waiting_paths, recurring=True)
@@ -206,7 +206,7 @@ class l3_switch (EventMixin):
           actions = []
           actions.append(of.ofp_action_dl_addr.set_dst(mac))
           actions.append(of.ofp_action_output(port = prt))
-          match = of.ofp_match.from_packet(packet, inport)
+          match = of.ofp_match.from_raw(event.data, inport)
           match.dl_src = None # Wildcard source MAC
 
           msg = of.ofp_flow_mod(command=of.OFPFC_ADD,
@@ -214,8 +214,8 @@ class l3_switch (EventMixin):
                                 hard_timeout=of.OFP_FLOW_PERMANENT,
                                 buffer_id=event.ofp.buffer_id,
                                 actions=actions,
-                                match=of.ofp_match.from_packet(packet,
-                                                               inport))
+                                match=of.ofp_match.from_raw(event.data,
+                                                            inport))
           event.connection.send(msg.pack())
       elif self.arp_for_unknowns:
         # We don't know this destination.
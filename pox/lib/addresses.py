@@ -73,16 +73,94 @@ def _load_oui_names ():
 _load_oui_names()
 
 
+class _InternCache (object):
+  """
+  A bounded cache of immutable objects, keyed by what they were made from
+
+  This approximates an LRU cheaply: entries go into the new dictionary,
+  and when that fills up, it becomes the old one (and whatever was in
+  the previous old one is dropped).  Entries found in the old dictionary
+  move back into the new one, so things which keep getting used stay.
+  """
+  def __init__ (self, size):
+    self.size = size
+    self.new = {}
+    self._old = {}
+
+  def get (self, key, factory):
+    """
+    Returns the cached object for key, making it with factory(key) if
+    there isn't one
+    """
+    obj = self.new.get(key)
+    if obj is None:
+      obj = self._old.pop(key, None)
+      if obj is None:
+        obj = factory(key)
+      if len(self.new) >= self.size:
+        self._old = self.new
+        self.new = {}
+      self.new[key] = obj
+    return obj
+
+  def __len__ (self):
+    return len(self.new) + len(self._old)
+
+
+# Caches for addresses made from raw bytes (see set_cache_size())
+_eth_cache = None
+_ip_cache = None
+
+def set_cache_size (size):
+  """
+  Sets how many EthAddrs and IPAddrs to keep around for reuse
+
+  With caching on, making an EthAddr or IPAddr from raw bytes (like the
+  packet library does) or an IPAddr from an int gives back the object
+  made last time for the same value if it's still cached.  That saves
+  making new objects for busy addresses, and dictionary lookups are
+  quicker when the key is the very same object.  Each cache holds up to
+  twice size addresses.  A size of 0 or None (the default) turns caching
+  off.
+  """
+  global _eth_cache, _ip_cache
+  if size:
+    _eth_cache = _InternCache(size)
+    _ip_cache = _InternCache(size)
+  else:
+    _eth_cache = None
+    _ip_cache = None
+
+
 class EthAddr (object):
   """
   An Ethernet (MAC) address type.
   """
-  def __init__ (self, addr):
+  __slots__ = ('_value',)
+
+  def __new__ (cls, addr):
     """
     Understands Ethernet address is various forms.  Hex strings, raw byte
     strings, etc.
     """
     # Always stores as a 6 character string
+    if type(addr) is bytes and len(addr) == 6:
+      # Raw, which is what the packet library gives us
+      if _eth_cache is not None and cls is EthAddr:
+        self = _eth_cache.new.get(addr)
+        if self is not None: return self
+        return _eth_cache.get(addr, _new_eth)
+    else:
+      addr = cls._parse(addr)
+    self = object.__new__(cls)
+    _set_eth(self, addr)
+    return self
+
+  @staticmethod
+  def _parse (addr):
+    """
+    Returns the 6 raw bytes for an address in any of the other forms
+    """
     if isinstance(addr, bytes) or isinstance(addr, basestring):
       if len(addr) == 6:
         # raw
@@ -106,13 +184,13 @@ class EthAddr (object):
         addr = b''.join((chr(int(addr[x*2:x*2+2], 16)) for x in range(0,6)))
       else:
         raise RuntimeError("Expected ethernet address string to be 6 raw bytes or some hex")
-      self._value = addr
+      return addr
     elif isinstance(addr, EthAddr):
-      self._value = addr.toRaw()
+      return addr.toRaw()
     elif type(addr) == list or (hasattr(addr, '__len__') and len(addr) == 6 and hasattr(addr, '__iter__')):
-      self._value = b''.join( (chr(x) for x in addr) )
+      return b''.join( (chr(x) for x in addr) )
     elif addr is None:
-      self._value = b'\x00' * 6
+      return b'\x00' * 6
     else:
       raise RuntimeError("Expected ethernet address to be a string of 6 raw bytes or some hex")
 
@@ -202,13 +280,21 @@ class EthAddr (object):
       if self._value < other:
         return -1
       if self._value > other:
-        return -1
+        return 1
       raise RuntimeError("Objects can not be compared?")
     except:
       return -other.__cmp__(self)
 
+  def __eq__ (self, other):
+    if type(other) is EthAddr:
+      return self._value == other._value
+    return self.__cmp__(other) == 0
+
+  def __ne__ (self, other):
+    return not self.__eq__(other)
+
   def __hash__ (self):
-    return self._value.__hash__()
+    return hash(self._value)
 
   def __repr__ (self):
     return self.__class__.__name__ + "('" + self.toStr() + "')"
@@ -217,37 +303,66 @@ class EthAddr (object):
     return 6
 
   def __setattr__ (self, a, v):
-    if hasattr(self, '_value'):
-      raise TypeError("This object is immutable")
-    object.__setattr__(self, a, v)
+    raise TypeError("This object is immutable")
+
+  def __reduce__ (self):
+    return (self.__class__, (self._value,))
+
+# Since __setattr__ refuses, we set the slot with its descriptor
+_set_eth = EthAddr._value.__set__
+
+def _new_eth (raw):
+  self = object.__new__(EthAddr)
+  _set_eth(self, raw)
+  return self
+
+
+_unpack_I = struct.Struct("!I").unpack
+_pack_I = struct.Struct("!I").pack
 
 
 class IPAddr (object):
   """
   Represents an IPv4 address.
   """
-  def __init__ (self, addr, networkOrder = False):
+  __slots__ = ('_value',)
+
+  def __new__ (cls, addr, networkOrder = False):
     """ Can be initialized with several formats.
         If addr is an int/long, then it is assumed to be in host byte order
         unless networkOrder = True
-        Stored in network byte order as a signed int
+        Stored as an unsigned int in host byte order
     """
-
-    # Always stores as a signed network-order int
-    if isinstance(addr, basestring) or isinstance(addr, bytes):
+    t = type(addr)
+    if t is bytes and len(addr) == 4:
+      # Raw, which is what the packet library gives us
+      if _ip_cache is not None and cls is IPAddr:
+        self = _ip_cache.new.get(addr)
+        if self is not None: return self
+        return _ip_cache.get(addr, _new_ip_from_raw)
+      value = _unpack_I(addr)[0]
+    elif (t is int or t is long) and not networkOrder:
+      if _ip_cache is not None and cls is IPAddr:
+        return _ip_cache.get(addr & 0xffFFffFF, _new_ip)
+      value = addr & 0xffFFffFF
+    elif isinstance(addr, basestring) or isinstance(addr, bytes):
       if len(addr) != 4:
         # dotted quad
-        self._value = struct.unpack('i', socket.inet_aton(addr))[0]
+        value = _unpack_I(socket.inet_aton(addr))[0]
       else:
-        self._value = struct.unpack('i', addr)[0]
+        value = _unpack_I(addr)[0]
     elif isinstance(addr, IPAddr):
-      self._value = addr._value
+      value = addr._value
     elif isinstance(addr, int) or isinstance(addr, long):
       addr = addr & 0xffFFffFF # unsigned long
-      self._value = struct.unpack("!i",
-          struct.pack(('!' if networkOrder else '') + "I", addr))[0]
+      if networkOrder:
+        addr = _unpack_I(struct.pack("I", addr))[0]
+      value = addr
     else:
       raise RuntimeError("Unexpected IP address format")
+    self = object.__new__(cls)
+    _set_ip(self, value)
+    return self
 
   def toSignedN (self):
     """ A shortcut """
@@ -260,15 +375,15 @@ class IPAddr (object):
   def toSigned (self, networkOrder = False):
     """ Return the address as a signed int """
     if networkOrder:
-      return self._value
-    v = socket.htonl(self._value & 0xffFFffFF)
-    return struct.unpack("i", struct.pack("I", v))[0]
+      return struct.unpack("i", self.toRaw())[0]
+    v = self._value
+    return v - 0x100000000 if v & 0x80000000 else v
 
   def toRaw (self):
     """
     Returns the address as a four-character byte string.
     """
-    return struct.pack("i", self._value)
+    return _pack_I(self._value)
 
   def toUnsigned (self, networkOrder = False):
     """
@@ -276,12 +391,14 @@ class IPAddr (object):
     default) byte order.
     """
     if not networkOrder:
-      return socket.htonl(self._value & 0xffFFffFF)
-    return self._value & 0xffFFffFF
+      return self._value
+    return struct.unpack("I", self.toRaw())[0]
 
   def toStr (self):
     """ Return dotted quad representation """
-    return socket.inet_ntoa(self.toRaw())
+    v = self._value
+    return "%i.%i.%i.%i" % (v >> 24, (v >> 16) & 0xff, (v >> 8) & 0xff,
+                            v & 0xff)
 
   def in_network (self, *args, **kw):
     return self.inNetwork(*args, **kw)
@@ -314,12 +431,20 @@ class IPAddr (object):
     try:
       if not isinstance(other, IPAddr):
         other = IPAddr(other)
-      return cmp(self.toUnsigned(), other.toUnsigned())
+      return cmp(self._value, other._value)
     except:
       return -other.__cmp__(self)
 
+  def __eq__ (self, other):
+    if type(other) is IPAddr:
+      return self._value == other._value
+    return self.__cmp__(other) == 0
+
+  def __ne__ (self, other):
+    return not self.__eq__(other)
+
   def __hash__ (self):
-    return self._value.__hash__()
+    return hash(self._value)
 
   def __repr__ (self):
     return self.__class__.__name__ + "('" + self.toStr() + "')"
@@ -328,9 +453,20 @@ class IPAddr (object):
     return 4
 
   def __setattr__ (self, a, v):
-    if hasattr(self, '_value'):
-      raise TypeError("This object is immutable")
-    object.__setattr__(self, a, v)
+    raise TypeError("This object is immutable")
+
+  def __reduce__ (self):
+    return (self.__class__, (self._value,))
+
+_set_ip = IPAddr._value.__set__
+
+def _new_ip (value):
+  self = object.__new__(IPAddr)
+  _set_ip(self, value)
+  return self
+
+def _new_ip_from_raw (raw):
+  return _new_ip(_unpack_I(raw)[0])
 
 
 def netmask_to_cidr (dq):
@@ -115,5 +115,52 @@ class EpollSelect(object):
 
     return (retrl, retwl, retxl)
 
+  def fileno(self):
+    """ the epoll fd itself, which is readable whenever any registered fd is ready.
+        This lets an EpollSelect be handed to select()/recoco's Select() as a
+        single fd that stands in for everything registered on it.
+    """
+    return self.epoll.fileno()
+
+  def register(self, obj, mask=None):
+    """ persistently register obj (a raw fd or an object answering to #fileno())
+        for the events in mask. Unlike select(), the registration is kept until
+        unregister() is called, so there is no per-call cost proportional to the
+        number of registered fds.
+        Don't mix this with select() on the same instance.
+        mask defaults to EPOLLIN|EPOLLPRI.
+    """
+    if mask is None:
+      mask = select.EPOLLIN|select.EPOLLPRI
+    fd = obj.fileno() if hasattr(obj, "fileno") else obj
+    if fd in self.registered:
+      self.epoll.modify(fd, mask)
+    else:
+      self.epoll.register(fd, mask)
+    self.registered[fd] = mask
+    self.fd_to_obj[fd] = obj
+
+  def unregister(self, obj):
+    """ remove a registration made with register(). Unknown objects are ignored. """
+    fd = obj.fileno() if hasattr(obj, "fileno") else obj
+    if fd not in self.registered:
+      return
+    del self.registered[fd]
+    del self.fd_to_obj[fd]
+    try:
+      self.epoll.unregister(fd)
+    except (IOError, OSError, ValueError):
+      # fd already closed -- the kernel has dropped it for us
+      pass
+
+  def poll(self, timeout=0, maxevents=-1):
+    """ wait for events on the persistently registered fds.
+        Returns a list of (obj, event mask) tuples, only for fds that are ready.
+    """
+    fd_to_obj = self.fd_to_obj
+    return [(fd_to_obj[fd], event)
+            for (fd, event) in self.epoll.poll(timeout, maxevents)
+            if fd in fd_to_obj]
+
   def close(self):
     self.epoll.close()
@@ -51,6 +51,17 @@ class MockSocket (object):
     """
     return self.receiving.recv(max_size)
 
+  def recv_into (self, buffer, nbytes=0):
+    """
+    receive data on this socket into buffer (e.g., a bytearray).
+
+    Returns the number of bytes received.  Like recv(), this returns 0
+    rather than blocking if there's no data available.
+    """
+    msg = self.receiving.recv(nbytes or len(buffer))
+    buffer[0:len(msg)] = msg
+    return len(msg)
+
   def set_on_ready_to_recv (self, on_ready):
     """
     set a handler function on_ready(socket, size) to be called when
@@ -72,7 +72,7 @@ class ethernet(packet_base):
 
   type_parsers = {}
 
-  def __init__(self, raw=None, prev=None, **kw):
+  def __init__(self, raw=None, prev=None, lazy=False, **kw):
     packet_base.__init__(self)
 
     if len(ethernet.type_parsers) == 0:
@@ -102,11 +102,17 @@ class ethernet(packet_base):
     self.next = b''
 
     if raw is not None:
-      self.parse(raw)
+      self.parse(raw, lazy)
 
     self._init(kw)
 
-  def parse (self, raw):
+  def parse (self, raw, lazy=False):
+    """
+    Parses raw
+
+    If lazy, the addresses and payload are decoded when first used (and
+    the payload is parsed lazily too, if its class supports it).
+    """
     assert isinstance(raw, bytes)
     self.raw = raw
     alen = len(raw)
@@ -115,20 +121,33 @@ class ethernet(packet_base):
                % (alen,))
       return
 
-    self.dst = EthAddr(raw[:6])
-    self.src = EthAddr(raw[6:12])
     self.type = struct.unpack('!H', raw[12:ethernet.MIN_LEN])[0]
 
     self.hdr_len = ethernet.MIN_LEN
     self.payload_len = alen - self.hdr_len
 
-    self.next = ethernet.parse_next(self, self.type, raw, ethernet.MIN_LEN)
+    if lazy:
+      del self.dst, self.src, self.next
+      self._lazy = ethernet._lazy_fields
+    else:
+      self.dst = EthAddr(raw[:6])
+      self.src = EthAddr(raw[6:12])
+      self.next = ethernet.parse_next(self, self.type, raw, ethernet.MIN_LEN)
     self.parsed = True
 
+  _lazy_fields = {
+    'dst' : lambda self: EthAddr(self.raw[:6]),
+    'src' : lambda self: EthAddr(self.raw[6:12]),
+    'next' : lambda self: ethernet.parse_next(self, self.type, self.raw,
+                                              ethernet.MIN_LEN, lazy=True),
+  }
+
   @staticmethod
-  def parse_next (prev, typelen, raw, offset=0, allow_llc=True):
+  def parse_next (prev, typelen, raw, offset=0, allow_llc=True, lazy=False):
     parser = ethernet.type_parsers.get(typelen)
     if parser is not None:
+      if lazy and parser._lazy_fields is not None:
+        return parser(raw[offset:], prev, lazy=True)
       return parser(raw[offset:], prev)
     elif typelen < 1536 and allow_llc:
       return ethernet._llc(raw[offset:], prev)
@@ -69,7 +69,7 @@ class ipv4(packet_base):
 
     ip_id = int(time.time())
 
-    def __init__(self, raw=None, prev=None, **kw):
+    def __init__(self, raw=None, prev=None, lazy=False, **kw):
         packet_base.__init__(self)
 
         self.prev = prev
@@ -90,7 +90,7 @@ class ipv4(packet_base):
         self.next  = b''
 
         if raw is not None:
-            self.parse(raw)
+            self.parse(raw, lazy)
 
         self._init(kw)
 
@@ -103,7 +103,7 @@ class ipv4(packet_base):
 
         return s
 
-    def parse(self, raw):
+    def parse(self, raw, lazy=False):
         assert isinstance(raw, bytes)
         self.raw = raw
         dlen = len(raw)
@@ -136,31 +136,47 @@ class ipv4(packet_base):
                         % (self.hl, self.iplen))
             return
 
-        self.dstip = IPAddr(self.dstip)
-        self.srcip = IPAddr(self.srcip)
-
         # At this point, we are reasonably certain that we have an IP
         # packet
         self.parsed = True
 
+        if lazy:
+            del self.srcip, self.dstip, self.next
+            self._lazy = ipv4._lazy_fields
+        else:
+            self.dstip = IPAddr(self.dstip)
+            self.srcip = IPAddr(self.srcip)
+            self.next = self._parse_next()
+
+    def _parse_next (self):
+        raw = self.raw
+        dlen = len(raw)
         length = self.iplen
         if length > dlen:
             length = dlen # Clamp to what we've got
         if self.protocol == ipv4.UDP_PROTOCOL:
-            self.next = udp(raw=raw[self.hl*4:length], prev=self)
+            payload = udp(raw=raw[self.hl*4:length], prev=self)
         elif self.protocol == ipv4.TCP_PROTOCOL:
-            self.next = tcp(raw=raw[self.hl*4:length], prev=self)
+            payload = tcp(raw=raw[self.hl*4:length], prev=self)
         elif self.protocol == ipv4.ICMP_PROTOCOL:
-            self.next = icmp(raw=raw[self.hl*4:length], prev=self)
+            payload = icmp(raw=raw[self.hl*4:length], prev=self)
         elif self.protocol == ipv4.IGMP_PROTOCOL:
-            self.next = igmp(raw=raw[self.hl*4:length], prev=self)
+            payload = igmp(raw=raw[self.hl*4:length], prev=self)
         elif dlen < self.iplen:
             self.msg('(ip parse) warning IP packet data shorter than IP len: %u < %u' % (dlen, self.iplen))
+            return b''
         else:
-            self.next =  raw[self.hl*4:length]
+            return raw[self.hl*4:length]
+
+        if not payload.parsed:
+            return raw[self.hl*4:length]
+        return payload
 
-        if isinstance(self.next, packet_base) and not self.next.parsed:
-            self.next = raw[self.hl*4:length]
+    _lazy_fields = {
+        'srcip' : lambda self: IPAddr(self.raw[12:16]),
+        'dstip' : lambda self: IPAddr(self.raw[16:20]),
+        'next' : _parse_next,
+    }
 
     def checksum(self):
         data = struct.pack('!BBHHHBBHII', (self.v << 4) + self.hl, self.tos,
@@ -63,13 +63,39 @@ class packet_base (object):
 
         def __str__(self):
             # optionally convert to human readable string
+
+    Packets can also be parsed lazily, which is mostly useful when only
+    a few fields of a packet are likely to be looked at (e.g., in a
+    PacketIn handler).  A class supporting this sets _lazy_fields to a
+    dictionary of attribute name -> function(packet) which decodes that
+    attribute from packet.raw.  When parse() is told to be lazy, it
+    leaves those attributes unset and sets self._lazy to _lazy_fields;
+    each is then decoded the first time something uses it (see
+    __getattr__).  Typically, 'next' is one of them, so that the next
+    layer isn't parsed until something asks for it.
     """
+
+    # See above.  _lazy is set on instances which were parsed lazily.
+    _lazy_fields = None
+    _lazy = None
+
     def __init__ (self):
         self.next = None
         self.prev = None
         self.parsed = False
         self.raw = None
 
+    def __getattr__ (self, attr):
+        # Only called for attributes which aren't set, so this costs
+        # nothing for packets which weren't parsed lazily.
+        lazy = self._lazy
+        if lazy is None or attr not in lazy:
+            raise AttributeError("'%s' object has no attribute '%s'"
+                                 % (self.__class__.__name__, attr))
+        value = lazy[attr](self)
+        setattr(self, attr, value)
+        return value
+
     def _init (self, kw):
         if 'payload' in kw:
           self.set_payload(kw['payload'])
@@ -44,7 +44,7 @@ class vlan(packet_base):
 
     MIN_LEN = 4
 
-    def __init__(self, raw=None, prev=None, **kw):
+    def __init__(self, raw=None, prev=None, lazy=False, **kw):
         packet_base.__init__(self)
 
         self.prev = prev
@@ -57,7 +57,7 @@ class vlan(packet_base):
         self.eth_type = 0
 
         if raw is not None:
-            self.parse(raw)
+            self.parse(raw, lazy)
 
         self._init(kw)
 
@@ -66,7 +66,7 @@ class vlan(packet_base):
             ethtype_to_str(self.eth_type))
         return s
 
-    def parse(self, raw):
+    def parse(self, raw, lazy=False):
         assert isinstance(raw, bytes)
         self.raw = raw
         dlen = len(raw)
@@ -83,7 +83,18 @@ class vlan(packet_base):
 
         self.parsed = True
 
-        self.next = ethernet.parse_next(self,self.eth_type,raw,vlan.MIN_LEN)
+        if lazy:
+            del self.next
+            self._lazy = vlan._lazy_fields
+        else:
+            self.next = ethernet.parse_next(self,self.eth_type,raw,
+                                            vlan.MIN_LEN)
+
+    _lazy_fields = {
+        'next' : lambda self: ethernet.parse_next(self, self.eth_type,
+                                                  self.raw, vlan.MIN_LEN,
+                                                  lazy=True),
+    }
 
     @property
     def effective_ethertype (self):
@@ -221,6 +221,39 @@ class EventMixin (object):
       setattr(self, "_eventMixin_events", True)
     if not hasattr(self, "_eventMixin_handlers"):
       setattr(self, "_eventMixin_handlers", {})
+    if not hasattr(self, "_eventMixin_compiled"):
+      setattr(self, "_eventMixin_compiled", {})
+
+  def _eventMixin_compile (self, eventType):
+    """
+    Builds what raiseEvent() needs to raise eventType
+
+    This is a tuple (handlers, fast, valid), where valid is False if this
+    source doesn't raise eventType.  If fast is True, handlers is a tuple
+    of (handler, eid) pairs which can simply be called with the event;
+    otherwise some are "once" or eventType has its own _invoke(), and
+    handlers is a tuple of (handler, once, eid).
+
+    The result is kept until listeners change (see addListener() and
+    removeListener()).
+    """
+    valid = (self._eventMixin_events is True
+             or eventType in self._eventMixin_events)
+    entries = self._eventMixin_handlers.get(eventType, ())
+    fast = getattr(eventType, '_invoke', None) == Event._invoke
+    for (priority, handler, once, eid) in entries:
+      if once:
+        fast = False
+        break
+    if fast:
+      handlers = tuple((handler, eid)
+                       for (priority, handler, once, eid) in entries)
+    else:
+      handlers = tuple((handler, once, eid)
+                       for (priority, handler, once, eid) in entries)
+    compiled = (handlers, fast, valid)
+    self._eventMixin_compiled[eventType] = compiled
+    return compiled
 
   def raiseEventNoErrors (self, event, *args, **kw):
     """
@@ -246,62 +279,77 @@ class EventMixin (object):
     Returns the event object, unless it was never created (because there
     were no listeners) in which case returns None.
     """
-    self._eventMixin_init()
+    try:
+      compiled = self._eventMixin_compiled
+    except AttributeError:
+      self._eventMixin_init()
+      compiled = self._eventMixin_compiled
 
-    classCall = False
     if isinstance(event, Event):
       eventType = event.__class__
-      classCall = True
       if event.source is None: event.source = self
+      c = compiled.get(eventType)
+      if c is None: c = self._eventMixin_compile(eventType)
+      handlers, fast, valid = c
     elif issubclass(event, Event):
+      eventType = event
+      c = compiled.get(eventType)
+      if c is None: c = self._eventMixin_compile(eventType)
+      handlers, fast, valid = c
       # Check for early-out
-      if event not in self._eventMixin_handlers:
-        return None
-      if len(self._eventMixin_handlers[event]) == 0:
+      if not handlers:
         return None
 
-      classCall = True
-      eventType = event
       event = eventType(*args, **kw)
       args = ()
       kw = {}
       if event.source is None:
         event.source = self
     #print("raise",event,eventType)
-    if (self._eventMixin_events is not True
-        and eventType not in self._eventMixin_events):
+    if not valid:
       raise RuntimeError("Event %s not defined on object of type %s"
                          % (eventType, type(self)))
 
-    # Create a copy so that it can be modified freely during event
-    # processing.  It might make sense to change this.
-    handlers = self._eventMixin_handlers.get(eventType, [])
-    for (priority, handler, once, eid) in handlers:
-      if classCall:
-        rv = event._invoke(handler, *args, **kw)
-      else:
+    # handlers is a snapshot, so listeners can be changed freely during
+    # event processing.
+    if fast:
+      for (handler, eid) in handlers:
         rv = handler(event, *args, **kw)
-      if once: self.removeListener(eid)
-      if rv is None: continue
-      if rv is False:
-        self.removeListener(eid)
-      if rv is True:
-        if classCall: event.halt = True
-        break
-      if type(rv) == tuple:
-        if len(rv) >= 2 and rv[1] == True:
-          self.removeListener(eid)
-        if len(rv) >= 1 and rv[0]:
-          if classCall: event.halt = True
-          break
-        if len(rv) == 0:
-          if classCall: event.halt = True
-          break
-      #if classCall and hasattr(event, "halt") and event.halt:
-      if classCall and event.halt:
-        break
+        if rv is None: continue
+        if self._eventMixin_handle_return(event, rv, eid): break
+    else:
+      for (handler, once, eid) in handlers:
+        rv = event._invoke(handler, *args, **kw)
+        if once: self.removeListener(eid)
+        if rv is None: continue
+        if self._eventMixin_handle_return(event, rv, eid): break
     return event
 
+  def _eventMixin_handle_return (self, event, rv, eid):
+    """
+    Deals with a handler's (non-None) return value
+
+    Returns True if no further handlers should be called.
+    """
+    if rv is False:
+      self.removeListener(eid)
+    if rv is True:
+      event.halt = True
+      return True
+    if type(rv) == tuple:
+      if len(rv) >= 2 and rv[1] == True:
+        self.removeListener(eid)
+      if len(rv) >= 1 and rv[0]:
+        event.halt = True
+        return True
+      if len(rv) == 0:
+        event.halt = True
+        return True
+    #if hasattr(event, "halt") and event.halt:
+    if event.halt:
+      return True
+    return False
+
   def removeListeners (self, listeners):
     altered = False
     for l in listeners:
@@ -324,6 +372,7 @@ class EventMixin (object):
 
     #print("Remove listener", handlerOrEID)
     self._eventMixin_init()
+    self._eventMixin_compiled.clear()
     handler = handlerOrEID
 
     altered = False
@@ -434,6 +483,7 @@ class EventMixin (object):
 
     entry = (priority, handler, once, eid)
 
+    self._eventMixin_compiled.pop(eventType, None)
     handlers.append(entry)
     if priority is not None:
       # If priority is specified, sort the event handlers
@@ -468,6 +518,7 @@ class EventMixin (object):
     Remove all handlers from this object
     """
     self._eventMixin_handlers = {}
+    self._eventMixin_compiled = {}
 
 
 def autoBindEvents (sink, source, prefix='', weak=False, priority=None):
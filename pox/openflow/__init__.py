@@ -128,12 +128,32 @@ class RawStatsReply (Event):
     self.ofp = ofp     # Raw ofp message(s)
 
 class StatsReply (Event):
-  """ Abstract superclass for all stats replies """
-  def __init__ (self, connection, ofp, stats):
+  """
+  Abstract superclass for all stats replies
+
+  If stats is not given, it's built from the ofp message(s) when it's
+  first accessed (so stats bodies only get unpacked if someone looks).
+  """
+  def __init__ (self, connection, ofp, stats = None):
     Event.__init__(self)
     self.connection = connection
     self.ofp = ofp     # Raw ofp message(s)
-    self.stats = stats # Processed
+    self._stats = stats
+
+  @property
+  def stats (self):
+    """ Processed """
+    if self._stats is None:
+      if isinstance(self.ofp, list):
+        self._stats = []
+        for part in self.ofp:
+          self._stats.extend(part.body)
+      else:
+        self._stats = self.ofp.body
+    return self._stats
+  @stats.setter
+  def stats (self, stats):
+    self._stats = stats
 
 class SwitchDescReceived (StatsReply):
   pass
@@ -171,7 +191,7 @@ class PacketIn (Event):
 
   def parse (self):
     if self._parsed is None:
-      self._parsed = ethernet(self.data)
+      self._parsed = ethernet(self.data, lazy=True)
     return self._parsed
 
   @property
@@ -234,6 +254,25 @@ class BarrierIn (Event):
     self.dpid = connection.dpid
     self.xid = ofp.xid
 
+class ConnectionCongestion (Event):
+  """
+  Fired when a connection's send queue becomes congested or uncongested
+
+  Data which a switch's socket won't take right away is queued.  Once too
+  much is queued (see Connection.send_high_water), this is raised with
+  congested True.  Once the queue has drained enough (send_low_water),
+  it's raised again with congested False.  While a switch is congested,
+  components may want to avoid sending it anything nonessential.
+  congested (bool) - Whether the connection is now congested
+  queued (int) - Bytes waiting to be sent
+  """
+  def __init__ (self, connection, congested, queued):
+    Event.__init__(self)
+    self.connection = connection
+    self.dpid = connection.dpid
+    self.congested = congested
+    self.queued = queued
+
 class ConnectionIn (Event):
   def __init__ (self, connection):
     super(ConnectionIn,self).__init__()
@@ -314,6 +353,7 @@ class OpenFlowNexus (EventMixin):
     PortStatsReceived,
     QueueStatsReceived,
     FlowRemoved,
+    ConnectionCongestion,
   ])
 
   # Bytes to send to controller when a packet misses all flows
@@ -360,8 +400,29 @@ class OpenFlowNexus (EventMixin):
       except:
         pass
 
+  def addListener (self, *args, **kw):
+    r = EventMixin.addListener(self, *args, **kw)
+    self._listeners_changed()
+    return r
+
+  def removeListener (self, *args, **kw):
+    r = EventMixin.removeListener(self, *args, **kw)
+    self._listeners_changed()
+    return r
+
+  def clearHandlers (self):
+    EventMixin.clearHandlers(self)
+    self._listeners_changed()
+
+  def _listeners_changed (self):
+    # Connections decide which messages to bother with based on what's
+    # listening here (see of_01), so let them know.
+    for con in self._connections.values():
+      con._listeners_changed()
+
   def _connect (self, con):
     self._connections[con.dpid] = con
+    con._listeners_changed()
   def _disconnect (self, dpid):
     if dpid in self._connections:
       del self._connections[dpid]
@@ -29,17 +29,62 @@ Discovery module, or a Discovery superclass.
 from pox.lib.revent import *
 from pox.lib.recoco import Timer
 from pox.lib.util import dpid_to_str, str_to_bool
+from pox.lib.addresses import EthAddr
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 import pox.lib.packet as pkt
 
 import struct
 import time
-from collections import namedtuple
+import heapq
+from collections import namedtuple, deque
 from random import shuffle
 
 log = core.getLogger()
 
+# Constant parts of discovery packets
+_NDP_MULTICAST_RAW = pkt.ETHERNET.NDP_MULTICAST.toRaw()
+_LLDP_TYPE_RAW = struct.pack("!H", pkt.ethernet.LLDP_TYPE)
+_END_TLV = struct.pack("!H", pkt.lldp.END_TLV << 9)
+
+
+def _parse_discovery_packet (data):
+  """
+  Get (dpid, port) from a discovery packet like LLDPSender makes
+
+  Works on the raw frame.  Returns None if it's not quite like ours (in
+  which case, it might still be fine for the full LLDP parser).
+  """
+  if data[12:14] != _LLDP_TYPE_RAW: return None
+
+  # Chassis ID, port ID, TTL, system description
+  offset = 14
+  tlvs = []
+  try:
+    for i in range(4):
+      h, = struct.unpack_from("!H", data, offset)
+      end = offset + 2 + (h & 0x1ff)
+      if end > len(data): return None
+      tlvs.append((h >> 9, data[offset+2:end]))
+      offset = end
+  except struct.error:
+    return None
+
+  (chassis_type, chassis), (port_type, port), (ttl_type, ttl), \
+      (desc_type, desc) = tlvs
+  if chassis_type != pkt.lldp.CHASSIS_ID_TLV: return None
+  if port_type != pkt.lldp.PORT_ID_TLV: return None
+  if ttl_type != pkt.lldp.TTL_TLV: return None
+  if desc_type != pkt.lldp.SYSTEM_DESC_TLV: return None
+  if not desc.startswith('dpid:'): return None
+  if ord(port[:1] or '\0') != pkt.port_id.SUB_PORT: return None
+  port = port[1:]
+  if not port.isdigit(): return None
+  try:
+    return int(desc[5:], 16), int(port)
+  except ValueError:
+    return None
+
 
 class LLDPSender (object):
   """
@@ -48,11 +93,8 @@ class LLDPSender (object):
 
   SendItem = namedtuple("LLDPSenderItem", ('dpid','port_num','packet'))
 
-  #NOTE: This class keeps the packets to send in a flat list, which makes
-  #      adding/removing them on switch join/leave or (especially) port
-  #      status changes relatively expensive. Could easily be improved.
-
-  def __init__ (self, send_cycle_time, ttl = 120):
+  def __init__ (self, send_cycle_time, ttl = 120, batch = False,
+                max_rate = None):
     """
     Initialize an LLDP packet sender
 
@@ -63,16 +105,32 @@ class LLDPSender (object):
     ttl is the time (in seconds) for which a receiving LLDP agent should
       consider the rest of the data to be valid.  We don't use this, but
       other LLDP agents might.  Can't be 0 (this means revoke).
+
+    batch sends all of a switch's discovery packets at once (in a single
+      write) instead of spreading them all out evenly.
+
+    max_rate, if set, is the most discovery packets per second to send on
+      average.  If it's too low to send everything in send_cycle_time,
+      cycles take longer (and links may time out).
     """
-    # Packets remaining to be sent in this cycle
-    self._this_cycle = []
+    # Packets to send.  dpid -> {port_num -> SendItem}
+    self._ports = {}
+    self._num_packets = 0
 
-    # Packets we've already sent in this cycle
-    self._next_cycle = []
+    # Keys (dpid,port_num) (or just dpid when batching) remaining to be
+    # sent in this cycle and ones we've already sent in this cycle.
+    # Deleted ports and switches are left in these until we come to them.
+    self._this_cycle = deque()
+    self._next_cycle = deque()
+    self._queued = set() # All keys in the above
 
     self._timer = None
     self._ttl = ttl
+    self._ttl_tlv = struct.pack("!HH", (pkt.lldp.TTL_TLV << 9) | 2, ttl)
     self._send_cycle_time = send_cycle_time
+    self._batch = batch
+    self._max_rate = max_rate
+    self._warned_rate = False
     core.listen_to_dependencies(self)
 
   def _handle_openflow_PortStatus (self, event):
@@ -98,52 +156,131 @@ class LLDPSender (object):
     self.del_switch(event.dpid)
 
   def del_switch (self, dpid, set_timer = True):
-    self._this_cycle = [p for p in self._this_cycle if p.dpid != dpid]
-    self._next_cycle = [p for p in self._next_cycle if p.dpid != dpid]
-    if set_timer: self._set_timer()
+    ports = self._ports.pop(dpid, None)
+    if ports:
+      self._num_packets -= len(ports)
+      if set_timer: self._set_timer()
 
   def del_port (self, dpid, port_num, set_timer = True):
     if port_num > of.OFPP_MAX: return
-    self._this_cycle = [p for p in self._this_cycle
-                        if p.dpid != dpid or p.port_num != port_num]
-    self._next_cycle = [p for p in self._next_cycle
-                        if p.dpid != dpid or p.port_num != port_num]
+    ports = self._ports.get(dpid)
+    if ports is None or port_num not in ports: return
+    del ports[port_num]
+    self._num_packets -= 1
+    if not ports: del self._ports[dpid]
     if set_timer: self._set_timer()
 
   def add_port (self, dpid, port_num, port_addr, set_timer = True):
     if port_num > of.OFPP_MAX: return
-    self.del_port(dpid, port_num, set_timer = False)
-    self._next_cycle.append(LLDPSender.SendItem(dpid, port_num,
-          self.create_discovery_packet(dpid, port_num, port_addr)))
+    ports = self._ports.get(dpid)
+    if ports is None:
+      ports = self._ports[dpid] = {}
+    if port_num not in ports: self._num_packets += 1
+    ports[port_num] = LLDPSender.SendItem(dpid, port_num,
+          self.create_discovery_packet(dpid, port_num, port_addr))
+    key = dpid if self._batch else (dpid, port_num)
+    if key not in self._queued:
+      self._queued.add(key)
+      self._next_cycle.append(key)
     if set_timer: self._set_timer()
 
+  def _is_current (self, key):
+    """
+    Is a key from the cycle queues for something we still send?
+    """
+    if self._batch: return key in self._ports
+    ports = self._ports.get(key[0])
+    return ports is not None and key[1] in ports
+
   def _set_timer (self):
     if self._timer: self._timer.cancel()
     self._timer = None
-    num_packets = len(self._this_cycle) + len(self._next_cycle)
-    if num_packets != 0:
-      self._timer = Timer(self._send_cycle_time / float(num_packets),
-                          self._timer_handler, recurring=True)
+    num_packets = self._num_packets
+    if num_packets == 0: return
+
+    # How many sends are there per cycle?
+    num_sends = len(self._ports) if self._batch else num_packets
+    interval = self._send_cycle_time / float(num_sends)
+    if self._max_rate:
+      # Keep the average rate under max_rate
+      min_interval = num_packets / float(num_sends) / self._max_rate
+      if min_interval > interval:
+        interval = min_interval
+        if not self._warned_rate:
+          self._warned_rate = True
+          log.warn("Discovery packet rate limit means sending all of them "
+                   "takes more than %s seconds", self._send_cycle_time)
+    self._timer = Timer(interval, self._timer_handler, recurring=True)
 
   def _timer_handler (self):
     """
     Called by a timer to actually send packets.
 
-    Picks the first packet off this cycle's list, sends it, and then puts
-    it on the next-cycle list.  When this cycle's list is empty, starts
-    the next cycle.
+    Picks the first key off this cycle's queue, sends its packet(s), and
+    then puts it on the next-cycle queue.  When this cycle's queue is
+    empty, starts the next cycle.  Keys for things which have been
+    removed are just dropped when we come to them.
+    """
+    while True:
+      if len(self._this_cycle) == 0:
+        if len(self._next_cycle) == 0: return
+        keys = list(self._next_cycle)
+        self._next_cycle.clear()
+        shuffle(keys)
+        self._this_cycle.extend(keys)
+      key = self._this_cycle.popleft()
+      if self._is_current(key): break
+      self._queued.discard(key)
+
+    self._next_cycle.append(key)
+    if self._batch:
+      self._send(key, [item.packet for item in self._ports[key].itervalues()])
+    else:
+      self._send(key[0], [self._ports[key[0]][key[1]].packet])
+
+  def _send (self, dpid, packets):
+    """
+    Send some discovery packets to a switch (all at once)
     """
-    if len(self._this_cycle) == 0:
-      self._this_cycle = self._next_cycle
-      self._next_cycle = []
-      shuffle(self._this_cycle)
-    item = self._this_cycle.pop(0)
-    self._next_cycle.append(item)
-    core.openflow.sendToDPID(item.dpid, item.packet)
+    con = core.openflow.getConnection(dpid)
+    if con is None: return
+    if len(packets) == 1:
+      con.send(packets[0])
+    else:
+      con.send_many(packets)
 
   def create_discovery_packet (self, dpid, port_num, port_addr):
     """
     Build discovery packet
+
+    This makes exactly what _build_discovery_packet() does, but it fills
+    in the few fields which differ between packets directly instead of
+    building and packing packet objects.
+    """
+    desc = 'dpid:%x' % (dpid,)
+    port_id = str(port_num)
+    if not isinstance(port_addr, EthAddr): port_addr = EthAddr(port_addr)
+
+    data = ''.join((
+        _NDP_MULTICAST_RAW, port_addr.toRaw(), _LLDP_TYPE_RAW,
+        struct.pack("!HB", (pkt.lldp.CHASSIS_ID_TLV << 9) | (len(desc) + 1),
+                    pkt.chassis_id.SUB_LOCAL), desc,
+        struct.pack("!HB", (pkt.lldp.PORT_ID_TLV << 9) | (len(port_id) + 1),
+                    pkt.port_id.SUB_PORT), port_id,
+        self._ttl_tlv,
+        struct.pack("!H", (pkt.lldp.SYSTEM_DESC_TLV << 9) | len(desc)), desc,
+        _END_TLV))
+
+    # ofp_packet_out with a single ofp_action_output
+    return struct.pack("!BBHLLHHHHHH", of.OFP_VERSION, of.OFPT_PACKET_OUT,
+                       24 + len(data), of.generate_xid(), of.NO_BUFFER,
+                       of.OFPP_NONE, 8, of.OFPAT_OUTPUT, 8, port_num, 0) + data
+
+  def _build_discovery_packet (self, dpid, port_num, port_addr):
+    """
+    Build discovery packet out of packet objects
+
+    create_discovery_packet() makes the same thing faster.
     """
 
     chassis_id = pkt.chassis_id(subtype=pkt.chassis_id.SUB_LOCAL)
@@ -192,6 +329,21 @@ class LinkEvent (Event):
     return None
 
 
+class LinksChanged (Event):
+  """
+  Some links came up and/or went down
+
+  This is raised once for a bunch of links which changed at the same time
+  (e.g., all the links which timed out together), after the individual
+  LinkEvents for them.  It's handy if you do a lot of work whenever links
+  change.
+  """
+  def __init__ (self, added, removed):
+    Event.__init__(self)
+    self.added = added     # List of Links which came up
+    self.removed = removed # List of Links which went down
+
+
 class Discovery (EventMixin):
   """
   Component that attempts to discover network toplogy.
@@ -205,6 +357,7 @@ class Discovery (EventMixin):
 
   _eventMixin_events = set([
     LinkEvent,
+    LinksChanged,
   ])
 
   _core_name = "openflow_discovery" # we want to be core.openflow_discovery
@@ -212,14 +365,22 @@ class Discovery (EventMixin):
   Link = namedtuple("Link",("dpid1","port1","dpid2","port2"))
 
   def __init__ (self, install_flow = True, explicit_drop = True,
-                link_timeout = None, eat_early_packets = False):
+                link_timeout = None, eat_early_packets = False,
+                lldp_batch = False, lldp_max_rate = None):
     self._eat_early_packets = eat_early_packets
     self._explicit_drop = explicit_drop
     self._install_flow = install_flow
     if link_timeout: self._link_timeout = link_timeout
 
     self.adjacency = {} # From Link to time.time() stamp
-    self._sender = LLDPSender(self.send_cycle_time)
+
+    # Links in the order they could time out.  (expires_at, Link)
+    # When a link's time comes, it goes back in with a later time if it
+    # has been seen since.  Links which are already gone are just dropped.
+    self._expiry_heap = []
+    self._expiry_queued = set() # Links in _expiry_heap
+    self._sender = LLDPSender(self.send_cycle_time, batch = lldp_batch,
+                              max_rate = lldp_max_rate)
 
     # Listen with a high priority (mostly so we get PacketIns early)
     core.listen_to_dependencies(self,
@@ -255,8 +416,20 @@ class Discovery (EventMixin):
     """
     now = time.time()
 
-    expired = [link for link,timestamp in self.adjacency.iteritems()
-               if timestamp + self._link_timeout < now]
+    expired = []
+    heap = self._expiry_heap
+    while heap and heap[0][0] < now:
+      link = heapq.heappop(heap)[1]
+      timestamp = self.adjacency.get(link)
+      if timestamp is not None:
+        expires_at = timestamp + self._link_timeout
+        if expires_at >= now:
+          # Seen since it went in
+          heapq.heappush(heap, (expires_at, link))
+          continue
+        expired.append(link)
+      self._expiry_queued.discard(link)
+
     if expired:
       for link in expired:
         log.info('link timeout: %s.%i -> %s.%i' %
@@ -270,10 +443,7 @@ class Discovery (EventMixin):
     Receive and process LLDP packets
     """
 
-    packet = event.parsed
-
-    if (packet.effective_ethertype != pkt.ethernet.LLDP_TYPE
-        or packet.dst != pkt.ETHERNET.NDP_MULTICAST):
+    if not self._is_discovery_packet(event):
       if not self._eat_early_packets: return
       if not event.connection.connect_time: return
       enable_time = time.time() - self.send_cycle_time - 1
@@ -289,22 +459,77 @@ class Discovery (EventMixin):
         msg.in_port = event.port
         event.connection.send(msg)
 
+    r = _parse_discovery_packet(event.data)
+    if r is None:
+      # Not exactly what we send; do it the hard way
+      r = self._parse_lldp(event)
+      if r is None: return EventHalt
+    originatorDPID,originatorPort = r
+
+    if originatorDPID not in core.openflow.connections:
+      log.info('Received LLDP packet from unknown switch')
+      return EventHalt
+
+    if (event.dpid, event.port) == (originatorDPID, originatorPort):
+      log.warning("Port received its own LLDP packet; ignoring")
+      return EventHalt
+
+    link = Discovery.Link(originatorDPID, originatorPort, event.dpid,
+                          event.port)
+
+    now = time.time()
+    if link not in self.adjacency:
+      self.adjacency[link] = now
+      self._schedule_expiry(link, now)
+      log.info('link detected: %s.%i -> %s.%i' %
+               (dpid_to_str(link.dpid1), link.port1,
+                dpid_to_str(link.dpid2), link.port2))
+      self.raiseEventNoErrors(LinkEvent, True, link)
+      self.raiseEventNoErrors(LinksChanged, [link], [])
+    else:
+      # Just update timestamp
+      self.adjacency[link] = now
+
+    return EventHalt # Probably nobody else needs this event
+
+  def _is_discovery_packet (self, event):
+    """
+    Is this PacketIn an LLDP packet sent to the discovery address?
+
+    This gets called for every PacketIn before anyone else sees it, and
+    most aren't LLDP, so we try not to parse the packet.
+    """
+    data = event.data
+    if data[:6] != _NDP_MULTICAST_RAW: return False
+    if data[12:14] == _LLDP_TYPE_RAW: return True
+    # Maybe it's in a VLAN or something
+    packet = event.parsed
+    return packet.effective_ethertype == pkt.ethernet.LLDP_TYPE
+
+  def _parse_lldp (self, event):
+    """
+    Find the originating (dpid, port) in any sort of LLDP packet
+
+    Returns None (and logs why) if it can't.
+    """
+    packet = event.parsed
+
     lldph = packet.find(pkt.lldp)
     if lldph is None or not lldph.parsed:
       log.error("LLDP packet could not be parsed")
-      return EventHalt
+      return None
     if len(lldph.tlvs) < 3:
       log.error("LLDP packet without required three TLVs")
-      return EventHalt
+      return None
     if lldph.tlvs[0].tlv_type != pkt.lldp.CHASSIS_ID_TLV:
       log.error("LLDP packet TLV 1 not CHASSIS_ID")
-      return EventHalt
+      return None
     if lldph.tlvs[1].tlv_type != pkt.lldp.PORT_ID_TLV:
       log.error("LLDP packet TLV 2 not PORT_ID")
-      return EventHalt
+      return None
     if lldph.tlvs[2].tlv_type != pkt.lldp.TTL_TLV:
       log.error("LLDP packet TLV 3 not TTL")
-      return EventHalt
+      return None
 
     def lookInSysDesc ():
       r = None
@@ -350,16 +575,12 @@ class Discovery (EventMixin):
 
     if originatorDPID == None:
       log.warning("Couldn't find a DPID in the LLDP packet")
-      return EventHalt
-
-    if originatorDPID not in core.openflow.connections:
-      log.info('Received LLDP packet from unknown switch')
-      return EventHalt
+      return None
 
     # Get port number from port TLV
     if lldph.tlvs[1].subtype != pkt.port_id.SUB_PORT:
       log.warning("Thought we found a DPID, but packet didn't have a port")
-      return EventHalt
+      return None
     originatorPort = None
     if lldph.tlvs[1].id.isdigit():
       # We expect it to be a decimal value
@@ -373,31 +594,21 @@ class Discovery (EventMixin):
     if originatorPort is None:
       log.warning("Thought we found a DPID, but port number didn't " +
                   "make sense")
-      return EventHalt
+      return None
 
-    if (event.dpid, event.port) == (originatorDPID, originatorPort):
-      log.warning("Port received its own LLDP packet; ignoring")
-      return EventHalt
+    return originatorDPID, originatorPort
 
-    link = Discovery.Link(originatorDPID, originatorPort, event.dpid,
-                          event.port)
-
-    if link not in self.adjacency:
-      self.adjacency[link] = time.time()
-      log.info('link detected: %s.%i -> %s.%i' %
-               (dpid_to_str(link.dpid1), link.port1,
-                dpid_to_str(link.dpid2), link.port2))
-      self.raiseEventNoErrors(LinkEvent, True, link)
-    else:
-      # Just update timestamp
-      self.adjacency[link] = time.time()
-
-    return EventHalt # Probably nobody else needs this event
+  def _schedule_expiry (self, link, now):
+    if link in self._expiry_queued: return
+    self._expiry_queued.add(link)
+    heapq.heappush(self._expiry_heap, (now + self._link_timeout, link))
 
   def _delete_links (self, links):
+    if not links: return
     for link in links:
       del self.adjacency[link]
       self.raiseEventNoErrors(LinkEvent, False, link)
+    self.raiseEventNoErrors(LinksChanged, [], list(links))
 
   def is_edge_port (self, dpid, port):
     """
@@ -412,12 +623,16 @@ class Discovery (EventMixin):
 
 
 def launch (no_flow = False, explicit_drop = True, link_timeout = None,
-            eat_early_packets = False):
+            eat_early_packets = False, lldp_batch = False,
+            lldp_max_rate = None):
   explicit_drop = str_to_bool(explicit_drop)
   eat_early_packets = str_to_bool(eat_early_packets)
   install_flow = not str_to_bool(no_flow)
   if link_timeout: link_timeout = int(link_timeout)
+  lldp_batch = str_to_bool(lldp_batch)
+  if lldp_max_rate: lldp_max_rate = float(lldp_max_rate)
 
   core.registerNew(Discovery, explicit_drop=explicit_drop,
                    install_flow=install_flow, link_timeout=link_timeout,
-                   eat_early_packets=eat_early_packets)
+                   eat_early_packets=eat_early_packets,
+                   lldp_batch=lldp_batch, lldp_max_rate=lldp_max_rate)
@@ -0,0 +1,277 @@
+# Copyright 2013 James McCauley
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Sends flow mods in batches, each followed by a single barrier
+
+Lots of components want to send some flow mods and then find out when
+the switch has them in place (or why it couldn't), which means sending
+a barrier and then watching for the BarrierIn (and ErrorIns) with the
+right XID.  This component does that for them.  Messages sent with
+send() are queued per switch; once the current batch of work is done
+(or a batch gets big), each switch's queue goes out followed by one
+barrier.  send() returns a FlowBatch which says how it went:
+
+  batch = core.openflow_flow_batcher.send(dpid, flow_mod)
+  batch.add_callback(lambda batch: log.info("ok: %s", batch.ok))
+
+From a recoco Task, you can also wait for it:
+
+  batch = yield batch.wait()
+
+Messages aren't packed until the batch is sent, so don't change them
+after passing them to send().
+
+All messages in a batch get the batch's XID (which is also the barrier's
+XID), so an error for any of them fails the whole batch.  Everything
+sent in the same batch shares that fate, even if it came from different
+callers.
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import BlockingOperation, Timer
+from pox.lib.util import dpid_to_str
+import time
+
+log = core.getLogger()
+
+
+class FlowBatch (object):
+  """
+  Messages sent to a switch together, followed by a barrier
+
+  done is True once the barrier has come back, an error has come back,
+  the switch has gone away, or the switch has taken too long (see
+  FlowBatcher.batch_timeout).  error is the ErrorIn event if there was
+  one.
+  """
+  def __init__ (self, dpid):
+    self.dpid = dpid
+    self.xid = None # Set when sent
+    self.done = False
+    self.error = None
+    self.disconnected = False
+    self.timed_out = False
+    self.created_at = time.time()
+    self.sent_at = None
+    self.finished_at = None
+    self._msgs = []
+    self._callbacks = []
+
+  @property
+  def ok (self):
+    """
+    True if the switch finished everything without an error
+    """
+    return (self.done and self.error is None and not self.disconnected
+            and not self.timed_out)
+
+  @property
+  def size (self):
+    return len(self._msgs)
+
+  def add_callback (self, callback):
+    """
+    Calls callback(batch) when done (right away if it already is)
+    """
+    if self.done:
+      callback(self)
+    else:
+      self._callbacks.append(callback)
+
+  def wait (self):
+    """
+    Returns a blocking operation which a recoco Task can yield
+
+    The task resumes (with this batch as the value) when it's done.
+    """
+    return _WaitOnBatch(self)
+
+  def _finish (self):
+    self.done = True
+    self.finished_at = time.time()
+    self._msgs = None
+    callbacks = self._callbacks
+    self._callbacks = None
+    for callback in callbacks:
+      try:
+        callback(self)
+      except:
+        log.exception("Exception in flow batch callback")
+
+  def __repr__ (self):
+    if self.ok: state = "ok"
+    elif self.error: state = "error"
+    elif self.disconnected: state = "disconnected"
+    elif self.timed_out: state = "timed out"
+    else: state = "pending"
+    return "<FlowBatch %s xid:%s %s>" % (dpid_to_str(self.dpid), self.xid,
+                                        state)
+
+
+class _WaitOnBatch (BlockingOperation):
+  def __init__ (self, batch):
+    self._batch = batch
+
+  def execute (self, task, scheduler):
+    def wake (batch):
+      task.rv = batch
+      scheduler.fast_schedule(task)
+    self._batch.add_callback(wake)
+
+
+class FlowBatcher (object):
+  """
+  Queues messages for switches and sends them in barrier-terminated
+  batches
+
+  stats counts messages and batches sent, and batches finished ok, with
+  errors, because the switch disconnected, or because the barrier never
+  came back (timed_out).  setup_time is the total time from queueing to
+  the barrier coming back for the ok batches (so stats['messages'] over
+  it gives a flow setup rate).
+  """
+  _core_name = "openflow_flow_batcher"
+
+  # Most messages to send in one batch
+  max_batch = 1000
+
+  # Seconds to wait for a batch's barrier before giving up on it
+  batch_timeout = 30
+
+  def __init__ (self):
+    self._queued = {} # dpid -> FlowBatch not sent yet
+    self._pending = {} # (dpid,xid) -> FlowBatch sent, awaiting barrier
+    self._flush_scheduled = False
+    self.stats = {
+      'messages' : 0,
+      'batches' : 0,
+      'ok' : 0,
+      'errors' : 0,
+      'disconnected' : 0,
+      'timed_out' : 0,
+      'setup_time' : 0.0,
+    }
+    core.listen_to_dependencies(self)
+
+  def send (self, dpid, msgs):
+    """
+    Queues a message or list of messages for the switch
+
+    dpid can also be a Connection.  Returns the FlowBatch they'll go out
+    in.
+    """
+    if not isinstance(dpid, (int, long)):
+      dpid = dpid.dpid
+    if not isinstance(msgs, list):
+      msgs = [msgs]
+
+    batch = self._queued.get(dpid)
+    if batch is None:
+      batch = FlowBatch(dpid)
+      self._queued[dpid] = batch
+      if not self._flush_scheduled:
+        self._flush_scheduled = True
+        self._schedule_flush()
+    batch._msgs.extend(msgs)
+    if len(batch._msgs) >= self.max_batch:
+      self._send_batch(self._queued.pop(dpid))
+    return batch
+
+  def _schedule_flush (self):
+    core.callLater(self.flush)
+
+  def flush (self):
+    """
+    Sends everything queued right away
+    """
+    self._flush_scheduled = False
+    queued = self._queued
+    self._queued = {}
+    for batch in queued.itervalues():
+      self._send_batch(batch)
+
+  def _send_batch (self, batch):
+    con = core.openflow.getConnection(batch.dpid)
+    if con is None:
+      batch.disconnected = True
+      self.stats['disconnected'] += 1
+      batch._finish()
+      return
+
+    xid = of.generate_xid()
+    batch.xid = xid
+    msgs = batch._msgs
+    for msg in msgs:
+      msg.xid = xid
+    batch.sent_at = time.time()
+    self._pending[(batch.dpid, xid)] = batch
+    self.stats['messages'] += len(msgs)
+    self.stats['batches'] += 1
+    con.send_many(msgs + [of.ofp_barrier_request(xid = xid)])
+
+  def expire_pending (self, now = None):
+    """
+    Gives up on batches whose barriers haven't come back in time
+
+    Generally this is just called periodically by a Timer (see launch()).
+    """
+    if now is None: now = time.time()
+    cutoff = now - self.batch_timeout
+    expired = [k for k,b in self._pending.iteritems() if b.sent_at < cutoff]
+    for key in expired:
+      batch = self._pending.pop(key)
+      log.warning("Barrier for batch to %s timed out", dpid_to_str(key[0]))
+      batch.timed_out = True
+      self.stats['timed_out'] += 1
+      batch._finish()
+
+  def _handle_openflow_BarrierIn (self, event):
+    batch = self._pending.pop((event.dpid, event.xid), None)
+    if batch is None: return
+    self.stats['ok'] += 1
+    batch._finish()
+    self.stats['setup_time'] += batch.finished_at - batch.created_at
+
+  def _handle_openflow_ErrorIn (self, event):
+    dpid = event.connection.dpid
+    batch = self._pending.pop((dpid, event.xid), None)
+    if batch is None: return
+    event.should_log = False
+    log.debug("Error in batch for %s: %s", dpid_to_str(dpid),
+              event.asString())
+    batch.error = event
+    self.stats['errors'] += 1
+    batch._finish()
+
+  def _handle_openflow_ConnectionDown (self, event):
+    dpid = event.dpid
+    batches = [b for k,b in self._pending.iteritems() if k[0] == dpid]
+    queued = self._queued.pop(dpid, None)
+    if queued is not None: batches.append(queued)
+    for batch in batches:
+      self._pending.pop((dpid, batch.xid), None)
+      batch.disconnected = True
+      self.stats['disconnected'] += 1
+      batch._finish()
+
+
+def launch ():
+  if not core.hasComponent(FlowBatcher._core_name):
+    batcher = core.registerNew(FlowBatcher)
+    Timer(1, batcher.expire_pending, recurring=True)
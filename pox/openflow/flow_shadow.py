@@ -0,0 +1,339 @@
+# Copyright 2013 James McCauley
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Keeps a shadow of each switch's flow table and fixes it up on reconnect
+
+Normally, switches have their tables cleared when they connect (see
+OpenFlowNexus.clear_flows_on_connect), and then components install
+whatever they want again.  When a switch reconnects after a hiccup, that
+means dropping traffic and a big burst of flow mods.
+
+With this component, every flow_mod object sent to a switch is applied to
+a FlowTable kept for it, and entries are taken back out when the switch
+says they've been removed.  The first time a switch connects it's still
+cleared, but when it reconnects, we ask it for its flows and send only
+what it takes to make them match the shadow:
+ * Permanent entries it's missing are added back
+ * Entries whose actions differ are modified
+ * Permanent entries we don't know about are deleted
+If the switch can't tell us its flows, we clear it and send everything in
+the shadow again.
+
+Entries with timeouts can't really be tracked (we don't see the traffic
+that keeps them alive), so they're handled loosely.  Ones we know about
+but the switch doesn't have are assumed to have expired, and ones the
+switch has but we don't know about are left to expire on their own.
+Shadow entries are also thrown out once they might have timed out.
+
+Flow mods sent as raw bytes aren't seen, so they don't end up in the
+shadow.
+"""
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.flow_table import SwitchFlowTable, TableEntry
+from pox.openflow.flow_table import _match_values
+from pox.lib.recoco import Timer
+from pox.lib.util import dpid_to_str, str_to_bool
+import struct
+import threading
+import time
+
+log = core.getLogger()
+
+# How often to throw out shadow entries which may have timed out (seconds)
+PURGE_INTERVAL = 30
+
+
+def _normalize (match):
+  """
+  Copies match, wildcarding the fields a switch ignores
+
+  Switches don't report back matches quite the way we sent them (e.g.,
+  they leave IP fields unwildcarded in non-IP matches since they're
+  ignored anyway), so everything in the shadow is normalized like this
+  before being stored or compared.
+  """
+  m = match.clone()
+  wildcards = m._unwire_wildcards(m.wildcards & of.OFPFW_ALL)
+  m.__dict__['wildcards'] = m._normalize_wildcards(wildcards)
+  return m
+
+def _entry_key (match, priority):
+  """
+  Dictionary key for an entry with the given (normalized) match
+  """
+  return _match_values(match) + (priority,)
+
+
+class ShadowFlowTable (SwitchFlowTable):
+  """
+  What we think is in a switch's flow table
+
+  Flow mods are recorded by whatever thread sends them, so anything that
+  changes or looks through the table holds its lock.
+  """
+  def __init__ (self):
+    SwitchFlowTable.__init__(self)
+    self.lock = threading.RLock()
+
+  def record_flow_mod (self, flow_mod):
+    """
+    Updates the table for a flow_mod being sent to the switch
+    """
+    with self.lock:
+      self._record_flow_mod(flow_mod)
+
+  def _record_flow_mod (self, flow_mod):
+    match = _normalize(flow_mod.match)
+    if flow_mod.command == of.OFPFC_ADD:
+      # Like process_flow_mod(), but we don't check for overlaps; if there
+      # is one, the switch sends an error and we forget the entry then.
+      self.remove_matching_entries(match, flow_mod.priority, strict=True)
+      entry = TableEntry.from_flow_mod(flow_mod)
+      entry.match = match
+      entry.buffer_id = None
+      self.add_entry(entry)
+    else:
+      # A modify may act as an add, so everything an entry gets from a
+      # flow_mod comes along (except the buffer and the overlap check,
+      # as above)
+      flags = flow_mod.flags & ~of.OFPFF_CHECK_OVERLAP
+      flow_mod = of.ofp_flow_mod(command=flow_mod.command, match=match,
+                                 priority=flow_mod.priority,
+                                 out_port=flow_mod.out_port,
+                                 cookie=flow_mod.cookie,
+                                 idle_timeout=flow_mod.idle_timeout,
+                                 hard_timeout=flow_mod.hard_timeout,
+                                 flags=flags,
+                                 actions=flow_mod.actions)
+      self.process_flow_mod(flow_mod)
+
+  def forget (self, match, priority):
+    """
+    Removes the entry for a match and priority reported by the switch
+    """
+    match = _normalize(match)
+    with self.lock:
+      self.remove_matching_entries(match, priority, strict=True)
+
+  def remove_expired_entries (self, now=None):
+    with self.lock:
+      return SwitchFlowTable.remove_expired_entries(self, now)
+
+  def diff (self, flow_stats):
+    """
+    Figures out how to make a switch with the given flows match the shadow
+
+    Returns (adds, modifies, deletes, forget), where the first three are
+    lists of flow mods to send and forget is a list of our entries which
+    the switch doesn't have any more (and which should be removed).
+    Callers should hold the lock until they've removed them.
+    """
+    want = {}
+    with self.lock:
+      for entry in self.entries:
+        want[_entry_key(entry.match, entry.priority)] = entry
+
+    adds = []
+    modifies = []
+    deletes = []
+    forget = []
+    seen = set()
+    for stats in flow_stats:
+      key = _entry_key(_normalize(stats.match), stats.priority)
+      entry = want.get(key)
+      if entry is None:
+        if stats.idle_timeout or stats.hard_timeout: continue
+        deletes.append(of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT,
+                                       match=stats.match,
+                                       priority=stats.priority))
+        continue
+      seen.add(key)
+      if entry.actions != stats.actions:
+        modifies.append(of.ofp_flow_mod(command=of.OFPFC_MODIFY_STRICT,
+                                        match=entry.match,
+                                        priority=entry.priority,
+                                        actions=entry.actions))
+
+    for key,entry in want.iteritems():
+      if key in seen: continue
+      if entry.idle_timeout or entry.hard_timeout:
+        forget.append(entry)
+        continue
+      adds.append(of.ofp_flow_mod(match=entry.match,
+                                  priority=entry.priority,
+                                  cookie=entry.cookie,
+                                  flags=entry.flags,
+                                  actions=entry.actions))
+
+    return adds, modifies, deletes, forget
+
+
+class FlowShadow (object):
+  """
+  Keeps a ShadowFlowTable for each switch and reconciles it on reconnect
+
+  stats counts reconciliations and the entries they added, modified,
+  deleted, and forgot.  reconcile_time is the total time from asking for
+  flows to the switch finishing the changes.
+  """
+  _core_name = "openflow_flow_shadow"
+
+  def __init__ (self):
+    self.tables = {} # dpid -> ShadowFlowTable
+    self._reconciling = {} # dpid -> (stats request xid, start time)
+    self._finishing = {} # (dpid, barrier xid) -> start time
+    # Whether to clear switches the first time they connect (None means
+    # to do whatever OpenFlowNexus.clear_flows_on_connect says)
+    self.clear_on_first_connect = None
+    self.stats = {
+      'reconciles' : 0,
+      'added' : 0,
+      'modified' : 0,
+      'deleted' : 0,
+      'forgotten' : 0,
+      'reconcile_time' : 0.0,
+    }
+    # We want to have the table in place before anyone else sends flow
+    # mods for a new connection
+    core.listen_to_dependencies(self,
+                                listen_args={'openflow':{'priority':1000}})
+
+  def _all_dependencies_met (self):
+    # We'll take care of clearing tables from now on
+    if self.clear_on_first_connect is None:
+      self.clear_on_first_connect = core.openflow.clear_flows_on_connect
+    core.openflow.clear_flows_on_connect = False
+
+  def purge (self):
+    """
+    Throws out shadow entries which may have timed out
+    """
+    for table in self.tables.itervalues():
+      table.remove_expired_entries()
+
+  def _handle_openflow_ConnectionUp (self, event):
+    con = event.connection
+    table = self.tables.get(event.dpid)
+    if table is None:
+      table = self.tables[event.dpid] = ShadowFlowTable()
+      con.flow_shadow = table
+      if self.clear_on_first_connect:
+        con.send(of.ofp_flow_mod(match=of.ofp_match(),
+                                 command=of.OFPFC_DELETE))
+      return
+
+    con.flow_shadow = table
+    table.remove_expired_entries()
+    sr = of.ofp_stats_request(body=of.ofp_flow_stats_request())
+    con.send(sr)
+    self._reconciling[event.dpid] = (sr.xid, time.time())
+
+  def _handle_openflow_ConnectionDown (self, event):
+    self._reconciling.pop(event.dpid, None)
+    for key in [k for k in self._finishing if k[0] == event.dpid]:
+      del self._finishing[key]
+
+  def _handle_openflow_FlowStatsReceived (self, event):
+    con = event.connection
+    r = self._reconciling.get(con.dpid)
+    if r is None or event.ofp[0].xid != r[0]: return
+    del self._reconciling[con.dpid]
+    table = self.tables[con.dpid]
+
+    with table.lock:
+      adds, modifies, deletes, forget = table.diff(event.stats)
+      table.remove_entries(forget)
+    self.stats['reconciles'] += 1
+    self.stats['added'] += len(adds)
+    self.stats['modified'] += len(modifies)
+    self.stats['deleted'] += len(deletes)
+    self.stats['forgotten'] += len(forget)
+    log.debug("Reconciling %s: %i to add, %i to modify, %i to delete",
+              dpid_to_str(con.dpid), len(adds), len(modifies), len(deletes))
+
+    # Deletes go first so there's room for the adds.  The shadow already
+    # has all of this, so it's sent packed (which the shadow doesn't see).
+    barrier = of.ofp_barrier_request()
+    msgs = deletes + modifies + adds + [barrier]
+    con.send_many([m.pack() for m in msgs])
+    self._finishing[(con.dpid, barrier.xid)] = r[1]
+
+  def _handle_openflow_BarrierIn (self, event):
+    start = self._finishing.pop((event.dpid, event.xid), None)
+    if start is None: return
+    elapsed = time.time() - start
+    self.stats['reconcile_time'] += elapsed
+    log.info("Reconciled %s in %0.2f seconds", dpid_to_str(event.dpid),
+             elapsed)
+
+  def _handle_openflow_FlowRemoved (self, event):
+    table = self.tables.get(event.dpid)
+    if table is None: return
+    table.forget(event.ofp.match, event.ofp.priority)
+
+  def _handle_openflow_ErrorIn (self, event):
+    con = event.connection
+    r = self._reconciling.get(con.dpid)
+    if r is not None and event.xid == r[0]:
+      # Can't get its flows, so clear it and put back everything we think
+      # should be there (including whatever other components have sent
+      # since it connected).  The shadow stays as it is.
+      del self._reconciling[con.dpid]
+      table = self.tables[con.dpid]
+      with table.lock:
+        adds = [entry.to_flow_mod() for entry in table.entries]
+      log.warning("Couldn't get flows from %s; reinstalling %i entries",
+                  dpid_to_str(con.dpid), len(adds))
+      self.stats['reconciles'] += 1
+      self.stats['added'] += len(adds)
+      barrier = of.ofp_barrier_request()
+      msgs = [of.ofp_flow_mod(match=of.ofp_match(), command=of.OFPFC_DELETE)]
+      msgs += adds + [barrier]
+      con.send_many([m.pack() for m in msgs])
+      self._finishing[(con.dpid, barrier.xid)] = r[1]
+      return
+
+    # Flow mod errors have the start of the flow mod, which is enough to
+    # know which entry didn't get in
+    err = event.ofp
+    if err.type != of.OFPET_FLOW_MOD_FAILED: return
+    if len(err.data) < 64: return
+    table = self.tables.get(con.dpid)
+    if table is None: return
+    match = of.ofp_match()
+    match.unpack(err.data, 8)
+    priority = struct.unpack_from("!H", err.data, 62)[0]
+    table.forget(match, priority)
+
+
+def launch (clear_first_connect = None):
+  """
+  Starts keeping shadow flow tables
+
+  --clear_first_connect=False leaves whatever a switch has alone the first
+  time it connects (by default, this follows OpenFlowNexus'
+  clear_flows_on_connect).
+  """
+  if core.hasComponent(FlowShadow._core_name): return
+  shadow = core.registerNew(FlowShadow)
+  if clear_first_connect is not None:
+    shadow.clear_on_first_connect = str_to_bool(clear_first_connect)
+
+  Timer(PURGE_INTERVAL, shadow.purge, recurring=True)
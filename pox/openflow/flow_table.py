@@ -23,6 +23,9 @@ from libopenflow_01 import *
 from pox.lib.revent import *
 
 import time
+from bisect import bisect_left, insort
+from heapq import heappush, heappop, heapify
+from operator import itemgetter
 
 # FlowTable Entries:
 #   match - ofp_match (13-tuple)
@@ -92,6 +95,17 @@ class TableEntry (object):
     if now==None: now = time.time()
     return (self.hard_timeout > 0 and now - self.counters["created"] > self.hard_timeout) or (self.idle_timeout > 0 and now - self.counters["last_touched"] > self.idle_timeout)
 
+  def expiry_time(self):
+    """ return the time after which this entry expires unless it is touched again,
+    or None if it has no timeouts """
+    t = None
+    if self.hard_timeout > 0:
+      t = self.counters["created"] + self.hard_timeout
+    if self.idle_timeout > 0:
+      idle = self.counters["last_touched"] + self.idle_timeout
+      if t is None or idle < t: t = idle
+    return t
+
   def __str__ (self):
     return self.__class__.__name__ + "\n  " + self.show()
 
@@ -126,6 +140,101 @@ class FlowTableModification (Event):
     self.removed = removed
 
 
+# ofp_match fields other than nw_src/nw_dst (which can be prefixes)
+_match_fields = ('in_port', 'dl_src', 'dl_dst', 'dl_vlan', 'dl_vlan_pcp',
+                 'dl_type', 'nw_tos', 'nw_proto', 'tp_src', 'tp_dst')
+
+# (ofp_match attribute holding the value, wildcard bit) for each of them
+_match_field_bits = tuple([('_' + f, ofp_match_data[f][1])
+                           for f in _match_fields])
+
+def _match_values (match):
+  """
+  Returns (values, nw_src, nw_dst) for a match
+
+  values holds the match's value (or None if wildcarded) for each of
+  _match_fields.  nw_src and nw_dst are (address, prefix length) with
+  the address as an unsigned int, or (None, 0) if wildcarded.
+  """
+  # Same as getattr(match, f) for each field, but without going through
+  # ofp_match.__getattr__
+  d = match.__dict__
+  wildcards = d['wildcards']
+  values = tuple([None if wildcards & bit else d[attr]
+                  for attr,bit in _match_field_bits])
+  src,src_bits = match.get_nw_src()
+  dst,dst_bits = match.get_nw_dst()
+  src = (IPAddr(src).toUnsigned(),src_bits) if src is not None else (None,0)
+  dst = (IPAddr(dst).toUnsigned(),dst_bits) if dst is not None else (None,0)
+  return values, src, dst
+
+def _match_mask (values, src, dst):
+  """
+  The "shape" of a match: which fields it specifies and its prefix lengths
+  """
+  fields = tuple([i for i,v in enumerate(values) if v is not None])
+  return (fields, src[1], dst[1])
+
+def _prefix_mask (bits):
+  return ~((1 << (32-bits))-1) & 0xffFFffFF
+
+
+class _MaskGroup (object):
+  """
+  All the entries whose matches specify the same fields and prefix lengths
+
+  Entries are hashed by the values of the fields they specify, so finding
+  the entries in the group which match a packet is a dict lookup.  Each
+  bucket is a list of (order, entry) kept in table order.
+  """
+  def __init__ (self, mask):
+    self.mask = mask
+    self.fields, self.src_bits, self.dst_bits = mask
+    if len(self.fields) == 0:
+      self._get = lambda values: ()
+    else:
+      self._get = itemgetter(*self.fields)
+    self._src_mask = _prefix_mask(self.src_bits)
+    self._dst_mask = _prefix_mask(self.dst_bits)
+    self.buckets = {}
+    self.count = 0
+    # No entry in the group comes before this in table order.  It isn't
+    # raised when entries are removed, so it's only a bound.
+    self.best = None
+
+  def entry_key (self, values, src, dst):
+    """
+    Key for an entry with this group's mask
+    """
+    return (self._get(values), src[0], dst[0])
+
+  def packet_key (self, values, src, dst):
+    """
+    Key that entries in this group matching the given values would have
+
+    Returns None if nothing in this group can match.
+    """
+    if self.src_bits:
+      if src[0] is None or src[1] < self.src_bits: return None
+      s = src[0] & self._src_mask
+    else:
+      s = None
+    if self.dst_bits:
+      if dst[0] is None or dst[1] < self.dst_bits: return None
+      d = dst[0] & self._dst_mask
+    else:
+      d = None
+    return (self._get(values), s, d)
+
+  def covers (self, mask):
+    """
+    Could entries in this group be matched non-strictly by a match of mask?
+    """
+    fields, src_bits, dst_bits = mask
+    if self.src_bits < src_bits or self.dst_bits < dst_bits: return False
+    return set(fields).issubset(self.fields)
+
+
 class FlowTable (EventMixin):
   _eventMixin_events = set([FlowTableModification])
 
@@ -135,14 +244,32 @@ class FlowTable (EventMixin):
   """
   def __init__(self):
     EventMixin.__init__(self)
-    # For now we represent the table as a multidimensional array.
+    # The table is kept as a list of entries, sorted by descending
+    # priority with exact matches always going first (and in the order
+    # they were added for entries that tie).
     #
-    # [ (cookie, match, counters, actions),
-    #   (cookie, match, counters, actions),
-    #    ...                        ]
+    # For lookups, entries are also indexed by the shape of their match
+    # (see _MaskGroup), which is tuple space search: there's a hash table
+    # for each distinct wildcard mask, and the one for exact matches is
+    # just a dict keyed on all the fields.  Groups are searched in order
+    # of the best entry in them, so the search stops once no remaining
+    # group could have anything better than what's been found.
     #
-    # Implies O(N) lookup for now. TODO: fix
+    # Entries shouldn't have their match or priority changed while they
+    # are in the table.
     self._table = []
+    self._orders = [] # Sort key for each entry in _table
+    self._entry_info = {} # entry -> (order, group, key)
+    self._groups = {} # mask -> _MaskGroup
+    self._sorted_groups = None # _groups by best, or None if out of date
+    self._next_seq = 0
+
+    # Entries with timeouts are also kept in a heap of (expiry time,
+    # order, entry).  Touching an entry doesn't update the heap; instead,
+    # when an entry comes up, it's checked and pushed back if it has been
+    # touched since.  Removed entries are left in the heap and skipped.
+    self._expiry_heap = []
+    self._expiry_garbage = 0 # Removed entries still in the heap
 
   @property
   def entries(self):
@@ -154,20 +281,106 @@ class FlowTable (EventMixin):
   def add_entry(self, entry):
     if not isinstance(entry, TableEntry):
       raise "Not an Entry type"
-    self._table.append(entry)
-
-    # keep table sorted by descending priority, with exact matches always going first
-    # note: python sort is stable
-    self._table.sort(key=lambda(e): (e.priority if e.match.is_wildcarded else (1<<16) + 1), reverse=True)
-
+    self._add_entry(entry)
     self.raiseEvent(FlowTableModification(added=[entry]))
 
+  def _add_entry(self, entry):
+    if entry in self._entry_info:
+      # Already here (e.g., being re-added after a sync); take it out and
+      # file it again rather than indexing it twice
+      self._remove_entry(entry)
+
+    # table order: descending priority, with exact matches always going
+    # first, and otherwise in the order entries were added
+    self._next_seq += 1
+    rank = entry.priority if entry.match.is_wildcarded else (1<<16) + 1
+    order = (-rank, self._next_seq)
+    index = bisect_left(self._orders, order)
+    self._orders.insert(index, order)
+    self._table.insert(index, entry)
+
+    values, src, dst = _match_values(entry.match)
+    mask = _match_mask(values, src, dst)
+    group = self._groups.get(mask)
+    if group is None:
+      group = _MaskGroup(mask)
+      self._groups[mask] = group
+      self._sorted_groups = None
+    key = group.entry_key(values, src, dst)
+    bucket = group.buckets.get(key)
+    if bucket is None:
+      bucket = group.buckets[key] = []
+    insort(bucket, (order, entry))
+    group.count += 1
+    if group.best is None or order < group.best:
+      group.best = order
+      self._sorted_groups = None
+
+    self._entry_info[entry] = (order, group, key)
+
+    expires = entry.expiry_time()
+    if expires is not None:
+      heappush(self._expiry_heap, (expires, order, entry))
+
   def remove_entry(self, entry):
     if not isinstance(entry, TableEntry):
       raise "Not an Entry type"
-    self._table.remove(entry)
+    self._remove_entry(entry)
     self.raiseEvent(FlowTableModification(removed=[entry]))
 
+  def remove_entries(self, entries):
+    """ remove a bunch of entries at once (raising a single event) """
+    self._remove_entries(entries)
+    self.raiseEvent(FlowTableModification(removed=entries))
+
+  def _remove_entries(self, entries):
+    if len(entries) < 64:
+      for entry in entries:
+        self._remove_entry(entry)
+      return
+    # Deleting from the middle of the table one at a time gets slow, so
+    # rebuild it instead
+    for entry in entries:
+      self._remove_entry(entry, unlist=False)
+    keep = [i for i,e in enumerate(self._table) if e in self._entry_info]
+    self._table = [self._table[i] for i in keep]
+    self._orders = [self._orders[i] for i in keep]
+
+  def _remove_entry(self, entry, unlist=True):
+    if entry not in self._entry_info:
+      raise ValueError("Entry not in table")
+    order, group, key = self._entry_info.pop(entry)
+    if unlist:
+      index = bisect_left(self._orders, order)
+      del self._orders[index]
+      del self._table[index]
+
+    bucket = group.buckets[key]
+    bucket.remove((order, entry))
+    if not bucket:
+      del group.buckets[key]
+    group.count -= 1
+    if group.count == 0:
+      del self._groups[group.mask]
+      self._sorted_groups = None
+
+    if entry.hard_timeout > 0 or entry.idle_timeout > 0:
+      self._expiry_garbage += 1
+      if self._expiry_garbage > len(self._expiry_heap) / 2:
+        # Mostly dead; rebuild it
+        self._expiry_heap = [x for x in self._expiry_heap
+                             if self._in_table(x[2], x[1])]
+        heapify(self._expiry_heap)
+        self._expiry_garbage = 0
+
+  def _in_table(self, entry, order):
+    """ is this entry (still) in the table with the given order? """
+    info = self._entry_info.get(entry)
+    return info is not None and info[0] == order
+
+  def _order_of(self, entry):
+    return self._entry_info[entry][0]
+
   def entries_for_port(self, port_no):
     entries = []
     for entry in self._table:
@@ -181,25 +394,76 @@ class FlowTable (EventMixin):
     return entries
 
   def matching_entries(self, match, priority=0, strict=False, out_port=None):
-    return [ entry for entry in self._table if entry.is_matched_by(match, priority, strict, out_port) ]
+    values, src, dst = _match_values(match)
+    mask = _match_mask(values, src, dst)
+    if strict:
+      # Only entries with exactly this match can be strictly matched
+      group = self._groups.get(mask)
+      if group is None: return []
+      bucket = group.buckets.get(group.entry_key(values, src, dst), ())
+      return [ entry for order,entry in bucket if entry.is_matched_by(match, priority, strict, out_port) ]
+
+    # Only groups whose entries specify everything match does can be
+    # matched, so skip the rest
+    candidates = []
+    for group in self._groups.itervalues():
+      if not group.covers(mask): continue
+      for bucket in group.buckets.itervalues():
+        candidates.extend(bucket)
+    candidates.sort(key=itemgetter(0))
+    return [ entry for order,entry in candidates if entry.is_matched_by(match, priority, strict, out_port) ]
 
   def flow_stats(self, match, out_port=None, now=None):
     return ( e.flow_stats() for e in self.matching_entries(match=match, strict=False, out_port=out_port))
 
+  def _expired_entries(self, now, remove):
+    """ find expired entries using the expiry heap, removing them if remove is set.
+    Only entries which might have expired are looked at. """
+    if now is None: now = time.time()
+    heap = self._expiry_heap
+    expired = []
+    requeue = []
+    while heap and heap[0][0] <= now:
+      expires, order, entry = heappop(heap)
+      if not self._in_table(entry, order):
+        self._expiry_garbage -= 1
+        continue
+      if entry.is_expired(now):
+        expired.append(entry)
+        if not remove: requeue.append((expires, order, entry))
+      else:
+        # It's been touched since it was queued (or it's right on the edge)
+        requeue.append((entry.expiry_time(), order, entry))
+    for x in requeue:
+      heappush(heap, x)
+
+    expired.sort(key=self._order_of) # Table order
+    if remove:
+      # They've already been popped, but _remove_entry() will count them
+      self._expiry_garbage -= len(expired)
+      self._remove_entries(expired)
+    return expired
+
   def expired_entries(self, now=None):
-    return [ entry for entry in self._table if entry.is_expired(now) ]
+    return self._expired_entries(now, remove=False)
+
+  def next_expiry_time(self):
+    """ return the earliest time at which an entry might expire, or None.
+    Entries may have been touched since, so nothing may actually expire then. """
+    heap = self._expiry_heap
+    while heap and not self._in_table(heap[0][2], heap[0][1]):
+      heappop(heap)
+      self._expiry_garbage -= 1
+    return heap[0][0] if heap else None
 
   def remove_expired_entries(self, now=None):
-    remove_flows = self.expired_entries(now)
-    for entry in remove_flows:
-        self._table.remove(entry)
+    remove_flows = self._expired_entries(now, remove=True)
     self.raiseEvent(FlowTableModification(removed=remove_flows))
     return remove_flows
 
-  def remove_matching_entries(self, match, priority=0, strict=False):
-    remove_flows = self.matching_entries(match, priority, strict)
-    for entry in remove_flows:
-        self._table.remove(entry)
+  def remove_matching_entries(self, match, priority=0, strict=False, out_port=None):
+    remove_flows = self.matching_entries(match, priority, strict, out_port)
+    self._remove_entries(remove_flows)
     self.raiseEvent(FlowTableModification(removed=remove_flows))
     return remove_flows
 
@@ -207,12 +471,33 @@ class FlowTable (EventMixin):
     """ return the highest priority flow table entry that matches the given packet
     on the given in_port, or None if no matching entry is found. """
     packet_match = ofp_match.from_packet(packet, in_port)
-
-    for entry in self._table:
-      if entry.match.matches_with_wildcards(packet_match, consider_other_wildcards=False):
-        return entry
-    else:
-      return None
+    return self.entry_for_match(packet_match)
+
+  def entry_for_match(self, packet_match):
+    """ return the highest priority flow table entry that matches the given
+    (exact) match of a packet, or None if no matching entry is found. """
+    values, src, dst = _match_values(packet_match)
+
+    groups = self._sorted_groups
+    if groups is None:
+      groups = sorted(self._groups.itervalues(), key=lambda g: g.best)
+      self._sorted_groups = groups
+
+    found = None
+    found_order = None
+    for group in groups:
+      if found is not None and group.best > found_order:
+        # Nothing left can come before what we've got
+        break
+      key = group.packet_key(values, src, dst)
+      if key is None: continue
+      bucket = group.buckets.get(key)
+      if bucket is None: continue
+      order, entry = bucket[0]
+      if found is None or order < found_order:
+        found = entry
+        found_order = order
+    return found
 
 
 class SwitchFlowTable(FlowTable):
@@ -227,9 +512,6 @@ class SwitchFlowTable(FlowTable):
     """
     if(flow_mod.flags & OFPFF_CHECK_OVERLAP):
       raise NotImplementedError("OFPFF_CHECK_OVERLAP checking not implemented")
-    if(flow_mod.out_port != OFPP_NONE and
-       flow_mod.command == ofp_flow_mod_command_rev_map['OFPFC_DELETE']):
-      raise NotImplementedError("flow_mod outport checking not implemented")
 
     if flow_mod.command == OFPFC_ADD:
       # exactly matching entries have to be removed
@@ -237,12 +519,10 @@ class SwitchFlowTable(FlowTable):
       return ("added", self.add_entry(TableEntry.from_flow_mod(flow_mod)))
     elif flow_mod.command == OFPFC_MODIFY or flow_mod.command == OFPFC_MODIFY_STRICT:
       is_strict = (flow_mod.command == OFPFC_MODIFY_STRICT)
-      modified = []
-      for entry in self._table:
+      modified = self.matching_entries(flow_mod.match, priority=flow_mod.priority, strict=is_strict)
+      for entry in modified:
         # update the actions field in the matching flows
-        if(entry.is_matched_by(flow_mod.match, priority=flow_mod.priority, strict=is_strict)):
-          entry.actions = flow_mod.actions
-          modified.append(entry)
+        entry.actions = flow_mod.actions
       if(len(modified) == 0):
         # if no matching entry is found, modify acts as add
         return ("added", self.add_entry(TableEntry.from_flow_mod(flow_mod)))
@@ -251,6 +531,7 @@ class SwitchFlowTable(FlowTable):
 
     elif flow_mod.command == OFPFC_DELETE or flow_mod.command == OFPFC_DELETE_STRICT:
       is_strict = (flow_mod.command == OFPFC_DELETE_STRICT)
-      return ("removed", self.remove_matching_entries(flow_mod.match, flow_mod.priority, strict=True))
+      out_port = flow_mod.out_port if flow_mod.out_port != OFPP_NONE else None
+      return ("removed", self.remove_matching_entries(flow_mod.match, flow_mod.priority, strict=is_strict, out_port=out_port))
     else:
       raise AttributeError("Command not yet implemented: %s" % flow_mod.command)
@@ -89,7 +89,12 @@ def _read (data, offset, length):
   if (len(data)-offset) < length:
     raise UnderrunError("wanted %s bytes but only have %s"
                         % (length, len(data)-offset))
-  return (offset+length, data[offset:offset+length])
+  d = data[offset:offset+length]
+  if type(d) is memoryview:
+    # We may be unpacking straight out of a receive buffer which will get
+    # reused, so never hand out views into it.
+    d = d.tobytes()
+  return (offset+length, d)
 
 def _unpack (fmt, data, offset):
   size = struct.calcsize(fmt)
@@ -185,6 +190,27 @@ class ofp_base (object):
     assert (r-offset) == length, o
     return (r, o)
 
+  # Set to True if unpack() takes a "lazy" argument (see unpack_new_lazy())
+  _lazy_unpack = False
+
+  @classmethod
+  def unpack_new_lazy (cls, raw, offset=0):
+    """
+    Like unpack_new(), but may leave variable-length bodies packed
+
+    Classes which support it keep the raw bytes of things like port lists
+    and stats bodies around and only unpack them into objects the first
+    time they're actually accessed.  Until then, pack() just reuses the
+    raw bytes.  Classes which don't support it are unpacked normally.
+
+    Returns newoffset,object
+    """
+    if not cls._lazy_unpack: return cls.unpack_new(raw, offset)
+    o = cls()
+    r,length = o.unpack(raw, offset, lazy=True)
+    assert (r-offset) == length, o
+    return (r, o)
+
 
 # ----------------------------------------------------------------------
 # Class decorators
@@ -945,6 +971,108 @@ class ofp_match (ofp_base):
 
     return match
 
+  @classmethod
+  def from_raw (cls, data, in_port = None):
+    """
+    Constructs an exact match for the given raw Ethernet frame
+
+    This gives the same match as from_packet(ethernet(data), in_port),
+    but reads the fields straight out of the frame at fixed offsets
+    instead of building packet objects.  Frames which aren't that
+    simple (truncated or malformed headers, TCP options, which the
+    packet library checks) are handed to from_packet().
+
+    @param data    The frame (e.g., PacketIn.data)
+    @param in_port The switch port the frame arrived on if you want
+                   the resulting match to have its in_port set.
+    """
+    dlen = len(data)
+    if dlen < 14:
+      return cls.from_packet(ethernet(data), in_port)
+
+    dl_type, = struct.unpack_from("!H", data, 12)
+    if dl_type == 0x8100:
+      if dlen < 18:
+        return cls.from_packet(ethernet(data), in_port)
+      tci, dl_type = struct.unpack_from("!HH", data, 14)
+      dl_vlan = tci & 0x0fff
+      dl_vlan_pcp = tci >> 13
+      offset = 18
+    else:
+      dl_vlan = OFP_VLAN_NONE
+      dl_vlan_pcp = 0
+      offset = 14
+
+    # We set the fields and wildcards directly, starting from what
+    # __init__ would give us
+    match = cls.__new__(cls)
+    d = match.__dict__
+    d.update(_empty_match_fields)
+    wildcards = d['wildcards'] & ~(OFPFW_DL_SRC | OFPFW_DL_DST |
+                                    OFPFW_DL_TYPE | OFPFW_DL_VLAN |
+                                    OFPFW_DL_VLAN_PCP)
+    if in_port is not None:
+      d['_in_port'] = in_port
+      wildcards &= ~OFPFW_IN_PORT
+    d['_dl_dst'] = EthAddr(data[:6])
+    d['_dl_src'] = EthAddr(data[6:12])
+    d['_dl_type'] = dl_type
+    d['_dl_vlan'] = dl_vlan
+    d['_dl_vlan_pcp'] = dl_vlan_pcp
+
+    if dl_type == 0x0800:
+      if dlen - offset < 20:
+        return cls.from_packet(ethernet(data), in_port)
+      vhl, tos, iplen = struct.unpack_from("!BBH", data, offset)
+      hl = (vhl & 0x0f) * 4
+      if (vhl >> 4 != 4 or hl < 20 or iplen < 20 or hl >= iplen
+          or hl > dlen - offset):
+        return cls.from_packet(ethernet(data), in_port)
+      nw_proto = ord(data[offset + 9])
+      d['_nw_tos'] = tos
+      d['_nw_proto'] = nw_proto
+      d['_nw_src'] = IPAddr(data[offset + 12:offset + 16])
+      d['_nw_dst'] = IPAddr(data[offset + 16:offset + 20])
+      wildcards &= ~(OFPFW_NW_TOS | OFPFW_NW_PROTO | OFPFW_NW_SRC_MASK |
+                     OFPFW_NW_DST_MASK)
+
+      # Transport ports are only set if the packet library could parse
+      # the transport header
+      tp = offset + hl
+      tp_len = min(iplen, dlen - offset) - hl
+      ports = None
+      if nw_proto == 6:
+        if tp_len >= 20:
+          tcp_hl = (ord(data[tp + 12]) >> 4) * 4
+          if tcp_hl == 20:
+            ports = struct.unpack_from("!HH", data, tp)
+          elif 20 < tcp_hl <= tp_len:
+            return cls.from_packet(ethernet(data), in_port)
+      elif nw_proto == 17:
+        if tp_len >= 8:
+          ports = struct.unpack_from("!HH", data, tp)
+      elif nw_proto == 1:
+        if tp_len >= 4:
+          ports = struct.unpack_from("!BB", data, tp)
+      if ports is not None:
+        d['_tp_src'], d['_tp_dst'] = ports
+        wildcards &= ~(OFPFW_TP_SRC | OFPFW_TP_DST)
+
+    elif dl_type == 0x0806:
+      if dlen - offset < 28:
+        return cls.from_packet(ethernet(data), in_port)
+      protolen, opcode = struct.unpack_from("!BH", data, offset + 5)
+      if protolen != 4:
+        return cls.from_packet(ethernet(data), in_port)
+      if opcode <= 255:
+        d['_nw_proto'] = opcode
+        d['_nw_src'] = IPAddr(data[offset + 14:offset + 18])
+        d['_nw_dst'] = IPAddr(data[offset + 24:offset + 28])
+        wildcards &= ~(OFPFW_NW_PROTO | OFPFW_NW_SRC_MASK | OFPFW_NW_DST_MASK)
+
+    d['wildcards'] = wildcards
+    return match
+
   def optimize (self):
     """
     Reduce the number of wildcards used.
@@ -977,10 +1105,9 @@ class ofp_match (ofp_base):
     return self # for chaining
 
   def clone (self):
-    n = ofp_match()
-    for k,v in ofp_match_data.iteritems():
-      setattr(n, '_' + k, getattr(self, '_' + k))
-    n.wildcards = self.wildcards
+    # Everything in here is immutable, so a shallow copy will do
+    n = ofp_match.__new__(ofp_match)
+    n.__dict__.update(self.__dict__)
     return n
 
   def flip (self):
@@ -2012,6 +2139,7 @@ class ofp_action_vendor_generic (ofp_action_base):
     reply_to="ofp_features_request")
 class ofp_features_reply (ofp_header):
   _MIN_LENGTH = 32
+  _lazy_unpack = True
   def __init__ (self, **kw):
     ofp_header.__init__(self)
     self.datapath_id = 0
@@ -2022,7 +2150,24 @@ class ofp_features_reply (ofp_header):
     self.ports = []
     
     initHelper(self, kw)
-  
+
+  @property
+  def ports (self):
+    if self._ports_raw is not None:
+      # Lazily unpacked; do it now
+      raw = self._ports_raw
+      self._ports = []
+      for offset in xrange(0, len(raw), len(ofp_phy_port)):
+        p = ofp_phy_port()
+        p.unpack(raw, offset)
+        self._ports.append(p)
+      self._ports_raw = None
+    return self._ports
+  @ports.setter
+  def ports (self, ports):
+    self._ports = ports
+    self._ports_raw = None
+
   def pack (self):
     assert self._assert()
 
@@ -2032,26 +2177,35 @@ class ofp_features_reply (ofp_header):
                           self.n_tables)
     packed += _PAD3
     packed += struct.pack("!LL", self.capabilities, self.actions)
-    for i in self.ports:
-      packed += i.pack()
+    if self._ports_raw is not None:
+      packed += self._ports_raw
+    else:
+      for i in self.ports:
+        packed += i.pack()
     return packed
 
-  def unpack (self, raw, offset=0):
+  def unpack (self, raw, offset=0, lazy=False):
     offset,length = self._unpack_header(raw, offset)
     offset,(self.datapath_id, self.n_buffers, self.n_tables) = \
         _unpack("!QLB", raw, offset)
     offset = _skip(raw, offset, 3)
     offset,(self.capabilities, self.actions) = _unpack("!LL", raw, offset)
     portCount = (length - 32) / len(ofp_phy_port)
-    self.ports = []
-    for i in xrange(0, portCount):
-      p = ofp_phy_port()
-      offset = p.unpack(raw, offset)
-      self.ports.append(p)
+    if lazy:
+      offset,self._ports_raw = _read(raw, offset,
+                                     portCount * len(ofp_phy_port))
+    else:
+      self.ports = []
+      for i in xrange(0, portCount):
+        p = ofp_phy_port()
+        offset = p.unpack(raw, offset)
+        self.ports.append(p)
     assert length == len(self)
     return offset,length
 
   def __len__ (self):
+    if self._ports_raw is not None:
+      return 32 + len(self._ports_raw)
     return 32 + len(self.ports) * len(ofp_phy_port)
 
   def __eq__ (self, other):
@@ -2532,6 +2686,7 @@ class ofp_stats_request (ofp_header):
     reply_to="ofp_stats_request")
 class ofp_stats_reply (ofp_header):
   _MIN_LENGTH = 12
+  _lazy_unpack = True
   def __init__ (self, **kw):
     ofp_header.__init__(self)
     self.type = None # Guess
@@ -2541,6 +2696,18 @@ class ofp_stats_reply (ofp_header):
 
     initHelper(self, kw)
 
+  @property
+  def body (self):
+    if self._body_raw is not None:
+      # Lazily unpacked; do it now
+      self._body = self._unpack_body(self._body_raw)
+      self._body_raw = None
+    return self._body
+  @body.setter
+  def body (self, body):
+    self._body = body
+    self._body_raw = None
+
   @property
   def is_last_reply (self):
     return (self.flags & 1) == 0
@@ -2552,6 +2719,8 @@ class ofp_stats_reply (ofp_header):
 
   @property
   def body_data (self):
+    if self._body_raw is not None:
+      return self._body_raw
     if self._body_data[0] is not self.body:
       def _pack(b):
         return b.pack() if hasattr(b, 'pack') else b
@@ -2581,37 +2750,43 @@ class ofp_stats_reply (ofp_header):
     packed += self.body_data
     return packed
 
-  def unpack (self, raw, offset=0):
+  def unpack (self, raw, offset=0, lazy=False):
     offset,length = self._unpack_header(raw, offset)
     offset,(self.type, self.flags) = _unpack("!HH", raw, offset)
     offset,packed = _read(raw, offset, length - 12)
-    t = _stats_type_to_class_info.get(self.type)
-    if t is None:
-      #FIXME: Put in a generic container?
-      self.body = packed
+    if lazy:
+      self._body_raw = packed
     else:
-      if t.reply is None:
-        #FIXME: Put in a generic container?
-        self.body = packed
-      else:
-        if not t.reply_is_list:
-          self.body = t.reply()
-          self.body.unpack(packed, 0, len(packed))
-        else:
-          prev_len = len(packed)
-          self.body = []
-          while len(packed):
-            part = t.reply()
-            off = part.unpack(packed, 0, len(packed))
-            packed = packed[off:]
-            assert len(packed) != prev_len
-            prev_len = len(packed)
-            self.body.append(part)
+      self.body = self._unpack_body(packed)
 
     assert length == len(self)
     return offset,length
 
+  def _unpack_body (self, packed):
+    t = _stats_type_to_class_info.get(self.type)
+    if t is None:
+      #FIXME: Put in a generic container?
+      return packed
+    if t.reply is None:
+      #FIXME: Put in a generic container?
+      return packed
+    if not t.reply_is_list:
+      body = t.reply()
+      body.unpack(packed, 0, len(packed))
+      return body
+    body = []
+    offset = 0
+    while offset < len(packed):
+      part = t.reply()
+      off = part.unpack(packed, offset, len(packed) - offset)
+      assert off != offset
+      offset = off
+      body.append(part)
+    return body
+
   def __len__ (self):
+    if self._body_raw is not None:
+      return 12 + len(self._body_raw)
     if isinstance(self.body, list):
       return 12 + sum(len(part) for part in self.body)
     return 12 + len(self.body)
@@ -4028,7 +4203,7 @@ class ofp_vendor_generic (ofp_vendor_base):
     offset,(self.vendor,) = _unpack("!L", raw, offset)
     offset,self.data = _read(raw, offset, length-12)
     if self._collect_raw:
-      self.raw = raw[_offset, _offset+length]
+      self.raw = _read(raw, _offset, length)[1]
     return offset,length
 
   def __len__ (self):
@@ -4309,3 +4484,6 @@ ofp_match_data = {
   'tp_src' : (0, OFPFW_TP_SRC),
   'tp_dst' : (0, OFPFW_TP_DST),
 }
+
+# The attributes of a fresh ofp_match (for ofp_match.from_raw())
+_empty_match_fields = dict(ofp_match().__dict__)
@@ -36,30 +36,21 @@ log = core.getLogger()
 
 import socket
 import select
+import threading
 
 # List where the index is an OpenFlow message type (OFPT_xxx), and
 # the values are unpack functions that unpack the wire format of that
 # type into a message object.
 unpackers = make_type_to_unpacker_table()
 
-try:
-  PIPE_BUF = select.PIPE_BUF
-except:
-  try:
-    # Try to get it from where PyPy (sometimes) has it
-    import IN
-    PIPE_BUF = IN.PIPE_BUF
-  except:
-    # (Hopefully) reasonable default
-    PIPE_BUF = 512
-
 import pox.openflow.libopenflow_01 as of
 
-import threading
 import os
 import sys
 import exceptions
 from errno import EAGAIN, ECONNRESET
+from collections import deque
+from contextlib import contextmanager
 
 
 import traceback
@@ -109,6 +100,7 @@ def handle_FEATURES_REPLY (con, msg):
     con.disconnect()
     return
   con.ofnexus = nexus
+  con._listeners_changed()
   con.ofnexus._connect(con)
   #connections[con.dpid] = con
 
@@ -166,13 +158,16 @@ def handle_STATS_REPLY (con, msg):
   con._incoming_stats_reply(msg)
 
 def handle_PORT_STATUS (con, msg): #A
+  handle_PORT_STATUS_quiet(con, msg)
+  e = con.ofnexus.raiseEventNoErrors(PortStatus, con, msg)
+  if e is None or e.halt != True:
+    con.raiseEventNoErrors(PortStatus, con, msg)
+
+def handle_PORT_STATUS_quiet (con, msg):
   if msg.reason == of.OFPPR_DELETE:
     con.ports._forget(msg.desc)
   else:
     con.ports._update(msg.desc)
-  e = con.ofnexus.raiseEventNoErrors(PortStatus, con, msg)
-  if e is None or e.halt != True:
-    con.raiseEventNoErrors(PortStatus, con, msg)
 
 def handle_PACKET_IN (con, msg): #A
   e = con.ofnexus.raiseEventNoErrors(PacketIn, con, msg)
@@ -185,8 +180,11 @@ def handle_ERROR_MSG (con, msg): #A
   if e is None or e.halt != True:
     con.raiseEventNoErrors(err)
   if err.should_log:
-    log.error(str(con) + " OpenFlow Error:\n" +
-              msg.show(str(con) + " Error: ").strip())
+    handle_ERROR_MSG_quiet(con, msg)
+
+def handle_ERROR_MSG_quiet (con, msg):
+  log.error(str(con) + " OpenFlow Error:\n" +
+            msg.show(str(con) + " Error: ").strip())
 
 def handle_BARRIER (con, msg):
   e = con.ofnexus.raiseEventNoErrors(BarrierIn, con, msg)
@@ -194,50 +192,37 @@ def handle_BARRIER (con, msg):
     con.raiseEventNoErrors(BarrierIn, con, msg)
 
 # handlers for stats replies
+# (The events build their stats from the parts when they're asked for)
 def handle_OFPST_DESC (con, parts):
-  msg = parts[0].body
-  e = con.ofnexus.raiseEventNoErrors(SwitchDescReceived,con,parts[0],msg)
+  e = con.ofnexus.raiseEventNoErrors(SwitchDescReceived, con, parts[0])
   if e is None or e.halt != True:
-    con.raiseEventNoErrors(SwitchDescReceived, con, parts[0], msg)
+    con.raiseEventNoErrors(SwitchDescReceived, con, parts[0])
 
 def handle_OFPST_FLOW (con, parts):
-  msg = []
-  for part in parts:
-    msg.extend(part.body)
-  e = con.ofnexus.raiseEventNoErrors(FlowStatsReceived, con, parts, msg)
+  e = con.ofnexus.raiseEventNoErrors(FlowStatsReceived, con, parts)
   if e is None or e.halt != True:
-    con.raiseEventNoErrors(FlowStatsReceived, con, parts, msg)
+    con.raiseEventNoErrors(FlowStatsReceived, con, parts)
 
 def handle_OFPST_AGGREGATE (con, parts):
-  msg = parts[0].body
   e = con.ofnexus.raiseEventNoErrors(AggregateFlowStatsReceived, con,
-                                     parts[0], msg)
+                                     parts[0])
   if e is None or e.halt != True:
-    con.raiseEventNoErrors(AggregateFlowStatsReceived, con, parts[0], msg)
+    con.raiseEventNoErrors(AggregateFlowStatsReceived, con, parts[0])
 
 def handle_OFPST_TABLE (con, parts):
-  msg = []
-  for part in parts:
-    msg.extend(part.body)
-  e = con.ofnexus.raiseEventNoErrors(TableStatsReceived, con, parts, msg)
+  e = con.ofnexus.raiseEventNoErrors(TableStatsReceived, con, parts)
   if e is None or e.halt != True:
-    con.raiseEventNoErrors(TableStatsReceived, con, parts, msg)
+    con.raiseEventNoErrors(TableStatsReceived, con, parts)
 
 def handle_OFPST_PORT (con, parts):
-  msg = []
-  for part in parts:
-    msg.extend(part.body)
-  e = con.ofnexus.raiseEventNoErrors(PortStatsReceived, con, parts, msg)
+  e = con.ofnexus.raiseEventNoErrors(PortStatsReceived, con, parts)
   if e is None or e.halt != True:
-    con.raiseEventNoErrors(PortStatsReceived, con, parts, msg)
+    con.raiseEventNoErrors(PortStatsReceived, con, parts)
 
 def handle_OFPST_QUEUE (con, parts):
-  msg = []
-  for part in parts:
-    msg.extend(part.body)
-  e = con.ofnexus.raiseEventNoErrors(QueueStatsReceived, con, parts, msg)
+  e = con.ofnexus.raiseEventNoErrors(QueueStatsReceived, con, parts)
   if e is None or e.halt != True:
-    con.raiseEventNoErrors(QueueStatsReceived, con, parts, msg)
+    con.raiseEventNoErrors(QueueStatsReceived, con, parts)
 
 def handle_VENDOR (con, msg):
   log.info("Vendor msg: " + str(msg))
@@ -263,6 +248,23 @@ handlerMap = {
   of.OFPT_VENDOR : handle_VENDOR,
 }
 
+# The events raised by the handlers above, and what to use instead of
+# the handler when nothing on either the nexus or the Connection is
+# listening for any of them: a handler which skips raising the events,
+# or None to drop the message without unpacking it at all.
+# (See Connection._build_dispatch())
+quietHandlerMap = {
+  of.OFPT_PACKET_IN : ((PacketIn,), None),
+  of.OFPT_FLOW_REMOVED : ((FlowRemoved,), None),
+  of.OFPT_BARRIER_REPLY : ((BarrierIn,), None),
+  of.OFPT_PORT_STATUS : ((PortStatus,), handle_PORT_STATUS_quiet),
+  of.OFPT_ERROR : ((ErrorIn,), handle_ERROR_MSG_quiet),
+  of.OFPT_STATS_REPLY : ((RawStatsReply, SwitchDescReceived,
+                          FlowStatsReceived, AggregateFlowStatsReceived,
+                          TableStatsReceived, PortStatsReceived,
+                          QueueStatsReceived), None),
+}
+
 statsHandlerMap = {
   of.OFPST_DESC : handle_OFPST_DESC,
   of.OFPST_FLOW : handle_OFPST_FLOW,
@@ -272,113 +274,67 @@ statsHandlerMap = {
   of.OFPST_QUEUE : handle_OFPST_QUEUE,
 }
 
-# Deferred sending should be unusual, so don't worry too much about
-# efficiency
-class DeferredSender (threading.Thread):
+class PendingWrites (object):
   """
-  Class that handles sending when a socket write didn't complete
+  Keeps track of which Connections have data queued for sending
+
+  Connection.send() sends right away when it can and only queues what
+  the socket won't take.  The main I/O loop watches the Connections in
+  here for writability and flushes them.  It selects on the waker so
+  that it notices when a Connection gets added.
   """
   def __init__ (self):
-    # Threads, not recoco?
-    threading.Thread.__init__(self)
-    self._dataForConnection = {}
-    self._lock = threading.RLock()
-    self._waker = pox.lib.util.makePinger()
-    self.daemon = True
-    self.sending = False
-
-    self.start()
-
-  def _sliceup (self, data):
-    """
-    Takes an array of data bytes, and slices into elements of
-    PIPE_BUF bytes each
-    """
-    out = []
-    while len(data) > PIPE_BUF:
-      out.append(data[0:PIPE_BUF])
-      data = data[PIPE_BUF:]
-    if len(data) > 0:
-      out.append(data)
-    return out
-
-  def send (self, con, data):
-    with self._lock:
-      self.sending = True
-
-      data = self._sliceup(data)
-
-      if con not in self._dataForConnection:
-        self._dataForConnection[con] = data
-      else:
-        self._dataForConnection[con].extend(data)
-
-      self._waker.ping()
-
-  def kill (self, con):
-    with self._lock:
-      try:
-        del self._dataForConnection[con]
-      except:
-        pass
+    self.connections = set()
+    self.waker = pox.lib.util.makePinger()
+    self._pinged = False
 
-      self._waker.ping()
+  def add (self, con):
+    if con in self.connections: return
+    self.connections.add(con)
+    if not self._pinged:
+      self._pinged = True
+      self.waker.ping()
 
-  def run (self):
-    while core.running:
+  def discard (self, con):
+    self.connections.discard(con)
 
-      with self._lock:
-        cons = self._dataForConnection.keys()
+  def pong (self):
+    self._pinged = False
+    self.waker.pongAll()
 
-      rlist, wlist, elist = select.select([self._waker], cons, cons, 1)
-      if not core.running: break
+# Used by the Connection class below
+pendingWrites = PendingWrites()
 
-      with self._lock:
-        if len(rlist) > 0:
-          self._waker.pongAll()
 
-        for con in elist:
-          try:
-            del self._dataForConnection[con]
-          except:
-            pass
+class SendBatcher (object):
+  """
+  Holds sends made while the I/O loop handles one batch of received data
 
-        for con in wlist:
-          try:
-            alldata = self._dataForConnection[con]
-            while len(alldata):
-              data = alldata[0]
-              try:
-                l = con.sock.send(data)
-                if l != len(data):
-                  alldata[0] = data[l:]
-                  break
-                del alldata[0]
-              except socket.error as (errno, strerror):
-                if errno != EAGAIN:
-                  con.msg("DeferredSender/Socket error: " + strerror)
-                  con.disconnect()
-                  del self._dataForConnection[con]
-                break
-              except:
-                con.msg("Unknown error doing deferred sending")
-                break
-            if len(alldata) == 0:
-              try:
-                del self._dataForConnection[con]
-                if len(self._dataForConnection) == 0:
-                  self.sending = False
-                  break
-              except:
-                pass
-          except:
-            try:
-              del self._dataForConnection[con]
-            except:
-              pass
+  When active (see OpenFlow_01_Task's batch_sends), everything sent to a
+  switch while the loop is dispatching received messages is held and
+  then sent with a single send() per switch once the batch is done.
+  Only sends from the thread that began the batch are held; others go
+  out as usual.
+  """
+  def __init__ (self):
+    self.active = False
+    self.thread = None
+    self.connections = set()
+
+  def begin (self):
+    self.thread = threading.current_thread()
+    self.active = True
+
+  def end (self):
+    self.active = False
+    self.thread = None
+    cons = self.connections
+    self.connections = set()
+    for con in cons:
+      con._uncork()
 
 # Used by the Connection class below
-deferredSender = DeferredSender()
+sendBatcher = SendBatcher()
 
 class DummyOFNexus (object):
   def raiseEventNoErrors (self, event, *args, **kw):
@@ -587,11 +543,24 @@ class Connection (EventMixin):
     PortStatsReceived,
     QueueStatsReceived,
     FlowRemoved,
+    ConnectionCongestion,
   ])
   
   # Globally unique identifier for the Connection instance
   ID = 0
 
+  # Most bytes to ask for in a single recv().  The receive buffer starts
+  # out at twice this and only grows if a single message won't fit.
+  recv_size = 2048
+
+  # Once more than send_high_water bytes are queued for sending, the
+  # connection is congested until the queue drains to send_low_water.
+  send_high_water = 256 * 1024
+  send_low_water = 64 * 1024
+
+  # Most queued bytes to coalesce into a single send()
+  send_chunk_size = 64 * 1024
+
   def msg (self, m):
     #print str(self), m
     log.debug(str(self) + " " + str(m))
@@ -608,7 +577,12 @@ class Connection (EventMixin):
 
     self.ofnexus = _dummyOFNexus
     self.sock = sock
-    self.buf = ''
+    # Received data lives in buf[_buf_start:_buf_end].  The buffer is
+    # received into in place and messages are unpacked straight out of it,
+    # so a burst of messages doesn't cause any concatenating or slicing.
+    self.buf = bytearray(self.recv_size * 2)
+    self._buf_start = 0
+    self._buf_end = 0
     Connection.ID += 1
     self.ID = Connection.ID
     # TODO: dpid and features don't belong here; they should be eventually
@@ -619,6 +593,28 @@ class Connection (EventMixin):
     self.connect_time = None
     self.idle_time = time.time()
 
+    # If set, a table which gets every flow_mod object sent on this
+    # connection (see openflow.flow_shadow)
+    self.flow_shadow = None
+
+    # Data the socket wouldn't take yet (see send() and _flush())
+    self._send_queue = deque()
+    self._send_queued = 0
+    self.congested = False
+
+    # Data held while corked (see cork())
+    self._corked = 0
+    self._cork_buf = []
+
+    # send() may be called from threads other than the I/O loop (e.g., by
+    # the webservice or messenger), so everything touching the send state
+    # above holds this
+    self._send_lock = threading.RLock()
+
+    # Handler (or None) for each message type; see _build_dispatch()
+    self._dispatch = None
+    self._dispatch_generation = None
+
     self.send(of.ofp_hello())
 
     self.original_ports = PortCollection()
@@ -656,11 +652,11 @@ class Connection (EventMixin):
       self.ofnexus.raiseEventNoErrors(ConnectionDown, self)
       self.raiseEventNoErrors(ConnectionDown, self)
 
-    try:
-      #deferredSender.kill(self)
-      pass
-    except:
-      pass
+    with self._send_lock:
+      self._send_queue.clear()
+      self._send_queued = 0
+      del self._cork_buf[:]
+      pendingWrites.discard(self)
     try:
       self.sock.shutdown(socket.SHUT_RDWR)
     except:
@@ -677,6 +673,7 @@ class Connection (EventMixin):
 
     Data should probably either be raw bytes in OpenFlow wire format, or
     an OpenFlow controller-to-switch message object from libopenflow.
+    This may be called from any thread.
     """
     if self.disconnected: return
     if type(data) is not bytes:
@@ -684,26 +681,202 @@ class Connection (EventMixin):
       # ofp_header, but this check is likely to catch a lot of bugs,
       # so we check it anyway.
       assert isinstance(data, of.ofp_header)
+      if self.flow_shadow is not None and type(data) is of.ofp_flow_mod:
+        self.flow_shadow.record_flow_mod(data)
       data = data.pack()
 
-    if deferredSender.sending:
-      log.debug("deferred sender is sending!")
-      deferredSender.send(self, data)
-      return
+    with self._send_lock:
+      if self._corked:
+        self._cork_buf.append(data)
+        return
+      if (sendBatcher.active
+          and sendBatcher.thread is threading.current_thread()):
+        self._cork_buf.append(data)
+        sendBatcher.connections.add(self)
+        return
+
+      self._send(data)
+
+  def send_many (self, msgs):
+    """
+    Send a sequence of messages (or raw data) to the switch at once
+
+    This is the same as sending each of them, except that they all go
+    to the socket together.
+    """
+    with self.cork():
+      for msg in msgs:
+        self.send(msg)
+
+  @contextmanager
+  def cork (self):
+    """
+    Context manager which holds everything sent until it exits
+
+    On exit, all the held data is sent together with a single send().
+    Corks can be nested; data goes out when the outermost one exits.
+
+      with connection.cork():
+        connection.send(flow_mod)
+        connection.send(barrier)
+    """
+    with self._send_lock:
+      self._corked += 1
     try:
-      l = self.sock.send(data)
-      if l != len(data):
-        self.msg("Didn't send complete buffer.")
-        data = data[l:]
-        deferredSender.send(self, data)
-    except socket.error as (errno, strerror):
-      if errno == EAGAIN:
-        self.msg("Out of send buffer space.  " +
-                 "Consider increasing SO_SNDBUF.")
-        deferredSender.send(self, data)
+      yield self
+    finally:
+      with self._send_lock:
+        self._corked -= 1
+        if self._corked == 0:
+          self._uncork()
+
+  def _uncork (self):
+    with self._send_lock:
+      if self._corked or not self._cork_buf: return
+      if len(self._cork_buf) == 1:
+        data = self._cork_buf[0]
       else:
-        self.msg("Socket error: " + strerror)
-        self.disconnect()
+        data = b''.join(self._cork_buf)
+      del self._cork_buf[:]
+      if self.disconnected: return
+      self._send(data)
+
+  def _send (self, data):
+    with self._send_lock:
+      if self._send_queue:
+        # Stay in order behind what's already waiting
+        self._enqueue(data)
+        return
+      try:
+        l = self.sock.send(data)
+        if l != len(data):
+          self.msg("Didn't send complete buffer.")
+          self._enqueue(data[l:])
+      except socket.error as (errno, strerror):
+        if errno == EAGAIN:
+          self.msg("Out of send buffer space.  " +
+                   "Consider increasing SO_SNDBUF.")
+          self._enqueue(data)
+        else:
+          self.msg("Socket error: " + strerror)
+          self.disconnect()
+
+  def _enqueue (self, data):
+    with self._send_lock:
+      self._send_queue.append(data)
+      self._send_queued += len(data)
+      pendingWrites.add(self)
+      if not self.congested and self._send_queued > self.send_high_water:
+        self._set_congested(True)
+
+  def _set_congested (self, congested):
+    self.congested = congested
+    if congested:
+      self.msg("Congested (%s bytes queued)" % (self._send_queued,))
+    e = self.ofnexus.raiseEventNoErrors(ConnectionCongestion, self,
+                                        congested, self._send_queued)
+    if e is None or e.halt != True:
+      self.raiseEventNoErrors(ConnectionCongestion, self, congested,
+                              self._send_queued)
+
+  def _flush (self):
+    """
+    Send as much queued data as the socket will take
+
+    Small queued messages are coalesced so that each send() call carries
+    up to send_chunk_size bytes.  Generally this is just called by the
+    main OpenFlow loop below when the socket is writable.
+
+    Returns True if nothing is left queued.
+    """
+    with self._send_lock:
+      q = self._send_queue
+      while q:
+        if len(q) == 1 or len(q[0]) >= self.send_chunk_size:
+          data = q.popleft()
+        else:
+          chunk = []
+          size = 0
+          while q and size < self.send_chunk_size:
+            d = q.popleft()
+            chunk.append(d)
+            size += len(d)
+          data = b''.join(chunk)
+        try:
+          l = self.sock.send(data)
+        except socket.error as (errno, strerror):
+          if errno != EAGAIN:
+            self.msg("Socket error: " + strerror)
+            self.disconnect()
+            return True
+          l = 0
+        self._send_queued -= l
+        if l != len(data):
+          q.appendleft(data[l:])
+          break
+
+      if self.congested and self._send_queued <= self.send_low_water:
+        self._set_congested(False)
+      if q: return False
+      pendingWrites.discard(self)
+      return True
+
+  def addListener (self, *args, **kw):
+    r = EventMixin.addListener(self, *args, **kw)
+    self._listeners_changed()
+    return r
+
+  def removeListener (self, *args, **kw):
+    r = EventMixin.removeListener(self, *args, **kw)
+    self._listeners_changed()
+    return r
+
+  def clearHandlers (self):
+    EventMixin.clearHandlers(self)
+    self._listeners_changed()
+
+  def _listeners_changed (self):
+    """
+    Called when listeners are added or removed here or on our nexus
+    """
+    self._dispatch = None
+
+  def _build_dispatch (self):
+    """
+    Builds the table read() uses to find the handler for a message type
+
+    Message types whose events nobody is listening for (see
+    quietHandlerMap) get their quiet handler, or None if the message
+    can just be dropped.  The table is thrown away whenever listeners
+    change on this Connection or its nexus.
+    """
+    dispatch = handlers + [None] * (256 - len(handlers))
+    for ofp_type,(events,quiet) in quietHandlerMap.iteritems():
+      if _has_listeners(self, events): continue
+      if _has_listeners(self.ofnexus, events): continue
+      dispatch[ofp_type] = quiet
+    self._dispatch = dispatch
+    self._dispatch_generation = _handlers_generation
+    return dispatch
+
+  def _make_room (self):
+    """
+    Makes sure there's space for at least recv_size bytes after _buf_end
+
+    Unconsumed data is moved to the front of the buffer, and the buffer
+    is grown if that still doesn't leave enough room (which only happens
+    when a single message is larger than the buffer).
+    """
+    buf = self.buf
+    if len(buf) - self._buf_end >= self.recv_size: return
+    pending = self._buf_end - self._buf_start
+    if self._buf_start != 0:
+      buf[0:pending] = buf[self._buf_start:self._buf_end]
+      self._buf_start = 0
+      self._buf_end = pending
+    short = self.recv_size - (len(buf) - pending)
+    if short > 0:
+      buf.extend(bytearray(max(short, len(buf))))
 
   def read (self):
     """
@@ -712,49 +885,72 @@ class Connection (EventMixin):
 
     Note: This function will block if data is not available.
     """
-    d = self.sock.recv(2048)
-    if len(d) == 0:
+    self._make_room()
+    buf = self.buf
+    view = memoryview(buf)
+    d = self.sock.recv_into(view[self._buf_end:], self.recv_size)
+    if d == 0:
       return False
-    self.buf += d
-    buf_len = len(self.buf)
+    buf_len = self._buf_end + d
+    self._buf_end = buf_len
 
+    if self._dispatch_generation != _handlers_generation:
+      self._dispatch = None
 
-    offset = 0
-    while buf_len - offset >= 8: # 8 bytes is minimum OF message size
-      # We pull the first four bytes of the OpenFlow header off by hand
-      # (using ord) to find the version/length/type so that we can
-      # correctly call libopenflow to unpack it.
+    offset = self._buf_start
+    try:
+      while buf_len - offset >= 8: # 8 bytes is minimum OF message size
+        # We pull the first four bytes of the OpenFlow header off by hand
+        # to find the version/length/type so that we can correctly call
+        # libopenflow to unpack it.
 
-      ofp_type = ord(self.buf[offset+1])
+        ofp_type = buf[offset+1]
 
-      if ord(self.buf[offset]) != of.OFP_VERSION:
-        if ofp_type == of.OFPT_HELLO:
-          # We let this through and hope the other side switches down.
-          pass
-        else:
-          log.warning("Bad OpenFlow version (0x%02x) on connection %s"
-                      % (ord(self.buf[offset]), self))
+        if buf[offset] != of.OFP_VERSION:
+          if ofp_type == of.OFPT_HELLO:
+            # We let this through and hope the other side switches down.
+            pass
+          else:
+            log.warning("Bad OpenFlow version (0x%02x) on connection %s"
+                        % (buf[offset], self))
+            return False # Throw connection away
+
+        msg_length = buf[offset+2] << 8 | buf[offset+3]
+        if msg_length < 8:
+          # We'd never get past it (or we'd lose our place in the stream)
+          log.warning("Bad OpenFlow message length (%i) on connection %s"
+                      % (msg_length, self))
           return False # Throw connection away
 
-      msg_length = ord(self.buf[offset+2]) << 8 | ord(self.buf[offset+3])
+        if buf_len - offset < msg_length: break
 
-      if buf_len - offset < msg_length: break
+        h = (self._dispatch or self._build_dispatch())[ofp_type]
+        if h is None:
+          # Nothing cares about it, so don't even unpack it
+          offset += msg_length
+          self._buf_start = offset
+          continue
 
-      new_offset,msg = unpackers[ofp_type](self.buf, offset)
-      assert new_offset - offset == msg_length
-      offset = new_offset
+        new_offset,msg = unpackers[ofp_type](view, offset)
+        assert new_offset - offset == msg_length
+        offset = new_offset
+        self._buf_start = offset
 
-      try:
-        h = handlers[ofp_type]
-        h(self, msg)
-      except:
-        log.exception("%s: Exception while handling OpenFlow message:\n" +
-                      "%s %s", self,self,
-                      ("\n" + str(self) + " ").join(str(msg).split('\n')))
-        continue
-
-    if offset != 0:
-      self.buf = self.buf[offset:]
+        try:
+          h(self, msg)
+        except:
+          log.exception("%s: Exception while handling OpenFlow message:\n" +
+                        "%s %s", self,self,
+                        ("\n" + str(self) + " ").join(str(msg).split('\n')))
+          continue
+    finally:
+      # Nothing may still be looking at the buffer when it gets resized
+      del view
+
+    if offset == buf_len:
+      # Everything has been consumed; start over at the front
+      self._buf_start = 0
+      self._buf_end = 0
 
     return True
 
@@ -818,46 +1014,99 @@ def wrap_socket (new_sock):
 
 
 from pox.lib.recoco.recoco import *
+from pox.lib.epoll_select import EpollSelect
 
 class OpenFlow_01_Task (Task):
   """
   The main recoco thread for listening to openflow messages
+
+  There are two reactors for doing the actual I/O:
+   select - the classic one.  Every cycle, select()s on a list of all the
+            connections.  Portable, but the per-wakeup cost grows with the
+            number of switches, and it can't deal with file descriptors
+            above FD_SETSIZE (typically 1024).
+   epoll  - Linux only.  Each Connection is registered on an epoll object
+            once, and the task only ever select()s on the listening socket
+            and the epoll fd itself.  On wakeup, only the connections which
+            are actually ready are visited.
   """
-  def __init__ (self, port = 6633, address = '0.0.0.0'):
-    Task.__init__(self)
+  def __init__ (self, port = 6633, address = '0.0.0.0', reactor = 'select',
+                batch_sends = False):
+    # run() is a generator, so these are all set before it's called
     self.port = int(port)
     self.address = address
+    self.batch_sends = batch_sends
+    if reactor not in ('select', 'epoll'):
+      raise RuntimeError("Unknown reactor '%s'" % (reactor,))
+    if reactor == 'epoll' and not hasattr(select, 'epoll'):
+      raise RuntimeError("epoll reactor is not available on this platform")
+    self.reactor = reactor
+    Task.__init__(self)
 
     core.addListener(pox.core.GoingUpEvent, self._handle_GoingUpEvent)
 
   def _handle_GoingUpEvent (self, event):
     self.start()
 
-  def run (self):
-    # List of open sockets/connections to select on
-    sockets = []
-
+  def _listen (self):
     listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     listener.bind((self.address, self.port))
     listener.listen(16)
-    sockets.append(listener)
 
-    log.debug("Listening on %s:%s" %
-              (self.address, self.port))
+    log.debug("Listening on %s:%s (%s reactor)" %
+              (self.address, self.port, self.reactor))
+    return listener
+
+  def _accept (self, listener):
+    new_sock = listener.accept()[0]
+    if pox.openflow.debug.pcap_traces:
+      new_sock = wrap_socket(new_sock)
+    new_sock.setblocking(0)
+    # Note that instantiating a Connection object fires a
+    # ConnectionUp event (after negotation has completed)
+    return Connection(new_sock)
+
+  def _log_exception (self, con):
+    doTraceback = True
+    if sys.exc_info()[0] is socket.error:
+      if sys.exc_info()[1][0] == ECONNRESET:
+        con.info("Connection reset")
+        doTraceback = False
+
+    if doTraceback:
+      log.exception("Exception reading connection " + str(con))
+
+  def run (self):
+    if self.reactor == 'epoll':
+      return self._run_epoll()
+    return self._run_select()
+
+  def _run_select (self):
+    # List of open sockets/connections to select on
+    sockets = []
+
+    listener = self._listen()
+    sockets.append(listener)
+    waker = pendingWrites.waker
+    sockets.append(waker)
 
     con = None
     while core.running:
       try:
         while True:
           con = None
-          rlist, wlist, elist = yield Select(sockets, [], sockets, 5)
+          rlist, wlist, elist = yield Select(sockets,
+                                             list(pendingWrites.connections),
+                                             sockets, 5)
           if len(rlist) == 0 and len(wlist) == 0 and len(elist) == 0:
             if not core.running: break
 
           for con in elist:
             if con is listener:
               raise RuntimeError("Error on listener socket")
+            elif con is waker:
+              continue
             else:
               try:
                 con.close()
@@ -868,34 +1117,28 @@ class OpenFlow_01_Task (Task):
               except:
                 pass
 
+          for con in wlist:
+            con._flush()
+
           timestamp = time.time()
-          for con in rlist:
-            if con is listener:
-              new_sock = listener.accept()[0]
-              if pox.openflow.debug.pcap_traces:
-                new_sock = wrap_socket(new_sock)
-              new_sock.setblocking(0)
-              # Note that instantiating a Connection object fires a
-              # ConnectionUp event (after negotation has completed)
-              newcon = Connection(new_sock)
-              sockets.append( newcon )
-              #print str(newcon) + " connected"
-            else:
-              con.idle_time = timestamp
-              if con.read() is False:
-                con.close()
-                sockets.remove(con)
+          if self.batch_sends: sendBatcher.begin()
+          try:
+            for con in rlist:
+              if con is listener:
+                sockets.append( self._accept(listener) )
+              elif con is waker:
+                pendingWrites.pong()
+              else:
+                con.idle_time = timestamp
+                if con.read() is False:
+                  con.close()
+                  sockets.remove(con)
+          finally:
+            if self.batch_sends: sendBatcher.end()
       except exceptions.KeyboardInterrupt:
         break
       except:
-        doTraceback = True
-        if sys.exc_info()[0] is socket.error:
-          if sys.exc_info()[1][0] == ECONNRESET:
-            con.info("Connection reset")
-            doTraceback = False
-
-        if doTraceback:
-          log.exception("Exception reading connection " + str(con))
+        self._log_exception(con)
 
         if con is listener:
           log.error("Exception on OpenFlow listener.  Aborting.")
@@ -913,19 +1156,146 @@ class OpenFlow_01_Task (Task):
 
     #pox.core.quit()
 
+  def _run_epoll (self):
+    listener = self._listen()
+
+    # Connections stay registered here for their whole lifetime, so a
+    # wakeup costs the same whether we have ten switches or ten thousand.
+    # We yield on the epoll object's own fd, which is readable whenever
+    # any connection is.
+    poller = EpollSelect()
+    waker = pendingWrites.waker
+    fds = [listener, poller, waker]
+
+    # Connections currently registered for EPOLLOUT too
+    writing = set()
+    READ = select.EPOLLIN | select.EPOLLPRI
+    READ_WRITE = READ | select.EPOLLOUT
+
+    def remove (con):
+      writing.discard(con)
+      poller.unregister(con)
+      try:
+        con.close()
+      except:
+        pass
+
+    con = None
+    while core.running:
+      try:
+        while True:
+          con = None
+          rlist, wlist, elist = yield Select(fds, [], [listener], 5)
+          if len(rlist) == 0 and len(elist) == 0:
+            if not core.running: break
+
+          if elist:
+            raise RuntimeError("Error on listener socket")
+
+          if listener in rlist:
+            con = listener
+            poller.register(self._accept(listener), READ)
+
+          if waker in rlist:
+            pendingWrites.pong()
+            for con in list(pendingWrites.connections):
+              if con not in writing and not con.disconnected:
+                writing.add(con)
+                poller.register(con, READ_WRITE)
+
+          timestamp = time.time()
+          if self.batch_sends: sendBatcher.begin()
+          try:
+            for con,event in poller.poll(0):
+              if event & select.EPOLLOUT:
+                if con._flush() and con in writing:
+                  writing.discard(con)
+                  poller.register(con, READ)
+              if event & select.EPOLLIN:
+                con.idle_time = timestamp
+                if con.read() is False:
+                  remove(con)
+              elif event & (select.EPOLLERR | select.EPOLLHUP):
+                remove(con)
+          finally:
+            if self.batch_sends: sendBatcher.end()
+      except exceptions.KeyboardInterrupt:
+        break
+      except:
+        self._log_exception(con)
+
+        if con is listener:
+          log.error("Exception on OpenFlow listener.  Aborting.")
+          break
+        if con is not None:
+          remove(con)
+
+    poller.close()
+    log.debug("No longer listening for connections")
+
+
+# Bumped whenever handlers changes so Connections rebuild their dispatch
+# tables
+_handlers_generation = 0
 
 def _set_handlers ():
+  global _handlers_generation
   handlers.extend([None] * (1 + sorted(handlerMap.keys(),reverse=True)[0]))
   for h in handlerMap:
     handlers[h] = handlerMap[h]
     #print handlerMap[h]
+  _handlers_generation += 1
 _set_handlers()
 
 
-def launch (port = 6633, address = "0.0.0.0"):
+def _has_listeners (source, events):
+  """
+  Is anything listening to source for any of the given event types?
+  """
+  h = getattr(source, '_eventMixin_handlers', None)
+  if not h: return False
+  for e in events:
+    if h.get(e): return True
+  return False
+
+
+def use_lazy_unpackers ():
+  """
+  Switch to unpackers which leave message bodies packed until used
+
+  Unpackers which have already been replaced (e.g., by a vendor
+  extension) are left alone.
+  """
+  eager = make_type_to_unpacker_table()
+  lazy = make_type_to_unpacker_table(lazy = True)
+  for i,u in enumerate(lazy):
+    if unpackers[i] == eager[i]:
+      unpackers[i] = u
+
+
+def launch (port = 6633, address = "0.0.0.0", reactor = "select",
+            recv_size = None, batch_sends = False, lazy_unpack = False):
+  """
+  Listen for OpenFlow 1.0 connections
+
+  --reactor=epoll uses epoll (Linux only) instead of select() for the main
+  I/O loop, which is worth it once there are more than a few hundred
+  switches (and required past FD_SETSIZE of them).
+  --recv_size=<bytes> sets the most data read from a switch at once.
+  --batch_sends holds everything sent while handling each batch of
+  received messages, and then sends it with one send() per switch.
+  --lazy_unpack only unpacks things like stats bodies and port lists
+  when something actually looks at them.
+  """
   if core.hasComponent('of_01'):
     return None
-  l = OpenFlow_01_Task(port = int(port), address = address)
+  if recv_size is not None:
+    Connection.recv_size = int(recv_size)
+  if pox.lib.util.str_to_bool(lazy_unpack):
+    use_lazy_unpackers()
+  l = OpenFlow_01_Task(port = int(port), address = address,
+                       reactor = reactor,
+                       batch_sends = pox.lib.util.str_to_bool(batch_sends))
   core.register("of_01", l)
   return l
 
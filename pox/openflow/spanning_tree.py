@@ -36,7 +36,7 @@ of going about it.
 from pox.core import core
 import pox.openflow.libopenflow_01 as of
 from pox.lib.revent import *
-from collections import defaultdict
+from collections import defaultdict, deque
 from pox.openflow.discovery import Discovery
 from pox.lib.util import dpidToStr
 from pox.lib.recoco import Timer
@@ -44,69 +44,80 @@ import time
 
 log = core.getLogger()
 
-# Might be nice if we made this accessible on core...
-#_adj = defaultdict(lambda:defaultdict(lambda:[]))
+def _flip (link):
+  return Discovery.Link(link[2],link[3], link[0],link[1])
 
-def _calc_spanning_tree ():
+
+def _get_adjacency (links):
+  """
+  Gets the switch graph from discovery's links
+
+  We only want a single symmetric link connecting nodes.  Returns a
+  tuple of (adj, link_ports).  adj is a dictionary where the keys are
+  DPID1 and the values are dictionaries of DPID2 -> port-num, where
+  port-num is the port on DPID1 connecting to DPID2.  link_ports is a set
+  of (DPID, port-num) which are on any link at all (so ports which are
+  not in it are edge ports).
+  """
+  adj = defaultdict(dict)
+  link_ports = set()
+  for l in links:
+    link_ports.add((l.dpid1, l.port1))
+    link_ports.add((l.dpid2, l.port2))
+    if l.dpid2 in adj[l.dpid1]: continue
+    if _flip(l) in links:
+      # This is a good one
+      adj[l.dpid1][l.dpid2] = l.port1
+      adj[l.dpid2][l.dpid1] = l.port2
+  return adj, link_ports
+
+
+def _calc_spanning_tree (adj = None, roots = None):
   """
-  Calculates the actual spanning tree
+  Calculates the actual spanning tree for the parts of the network
+  containing any of the roots
 
   Returns it as dictionary where the keys are DPID1, and the
-  values are tuples of (DPID2, port-num), where port-num
-  is the port on DPID1 connecting to DPID2.
+  values are sets of (DPID2, port-num), where port-num
+  is the port on DPID1 connecting to DPID2.  Every switch connected to
+  any of the roots has a key (even if it has no links at all).
+
+  Each part of the tree grows from the lowest DPID in it, so it comes
+  out the same no matter which of its switches we started from.
+
+  adj is as returned by _get_adjacency() (defaults to discovery's current
+  view).  roots defaults to every switch in adj.
   """
-  def flip (link):
-    return Discovery.Link(link[2],link[3], link[0],link[1])
-
-  adj = defaultdict(lambda:defaultdict(lambda:[]))
-  switches = set()
-  # Add all links and switches
-  for l in core.openflow_discovery.adjacency:
-    adj[l.dpid1][l.dpid2].append(l)
-    switches.add(l.dpid1)
-    switches.add(l.dpid2)
-
-  # Cull links -- we want a single symmetric link connecting nodes
-  for s1 in switches:
-    for s2 in switches:
-      if s2 not in adj[s1]:
-        continue
-      if not isinstance(adj[s1][s2], list):
-        continue
-      assert s1 is not s2
-      good = False
-      for l in adj[s1][s2]:
-        if flip(l) in core.openflow_discovery.adjacency:
-          # This is a good one
-          adj[s1][s2] = l.port1
-          adj[s2][s1] = l.port2
-          good = True
-          break
-      if not good:
-        del adj[s1][s2]
-        if s1 in adj[s2]:
-          # Delete the other way too
-          del adj[s2][s1]
-
-  q = []
-  more = set(switches)
-
-  done = set()
-
-  tree = defaultdict(set)
-
-  while True:
-    q = sorted(list(more)) + q
-    more.clear()
-    if len(q) == 0: break
-    v = q.pop(False)
-    if v in done: continue
-    done.add(v)
-    for w,p in adj[v].iteritems():
-      if w in tree: continue
-      more.add(w)
-      tree[v].add((w,p))
-      tree[w].add((v,adj[w][v]))
+  if adj is None:
+    adj = _get_adjacency(core.openflow_discovery.adjacency)[0]
+  if roots is None:
+    roots = list(adj)
+  tree = {}
+  for root in sorted(roots):
+    if root in tree: continue
+
+    # Find everything connected to the root
+    component = set([root])
+    q = deque([root])
+    while q:
+      v = q.popleft()
+      for w in adj[v]:
+        if w in component: continue
+        component.add(w)
+        q.append(w)
+
+    # ...and grow a tree over it
+    start = min(component)
+    tree[start] = set()
+    q = deque([start])
+    while q:
+      v = q.popleft()
+      for w in sorted(adj[v]):
+        if w in tree: continue
+        tree[w] = set()
+        tree[v].add((w,adj[v][w]))
+        tree[w].add((v,adj[w][v]))
+        q.append(w)
 
   if False:
     log.debug("*** SPANNING TREE ***")
@@ -133,6 +144,14 @@ _noflood_by_default = False
 # cycle should have completed (mostly makes sense with _noflood_by_default).
 _hold_down = False
 
+# Switches which had links change since we last updated the tree
+_dirty = set()
+
+# How long to wait after a link change before updating the tree (so that
+# a burst of changes only causes one update), and the Timer for it
+_debounce_time = 0.5
+_update_timer = None
+
 
 def _handle_ConnectionUp (event):
   # When a switch connects, forget about previous port states
@@ -156,8 +175,21 @@ def _handle_ConnectionUp (event):
               kw={'force_dpid':event.dpid})
 
 
-def _handle_LinkEvent (event):
-  # When links change, update spanning tree
+def _handle_LinksChanged (event):
+  # When links change, update spanning tree (soon)
+  global _update_timer
+  for l in event.added + event.removed:
+    _dirty.add(l.dpid1)
+    _dirty.add(l.dpid2)
+  if not _debounce_time:
+    _update_tree()
+  elif _update_timer is None:
+    _update_timer = Timer(_debounce_time, _debounced_update)
+
+
+def _debounced_update ():
+  global _update_timer
+  _update_timer = None
   _update_tree()
 
 
@@ -165,13 +197,22 @@ def _update_tree (force_dpid = None):
   """
   Update spanning tree
 
+  Only the parts of the network containing switches whose links changed
+  (or force_dpid) are recalculated, and we only send port mods for ports
+  whose flood setting should change.
+
   force_dpid specifies a switch we want to update even if we are supposed
   to be holding down changes.
   """
+  if force_dpid is not None: _dirty.add(force_dpid)
+  if not _dirty: return
+  dirty = set(_dirty)
+  _dirty.clear()
 
-  # Get a spanning tree
-  tree = _calc_spanning_tree()
-  log.debug("Spanning tree updated")
+  # Get a spanning tree for what changed
+  adj, link_ports = _get_adjacency(core.openflow_discovery.adjacency)
+  tree = _calc_spanning_tree(adj, dirty)
+  log.debug("Spanning tree updated for %i switches", len(tree))
 
   # Connections born before this time are old enough that a complete
   # discovery cycle should have completed (and, thus, all of their
@@ -195,12 +236,13 @@ def _update_tree (force_dpid = None):
           else:
             continue
 
-      tree_ports = [p[1] for p in ports]
+      tree_ports = set(p[1] for p in ports)
       for p in con.ports.itervalues():
         if p.port_no < of.OFPP_MAX:
           flood = p.port_no in tree_ports
           if not flood:
-            if core.openflow_discovery.is_edge_port(sw, p.port_no):
+            if (sw, p.port_no) not in link_ports:
+              # Edge port
               flood = True
           if _prev[sw][p.port_no] is flood:
             #print sw,p.port_no,"skip","(",flood,")"
@@ -259,16 +301,19 @@ def _check_ports (dpid):
   log.debug("Requested switch features for %s", str(con))
 
 
-def launch (no_flood = False, hold_down = False):
-  global _noflood_by_default, _hold_down
+def launch (no_flood = False, hold_down = False, debounce = None):
+  global _noflood_by_default, _hold_down, _debounce_time
   if no_flood is True:
     _noflood_by_default = True
   if hold_down is True:
     _hold_down = True
+  if debounce is not None:
+    _debounce_time = float(debounce)
 
   def start_spanning_tree ():
     core.openflow.addListenerByName("ConnectionUp", _handle_ConnectionUp)
-    core.openflow_discovery.addListenerByName("LinkEvent", _handle_LinkEvent)
+    core.openflow_discovery.addListenerByName("LinksChanged",
+                                              _handle_LinksChanged)
     log.debug("Spanning tree component ready")
   core.call_when_ready(start_spanning_tree, "openflow_discovery")
 
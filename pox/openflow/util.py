@@ -18,16 +18,23 @@
 import pox.openflow.libopenflow_01 as of
 import struct
 
-def make_type_to_unpacker_table ():
+def make_type_to_unpacker_table (lazy = False):
   """
   Returns a list of unpack methods.
 
   The resulting list maps OpenFlow types to functions which unpack
   data for those types into message objects.
+
+  If lazy is True, messages which support it only have their bodies
+  unpacked when they're first accessed (see ofp_base.unpack_new_lazy()).
   """
 
   top = max(of._message_type_to_class)
 
-  r = [of._message_type_to_class[i].unpack_new for i in range(0, top)]
+  if lazy:
+    r = [of._message_type_to_class[i].unpack_new_lazy
+         for i in range(0, top)]
+  else:
+    r = [of._message_type_to_class[i].unpack_new for i in range(0, top)]
 
   return r
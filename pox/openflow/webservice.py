@@ -141,46 +141,31 @@ class OFFlowStatsRequest (OFConRequest):
 
 class OFSetTableRequest (OFConRequest):
 
-  def clear_table (self, xid = None):
+  def clear_table (self):
     fm = of.ofp_flow_mod()
-    fm.xid = xid
     fm.command = of.OFPFC_DELETE
     self._con.send(fm)
-    bar = of.ofp_barrier_request()
-    bar.xid = xid
-    self._con.send(bar)
-    #TODO: Watch for errors on these
 
   def _init (self, flows = []):
-    self.done = False
-
-    xid = of.generate_xid()
-    self.xid = xid
-    self.clear_table(xid=xid)
-
-    self.count = 1 + len(flows)
-
-    for flow in flows:
-      fm = dict_to_flow_mod(flow)
-      fm.xid = xid
+    fm = of.ofp_flow_mod()
+    fm.command = of.OFPFC_DELETE
+    msgs = [fm] + [dict_to_flow_mod(flow) for flow in flows]
 
-      self._con.send(fm)
-      self._con.send(of.ofp_barrier_request(xid=xid))
+    # One barrier for the lot
+    batch = core.openflow_flow_batcher.send(self._con, msgs)
+    batch.add_callback(self._batch_done)
 
-  def _handle_BarrierIn (self, event):
-    if event.ofp.xid != self.xid: return
-    if self.done: return
-    self.count -= 1
-    if self.count <= 0:
+  def _batch_done (self, batch):
+    self.xid = batch.xid
+    if batch.ok:
       self._result('flowmod', True)
-      self.done = True
-
-  def _handle_ErrorIn (self, event):
-    if event.ofp.xid != self.xid: return
-    if self.done: return
-    self.clear_table()
-    self.done = True
-    self._finish(make_error("OpenFlow Error", data=event.asString()))
+    elif batch.error:
+      self.clear_table()
+      self._finish(make_error("OpenFlow Error", data=batch.error.asString()))
+    elif batch.timed_out:
+      self._finish(make_error("Switch didn't respond"))
+    else:
+      self._finish(make_error("Switch disconnected"))
 
 
 class OFRequestHandler (JSONRPCHandler):
@@ -215,6 +200,9 @@ class OFRequestHandler (JSONRPCHandler):
 
 
 def launch (username='', password=''):
+  import pox.openflow.flow_batcher
+  pox.openflow.flow_batcher.launch()
+
   def _launch ():
     cfg = {}
     if len(username) and len(password):
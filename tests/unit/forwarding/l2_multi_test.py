@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+
+import unittest
+import sys
+import os.path
+import random
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+import pox.forwarding.l2_multi as l2m
+import pox.openflow.libopenflow_01 as of
+from pox.openflow.flow_batcher import FlowBatch
+from pox.lib.addresses import EthAddr
+from pox.lib.packet import ethernet
+from pox.openflow import PacketIn, FlowRemoved
+
+class FakeConnection (object):
+  def __init__ (self):
+    self.sent = []
+  def send (self, msg):
+    self.sent.append(msg)
+
+class PathTestBase (unittest.TestCase):
+  def setUp (self):
+    l2m.adjacency.clear()
+    l2m.switches.clear()
+    l2m.path_trees.clear()
+    l2m.path_cache.clear()
+    l2m.mac_map.clear()
+    l2m.installed_trees.clear()
+    l2m.dense_paths = None
+
+  def tearDown (self):
+    self.setUp()
+
+  def _make_switches (self, n):
+    sws = []
+    for i in range(n):
+      sw = l2m.Switch()
+      sw.dpid = i + 1
+      l2m.switches[sw.dpid] = sw
+      sws.append(sw)
+    return sws
+
+  def _link (self, sw1, sw2):
+    l2m.adjacency[sw1][sw2] = sw2.dpid
+    l2m.adjacency[sw2][sw1] = sw1.dpid
+    l2m._link_added(sw1, sw2)
+
+  def _unlink (self, sw1, sw2):
+    del l2m.adjacency[sw1][sw2]
+    del l2m.adjacency[sw2][sw1]
+    l2m._link_removed(sw1, sw2)
+
+  def _distances (self, sws):
+    """
+    All-pairs hop counts computed from scratch
+    """
+    r = {}
+    for src in sws:
+      dist = {src:0}
+      frontier = [src]
+      while frontier:
+        nxt = []
+        for sw in frontier:
+          for n,port in l2m.adjacency[sw].items():
+            if port is None or n in dist: continue
+            dist[n] = dist[sw] + 1
+            nxt.append(n)
+        frontier = nxt
+      r[src] = dist
+    return r
+
+  def _check_flaps (self):
+    rng = random.Random(11)
+    sws = self._make_switches(30)
+    links = set()
+    for i in range(60):
+      a,b = rng.sample(sws, 2)
+      if (a,b) in links or (b,a) in links: continue
+      self._link(a, b)
+      links.add((a,b))
+
+    for i in range(100):
+      if links and rng.random() < 0.5:
+        a,b = rng.choice(sorted(links, key=lambda l:(l[0].dpid,l[1].dpid)))
+        self._unlink(a, b)
+        links.discard((a,b))
+      else:
+        a,b = rng.sample(sws, 2)
+        if (a,b) in links or (b,a) in links: continue
+        self._link(a, b)
+        links.add((a,b))
+
+      expected = self._distances(sws)
+      for j in range(20):
+        src,dst = rng.sample(sws, 2)
+        p = l2m._get_raw_path(src, dst)
+        if dst not in expected[src]:
+          self.assertEqual(p, None)
+        else:
+          self.assertEqual(len(p) + 1, expected[src][dst])
+          hops = [src] + p + [dst]
+          for s1,s2 in zip(hops[:-1], hops[1:]):
+            self.assertTrue(l2m.adjacency[s1][s2] is not None)
+
+
+  def _check_multipath (self):
+    # Two leaves and four spines, plus a host switch hanging off a spine
+    leaf1,leaf2,s1,s2,s3,s4,other = self._make_switches(7)
+    spines = [s1,s2,s3,s4]
+    for spine in spines:
+      self._link(leaf1, spine)
+      self._link(leaf2, spine)
+    self._link(s4, other)
+
+    used = set()
+    for i in range(100):
+      p = l2m._get_multipath_raw_path(leaf1, leaf2, hash(i))
+      self.assertEqual(len(p), 1)
+      self.assertTrue(p[0] in spines)
+      used.add(p[0])
+      self.assertEqual(p, l2m._get_multipath_raw_path(leaf1, leaf2, hash(i)))
+    self.assertEqual(used, set(spines))
+
+    self.assertEqual(l2m._get_multipath_raw_path(leaf1, other, 5), [s4])
+    self.assertEqual(l2m._get_multipath_raw_path(leaf1, leaf1, 5), [])
+    p = l2m._get_path(other, leaf2, 1, 2, 7)
+    self.assertEqual(len(p), 3)
+
+    self._unlink(leaf2, s4)
+    for i in range(20):
+      p = l2m._get_multipath_raw_path(leaf1, leaf2, hash(i))
+      self.assertTrue(p[0] in (s1,s2,s3))
+    p = l2m._get_multipath_raw_path(other, leaf2, 3)
+    self.assertEqual(p[:2], [s4, leaf1])
+    self.assertTrue(p[2] in (s1,s2,s3))
+
+
+  def _check_trees (self):
+    a,b,c = self._make_switches(3)
+    for sw in (a,b,c): sw.connection = FakeConnection()
+    self._link(a, b)
+    self._link(b, c)
+    mac = EthAddr("00:00:00:00:00:01")
+
+    def sent ():
+      r = {}
+      for sw in (a,b,c):
+        for msg in sw.connection.sent:
+          if msg.command == of.OFPFC_DELETE:
+            r.setdefault(sw, []).append("delete")
+          else:
+            self.assertEqual(msg.match, of.ofp_match(dl_dst=mac))
+            r.setdefault(sw, []).append(msg.actions[0].port)
+        del sw.connection.sent[:]
+      return r
+
+    l2m.mac_map[mac] = (c, 5)
+    l2m._install_tree(mac)
+    self.assertEqual(sent(), {a:[b.dpid], b:[c.dpid], c:[5]})
+    l2m._install_tree(mac)
+    self.assertEqual(sent(), {})
+
+    # An entry timed out on b
+    l2m.installed_trees[mac][1].discard(b)
+    l2m._install_tree(mac)
+    self.assertEqual(sent(), {b:[c.dpid]})
+
+    # Host moved
+    l2m.mac_map[mac] = (a, 7)
+    l2m._install_tree(mac)
+    self.assertEqual(sent(), {a:["delete", 7], b:["delete", a.dpid],
+                              c:["delete", b.dpid]})
+
+
+class PathTest (PathTestBase):
+  def test_line (self):
+    a,b,c,d = self._make_switches(4)
+    self._link(a, b)
+    self._link(b, c)
+    self.assertEqual(l2m._get_raw_path(a, c), [b])
+    self.assertEqual(l2m._get_raw_path(a, b), [])
+    self.assertEqual(l2m._get_raw_path(a, d), None)
+    self.assertEqual(l2m._get_path(a, c, 9, 8),
+                     [(a,9,b.dpid), (b,a.dpid,c.dpid), (c,b.dpid,8)])
+
+    # Cooked paths are cached until links change
+    self.assertTrue(l2m._get_path(a, c, 9, 8) is l2m._get_path(a, c, 9, 8))
+
+    # A shortcut only throws away trees it improves
+    l2m._get_tree(d)
+    self._link(a, c)
+    self.assertTrue(d in l2m.path_trees)
+    self.assertFalse(a in l2m.path_trees)
+    self.assertEqual(l2m._get_raw_path(a, c), [])
+
+    # Removing a link only throws away trees that used it
+    l2m._get_tree(b)
+    self._unlink(a, c)
+    self.assertTrue(b in l2m.path_trees)
+    self.assertFalse(a in l2m.path_trees)
+    self.assertEqual(l2m._get_raw_path(a, c), [b])
+
+  def test_flaps (self):
+    self._check_flaps()
+
+  def test_multipath (self):
+    self._check_multipath()
+
+  def test_trees (self):
+    self._check_trees()
+
+  def test_proactive_move (self):
+    """ a host that moves is found again once its tree times out """
+    a,b,c = self._make_switches(3)
+    for sw in (a,b,c):
+      sw.connection = FakeConnection()
+      sw.connection.dpid = sw.dpid
+    self._link(a, b)
+    self._link(b, c)
+    mac = EthAddr("00:00:00:00:00:01")
+
+    def packet_in (sw, port):
+      e = ethernet(src=mac, dst=EthAddr("ff:ff:ff:ff:ff:ff"), type=0x800)
+      e.payload = "\x45" + "\x00" * 19
+      ofp = of.ofp_packet_in(in_port=port, data=e.pack())
+      sw._handle_PacketIn(PacketIn(sw.connection, ofp))
+
+    def tree ():
+      r = {}
+      for sw in (a,b,c):
+        for msg in sw.connection.sent:
+          if not isinstance(msg, of.ofp_flow_mod): continue
+          if msg.command == of.OFPFC_ADD:
+            self.assertEqual(msg.hard_timeout, l2m.TREE_HARD_TIMEOUT)
+            r[sw] = msg.actions[0].port
+        del sw.connection.sent[:]
+      return r
+
+    proactive = l2m._proactive
+    l2m._proactive = True
+    try:
+      packet_in(c, 5)
+      self.assertEqual(tree(), {a:b.dpid, b:c.dpid, c:5})
+
+      # It moves to a.  Its traffic follows the old tree without reaching
+      # us until the tree's hard timeout is up.
+      for sw in (a,b,c):
+        fr = of.ofp_flow_removed(match=of.ofp_match(dl_dst=mac),
+                                 reason=of.OFPRR_HARD_TIMEOUT)
+        l2m.l2_multi._handle_FlowRemoved.im_func(None,
+                                                 FlowRemoved(sw.connection, fr))
+      packet_in(a, 7)
+      self.assertEqual(l2m.mac_map[mac], (a, 7))
+      self.assertEqual(tree(), {a:7, b:a.dpid, c:b.dpid})
+    finally:
+      l2m._proactive = proactive
+
+
+@unittest.skipUnless(l2m.numpy, "NumPy not available")
+class DensePathTest (PathTestBase):
+  def setUp (self):
+    PathTestBase.setUp(self)
+    l2m.dense_paths = l2m.DensePaths()
+
+  def test_line (self):
+    a,b,c,d = self._make_switches(4)
+    self._link(a, b)
+    self._link(b, c)
+    self.assertEqual(l2m._get_raw_path(a, c), [b])
+    self.assertEqual(l2m._get_raw_path(c, a), [b])
+    self.assertEqual(l2m._get_raw_path(a, b), [])
+    self.assertEqual(l2m._get_raw_path(a, d), None)
+    self._link(a, c)
+    self.assertEqual(l2m._get_raw_path(a, c), [])
+
+  def test_flaps (self):
+    self._check_flaps()
+
+  def test_multipath (self):
+    self._check_multipath()
+
+  def test_trees (self):
+    self._check_trees()
+
+
+class WaitingPathTest (unittest.TestCase):
+  def setUp (self):
+    l2m.waiting_paths.clear()
+    del l2m._waiting_heap[:]
+    for k in l2m.path_stats: l2m.path_stats[k] = 0
+
+  def tearDown (self):
+    self.setUp()
+
+  def _make_path (self, dpid, batches):
+    sw = l2m.Switch()
+    sw.dpid = dpid
+    wp = l2m.WaitingPath([(sw,1,2)], None)
+    for batch in batches:
+      wp.add_batch(batch)
+    return wp
+
+  def test_expire (self):
+    setup_time = l2m.PATH_SETUP_TIME
+    try:
+      l2m.PATH_SETUP_TIME = -1
+      wp1 = self._make_path(1, [FlowBatch(1), FlowBatch(1)])
+      b2 = FlowBatch(2)
+      wp2 = self._make_path(2, [b2])
+    finally:
+      l2m.PATH_SETUP_TIME = setup_time
+    wp3 = self._make_path(3, [FlowBatch(3)])
+
+    # wp2 got its barrier in time
+    b2.xid = 3
+    b2._finish()
+    self.assertEqual(l2m.path_stats['installed'], 1)
+    self.assertFalse(wp2 in l2m.waiting_paths)
+
+    l2m.WaitingPath.expire_waiting_paths()
+    self.assertEqual(l2m.waiting_paths, set([wp3]))
+    self.assertEqual(l2m.path_stats['timed_out'], 1)
+    self.assertEqual(len(l2m._waiting_heap), 1)
+
+    # Nothing else is due
+    l2m.WaitingPath.expire_waiting_paths()
+    self.assertEqual(l2m.path_stats['timed_out'], 1)
+
+  def test_rejected (self):
+    b1 = FlowBatch(1)
+    b2 = FlowBatch(2)
+    wp = self._make_path(1, [b1, b2])
+    b1.error = object()
+    b1._finish()
+    self.assertEqual(l2m.path_stats['rejected'], 1)
+    self.assertEqual(l2m.waiting_paths, set())
+
+    # The other switch finishing later doesn't matter
+    b2._finish()
+    self.assertEqual(l2m.path_stats['installed'], 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -21,6 +21,7 @@ import unittest
 import sys
 import os.path
 from pox.lib.addresses import *
+import pox.lib.addresses as addresses
 from copy import copy
 
 class MockEthAddrTest(unittest.TestCase):
@@ -38,3 +39,45 @@ class MockIPAddrTest (unittest.TestCase):
   def test_in_network (self):
     self.assertTrue(IPAddr("192.168.1.1").inNetwork("192.168.1.0/24"))
 
+
+  def test_forms (self):
+    a = IPAddr("10.1.2.3")
+    self.assertEqual(a.toUnsigned(), 0x0a010203)
+    self.assertEqual(a.toRaw(), "\x0a\x01\x02\x03")
+    self.assertEqual(IPAddr(0x0a010203), a)
+    self.assertEqual(IPAddr("\x0a\x01\x02\x03"), a)
+    self.assertEqual(IPAddr(a.toUnsigned(networkOrder=True),
+                            networkOrder=True), a)
+    self.assertEqual(IPAddr("255.255.255.255").toSigned(), -1)
+    self.assertTrue(IPAddr("10.0.0.1") < IPAddr("10.0.0.2"))
+    self.assertEqual(str(IPAddr("192.168.100.1")), "192.168.100.1")
+
+class AddressTest (unittest.TestCase):
+  def tearDown (self):
+    set_cache_size(None)
+
+  def test_immutable (self):
+    for a in (EthAddr("00:11:22:33:44:55"), IPAddr("1.2.3.4")):
+      self.assertRaises(TypeError, setattr, a, '_value', 0)
+      self.assertFalse(hasattr(a, '__dict__'))
+      self.assertEqual(copy(a), a)
+      self.assertEqual(hash(copy(a)), hash(a))
+
+  def test_cache (self):
+    raw = "\x00\x11\x22\x33\x44\x55"
+    self.assertFalse(EthAddr(raw) is EthAddr(raw))
+    set_cache_size(2)
+    e = EthAddr(raw)
+    self.assertTrue(EthAddr(raw) is e)
+    self.assertTrue(IPAddr("\x01\x02\x03\x04") is IPAddr("\x01\x02\x03\x04"))
+    self.assertTrue(IPAddr(5) is IPAddr(5))
+    self.assertFalse(IPAddr(5) is IPAddr(5, networkOrder=True))
+
+    # Bounded, but busy addresses stick around
+    for i in range(10):
+      EthAddr("\x00\x00\x00\x00\x00" + chr(i))
+      self.assertTrue(EthAddr(raw) is e)
+    self.assertTrue(len(addresses._eth_cache) <= 4)
+
+    set_cache_size(0)
+    self.assertFalse(EthAddr(raw) is EthAddr(raw))
@@ -86,5 +86,21 @@ class EpollSelectTest(unittest.TestCase):
       check( ([],[],[]), self.es.select(sockets, [], sockets, 0))
       check( ([],sockets,[]), self.es.select(sockets, sockets, sockets, 0))
 
+  def test_persistent_register(self):
+    c1 = socket.create_connection( (self.ip, self.port))
+    c2 = socket.create_connection( (self.ip, self.port))
+    self.es.register(c1)
+    self.es.register(c2)
+    self.assertEqual([], self.es.poll(0.1))
+    c2.send("Hallo\n")
+    self.assertEqual([c2], [o for (o, e) in self.es.poll(0.5)])
+    # the epoll fd itself is selectable and readable while c2 is
+    import select
+    self.assertEqual([self.es], select.select([self.es], [], [], 0)[0])
+    self.es.unregister(c2)
+    self.assertEqual([], self.es.poll(0.1))
+    c1.send("Hallo\n")
+    self.assertEqual([c1], [o for (o, e) in self.es.poll(0.5)])
+
 if __name__ == '__main__':
   unittest.main()
@@ -60,5 +60,15 @@ class MockSocketTest(unittest.TestCase):
     (a, b) = MockSocket.pair()
     self.assertEquals(a.recv(), "")
 
+  def test_recv_into(self):
+    (a, b) = MockSocket.pair()
+    a.send("Hallo")
+    buf = bytearray(8)
+    self.assertEquals(b.recv_into(memoryview(buf)[2:], 3), 3)
+    self.assertEquals(buf, bytearray("\x00\x00Hal\x00\x00\x00"))
+    self.assertEquals(b.recv_into(buf), 2)
+    self.assertEquals(buf[0:2], bytearray("lo"))
+    self.assertEquals(b.recv_into(buf), 0)
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.lib.packet import *
+from pox.lib.addresses import EthAddr, IPAddr
+
+class LazyParseTest (unittest.TestCase):
+  def _packets (self):
+    src = EthAddr("00:00:00:00:00:01")
+    dst = EthAddr("00:00:00:00:00:02")
+    def eth (type, payload):
+      return ethernet(src=src, dst=dst, type=type, payload=payload)
+    def ip (protocol, payload):
+      return ipv4(srcip=IPAddr("10.0.0.1"), dstip=IPAddr("192.168.1.200"),
+                  protocol=protocol, payload=payload)
+
+    t = tcp(srcport=1234, dstport=80, off=5, payload="GET /")
+    yield eth(ethernet.IP_TYPE, ip(ipv4.TCP_PROTOCOL, t))
+    u = udp(srcport=5000, dstport=6000, payload="hello")
+    yield eth(ethernet.IP_TYPE, ip(ipv4.UDP_PROTOCOL, u))
+    yield eth(ethernet.IP_TYPE, ip(99, "unknown"))
+    a = arp(opcode=arp.REQUEST, hwsrc=src, protosrc=IPAddr("10.0.0.1"),
+            protodst=IPAddr("10.0.0.2"))
+    yield eth(ethernet.ARP_TYPE, a)
+    v = vlan(id=5, pcp=3, eth_type=ethernet.IP_TYPE,
+             payload=ip(ipv4.UDP_PROTOCOL, u))
+    yield eth(ethernet.VLAN_TYPE, v)
+    yield eth(0x1234, "some payload")
+
+  def test_same (self):
+    for p in self._packets():
+      data = p.pack()
+      eager = ethernet(data)
+      lazy = ethernet(data, lazy=True)
+      self.assertEqual(lazy.pack(), data)
+      self.assertEqual(lazy.dump(), eager.dump())
+      self.assertEqual(lazy.effective_ethertype, eager.effective_ethertype)
+      for proto in (ipv4, tcp, udp, arp, vlan):
+        self.assertEqual(str(lazy.find(proto)), str(eager.find(proto)))
+
+  def test_lazy (self):
+    data = list(self._packets())[0].pack()
+    p = ethernet(data, lazy=True)
+    self.assertTrue(p.parsed)
+    self.assertEqual(p.type, ethernet.IP_TYPE)
+    self.assertFalse('next' in p.__dict__)
+    self.assertFalse('src' in p.__dict__)
+
+    self.assertEqual(p.dst, EthAddr("00:00:00:00:00:02"))
+    self.assertFalse('src' in p.__dict__)
+    self.assertFalse('next' in p.__dict__)
+
+    ip = p.next
+    self.assertTrue(ip is p.next)
+    self.assertFalse('next' in ip.__dict__)
+    self.assertEqual(ip.dstip, IPAddr("192.168.1.200"))
+    self.assertEqual(p.find('tcp').dstport, 80)
+
+    # Setting things works as usual
+    p.src = EthAddr("00:00:00:00:00:03")
+    self.assertEqual(p.src, EthAddr("00:00:00:00:00:03"))
+    self.assertRaises(AttributeError, getattr, p, 'nonexistent')
+
+  def test_short (self):
+    data = list(self._packets())[0].pack()
+    p = ethernet(data[:10], lazy=True)
+    self.assertFalse(p.parsed)
+    self.assertEqual(p.next, b'')
+    p = ethernet(data[:20], lazy=True)
+    self.assertFalse(p.next.parsed)
+    self.assertEqual(p.find('ipv4'), None)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.lib.revent.revent import *
+
+class Foo (Event):
+  def __init__ (self, n = 0):
+    Event.__init__(self)
+    self.n = n
+
+class Bar (Event):
+  def _invoke (self, handler, *args, **kw):
+    return handler("bar", *args, **kw)
+
+class Source (EventMixin):
+  _eventMixin_events = set([Foo, Bar])
+
+class Other (Event):
+  pass
+
+class ReventTest (unittest.TestCase):
+  def setUp (self):
+    self.source = Source()
+    self.got = []
+
+  def test_no_listeners (self):
+    self.assertEqual(self.source.raiseEvent(Foo, 1), None)
+
+  def test_raise (self):
+    self.source.addListener(Foo, lambda e: self.got.append(e.n))
+    e = self.source.raiseEvent(Foo, 3)
+    self.assertEqual(self.got, [3])
+    self.assertTrue(e.source is self.source)
+    self.source.raiseEvent(Foo(4))
+    self.assertEqual(self.got, [3, 4])
+
+  def test_priority (self):
+    self.source.addListener(Foo, lambda e: self.got.append(1), priority=1)
+    self.source.addListener(Foo, lambda e: self.got.append(2), priority=2)
+    self.source.raiseEvent(Foo)
+    self.assertEqual(self.got, [2, 1])
+
+  def test_remove (self):
+    l = self.source.addListener(Foo, lambda e: self.got.append(1))
+    self.source.raiseEvent(Foo)
+    self.source.removeListener(l)
+    self.assertEqual(self.source.raiseEvent(Foo), None)
+    self.assertEqual(self.got, [1])
+
+  def test_once (self):
+    self.source.addListener(Foo, lambda e: self.got.append(1), once=True)
+    self.source.addListener(Foo, lambda e: self.got.append(2))
+    self.source.raiseEvent(Foo)
+    self.source.raiseEvent(Foo)
+    self.assertEqual(self.got, [1, 2, 2])
+
+  def test_return_values (self):
+    def h1 (e):
+      self.got.append(1)
+      return EventRemove
+    def h2 (e):
+      self.got.append(2)
+      return EventHalt
+    def h3 (e):
+      self.got.append(3)
+    self.source.addListener(Foo, h1)
+    self.source.addListener(Foo, h2)
+    self.source.addListener(Foo, h3)
+    self.assertTrue(self.source.raiseEvent(Foo).halt)
+    self.assertTrue(self.source.raiseEvent(Foo).halt)
+    self.assertEqual(self.got, [1, 2, 2])
+
+  def test_halt_attribute (self):
+    def h1 (e):
+      e.halt = True
+      return EventContinue
+    self.source.addListener(Foo, h1)
+    self.source.addListener(Foo, lambda e: self.got.append(2))
+    self.source.raiseEvent(Foo)
+    self.assertEqual(self.got, [])
+
+  def test_custom_invoke (self):
+    self.source.addListener(Bar, lambda e: self.got.append(e))
+    self.source.raiseEvent(Bar)
+    self.assertEqual(self.got, ["bar"])
+
+  def test_undefined_event (self):
+    self.assertEqual(self.source.raiseEvent(Other), None)
+    self.assertRaises(RuntimeError, self.source.raiseEvent, Other())
+    self.assertRaises(RuntimeError, self.source.addListener, Other,
+                      lambda e: None)
+
+if __name__ == '__main__':
+  unittest.main()
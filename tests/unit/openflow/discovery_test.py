@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.openflow.discovery import LLDPSender, Discovery
+from pox.openflow.discovery import LinkEvent, LinksChanged
+import time
+from pox.openflow.discovery import _parse_discovery_packet
+import pox.lib.packet as pkt
+from pox.lib.addresses import EthAddr
+import pox.openflow.libopenflow_01 as of
+
+class TestSender (LLDPSender):
+  """
+  LLDPSender which doesn't use timers or connections
+  """
+  def __init__ (self, *args, **kw):
+    self.sent = []
+    LLDPSender.__init__(self, *args, **kw)
+
+  def _set_timer (self):
+    pass
+
+  def _send (self, dpid, packets):
+    self.sent.append((dpid, len(packets)))
+
+  def cycle (self):
+    """
+    Run the timer until a whole cycle has gone by
+    """
+    del self.sent[:]
+    self._timer_handler()
+    self.finish_cycle()
+    return self.sent
+
+  def finish_cycle (self):
+    """
+    Run the timer until this cycle has nothing left to send
+    """
+    while any(self._is_current(key) for key in self._this_cycle):
+      self._timer_handler()
+
+
+class LLDPSenderTest (unittest.TestCase):
+  def _add_switch (self, sender, dpid, ports):
+    for p in range(1, ports + 1):
+      sender.add_port(dpid, p, EthAddr("00:00:00:00:00:%02x" % (p,)),
+                      set_timer = False)
+
+  def _check_queues (self, sender):
+    # Nothing is queued twice
+    keys = list(sender._this_cycle) + list(sender._next_cycle)
+    self.assertEqual(len(keys), len(sender._queued))
+    self.assertEqual(set(keys), sender._queued)
+
+  def test_add_del (self):
+    sender = TestSender(10)
+    self._add_switch(sender, 1, 3)
+    self._add_switch(sender, 2, 2)
+    self.assertEqual(sender._num_packets, 5)
+    self.assertEqual(sorted(sender.cycle()), [(1,1)] * 3 + [(2,1)] * 2)
+
+    sender.del_port(1, 2)
+    sender.del_port(1, 2)
+    sender.del_port(3, 1)
+    self.assertEqual(sender._num_packets, 4)
+    self.assertEqual(sorted(sender.cycle()), [(1,1)] * 2 + [(2,1)] * 2)
+
+    # Deleted in the middle of a cycle
+    sender._timer_handler()
+    sender.del_switch(2)
+    self.assertEqual(sender._num_packets, 2)
+    sender.finish_cycle()
+    self.assertEqual(sorted(sender.cycle()), [(1,1)] * 2)
+
+    # Re-added ports aren't sent twice
+    sender.del_port(1, 1)
+    sender.add_port(1, 1, EthAddr("00:00:00:00:00:01"))
+    self.assertEqual(sorted(sender.cycle()), [(1,1)] * 2)
+    self._check_queues(sender)
+
+  def test_batch (self):
+    sender = TestSender(10, batch = True)
+    self._add_switch(sender, 1, 3)
+    self._add_switch(sender, 2, 2)
+    self.assertEqual(sorted(sender.cycle()), [(1,3), (2,2)])
+    sender.del_port(1, 1)
+    sender.del_switch(2)
+    self.assertEqual(sender.cycle(), [(1,2)])
+    self._check_queues(sender)
+
+  def test_discovery_packet (self):
+    sender = TestSender(10, ttl = 99)
+    for dpid,port,addr in ((1, 1, EthAddr("00:00:00:00:00:01")),
+                           (0x1234abcd, 48, EthAddr("00:11:22:33:44:55")),
+                           (0xffffffffffffffff, of.OFPP_MAX,
+                            EthAddr("ff:ff:ff:ff:ff:fe"))):
+      fast = sender.create_discovery_packet(dpid, port, addr)
+      slow = sender._build_discovery_packet(dpid, port, addr)
+      # Same except for the xid
+      self.assertEqual(fast[:4] + fast[8:], slow[:4] + slow[8:])
+      self.assertNotEqual(fast[4:8], slow[4:8])
+
+      po = of.ofp_packet_out()
+      po.unpack(fast)
+      self.assertEqual(po.actions[0].port, port)
+
+
+class FakePacketIn (object):
+  def __init__ (self, data):
+    self.data = data
+    self.parsed = pkt.ethernet(data)
+
+
+class LLDPParseTest (unittest.TestCase):
+  def _frame (self, dpid, port):
+    sender = TestSender(10)
+    po = sender.create_discovery_packet(dpid, port,
+                                        EthAddr("00:00:00:00:00:01"))
+    return po[24:]
+
+  def _lldp_frame (self, tlvs, vlan = False):
+    lldp = pkt.lldp()
+    lldp.tlvs.extend(tlvs)
+    lldp.tlvs.append(pkt.end_tlv())
+    eth = pkt.ethernet(type=pkt.ethernet.LLDP_TYPE,
+                       src=EthAddr("00:00:00:00:00:01"),
+                       dst=pkt.ETHERNET.NDP_MULTICAST)
+    if vlan:
+      eth.type = pkt.ethernet.VLAN_TYPE
+      eth.payload = pkt.vlan(id=5, eth_type=pkt.ethernet.LLDP_TYPE,
+                             payload=lldp)
+    else:
+      eth.payload = lldp
+    return eth.pack()
+
+  def test_fast (self):
+    discovery = Discovery.__new__(Discovery)
+    for dpid,port in ((1,1), (0x1234abcd,48), (0xffffffffffffffff,65279)):
+      data = self._frame(dpid, port)
+      self.assertEqual(_parse_discovery_packet(data), (dpid,port))
+      self.assertEqual(discovery._parse_lldp(FakePacketIn(data)), (dpid,port))
+      self.assertTrue(discovery._is_discovery_packet(FakePacketIn(data)))
+
+    self.assertEqual(_parse_discovery_packet(data[:30]), None)
+
+  def test_other_formats (self):
+    """
+    LLDP packets the fast path leaves to the full parser
+    """
+    discovery = Discovery.__new__(Discovery)
+    chassis = pkt.chassis_id(subtype=pkt.chassis_id.SUB_LOCAL, id='dpid:2a')
+    ttl = pkt.ttl(ttl=120)
+    binary_port = pkt.port_id(subtype=pkt.port_id.SUB_PORT, id='\x00\x07')
+    port = pkt.port_id(subtype=pkt.port_id.SUB_PORT, id='7')
+    desc = pkt.system_description(payload='name\ndpid:2a')
+    for tlvs,vlan in (([chassis, binary_port, ttl], False),
+                      ([chassis, port, ttl, desc], False),
+                      ([chassis, port, ttl], True)):
+      data = self._lldp_frame(tlvs, vlan)
+      self.assertEqual(_parse_discovery_packet(data), None)
+      self.assertTrue(discovery._is_discovery_packet(FakePacketIn(data)))
+      self.assertEqual(discovery._parse_lldp(FakePacketIn(data)), (0x2a,7))
+
+    data = self._lldp_frame([chassis, port, ttl])
+    data = EthAddr("ff:ff:ff:ff:ff:ff").toRaw() + data[6:]
+    self.assertFalse(discovery._is_discovery_packet(FakePacketIn(data)))
+
+
+class LinkExpiryTest (unittest.TestCase):
+  def test_expire (self):
+    d = Discovery.__new__(Discovery)
+    d.adjacency = {}
+    d._expiry_heap = []
+    d._expiry_queued = set()
+    events = []
+    d.addListener(LinkEvent, lambda e: events.append((e.removed, e.link)))
+    d.addListener(LinksChanged,
+                  lambda e: events.append((e.added, e.removed)))
+
+    now = time.time()
+    links = [Discovery.Link(i, 1, i + 1, 2) for i in range(1, 6)]
+    old, refreshed, gone, fresh, old2 = links
+    for link in (old, refreshed, gone, old2):
+      d.adjacency[link] = now - 20
+      d._schedule_expiry(link, now - 20)
+    d.adjacency[fresh] = now
+    d._schedule_expiry(fresh, now)
+    d._schedule_expiry(fresh, now) # Already in there
+    d.adjacency[refreshed] = now
+    d._delete_links([gone])
+    self.assertEqual(events, [(True, gone), ([], [gone])])
+    del events[:]
+
+    d._expire_links()
+    self.assertEqual(events, [(True, old), (True, old2), ([], [old, old2])])
+    self.assertEqual(sorted(d.adjacency), [refreshed, fresh])
+    self.assertEqual(sorted(link for t,link in d._expiry_heap),
+                     [refreshed, fresh])
+    self.assertEqual(d._expiry_queued, set([refreshed, fresh]))
+
+    # Nothing else is due
+    del events[:]
+    d._expire_links()
+    self.assertEqual(events, [])
+
+if __name__ == '__main__':
+  unittest.main()
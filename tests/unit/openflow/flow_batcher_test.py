@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.core import core
+from pox.openflow import BarrierIn, ErrorIn, ConnectionDown
+from pox.openflow.flow_batcher import FlowBatcher
+import pox.openflow.libopenflow_01 as of
+
+class FakeConnection (object):
+  def __init__ (self, dpid):
+    self.dpid = dpid
+    self.sent = []
+  def send_many (self, msgs):
+    self.sent.append(list(msgs))
+
+class FakeOpenFlow (object):
+  def __init__ (self):
+    self.connections = {}
+  def getConnection (self, dpid):
+    return self.connections.get(dpid)
+
+class TestBatcher (FlowBatcher):
+  flushes = 0
+  def _schedule_flush (self):
+    self.flushes += 1
+
+
+class FlowBatcherTest (unittest.TestCase):
+  def setUp (self):
+    self.openflow = FakeOpenFlow()
+    core.components['openflow'] = self.openflow
+    for dpid in (1,2):
+      self.openflow.connections[dpid] = FakeConnection(dpid)
+    self.batcher = TestBatcher()
+
+  def tearDown (self):
+    del core.components['openflow']
+
+  def _barrier (self, batch):
+    con = self.openflow.connections[batch.dpid]
+    self.batcher._handle_openflow_BarrierIn(
+        BarrierIn(con, of.ofp_barrier_reply(xid = batch.xid)))
+
+  def test_batch (self):
+    con1 = self.openflow.connections[1]
+    b1 = self.batcher.send(1, of.ofp_flow_mod())
+    b2 = self.batcher.send(con1, [of.ofp_flow_mod(), of.ofp_flow_mod()])
+    b3 = self.batcher.send(2, of.ofp_flow_mod())
+    self.assertTrue(b1 is b2)
+    self.assertFalse(b1 is b3)
+    self.assertEqual(self.batcher.flushes, 1)
+    self.assertEqual(con1.sent, [])
+
+    self.batcher.flush()
+    self.assertEqual(len(con1.sent), 1)
+    msgs = con1.sent[0]
+    self.assertEqual(len(msgs), 4)
+    self.assertTrue(isinstance(msgs[-1], of.ofp_barrier_request))
+    self.assertEqual(set(m.xid for m in msgs), set([b1.xid]))
+    self.assertNotEqual(b1.xid, b3.xid)
+
+    # Sending again starts a new batch
+    b4 = self.batcher.send(1, of.ofp_flow_mod())
+    self.assertFalse(b4 is b1)
+    self.assertEqual(self.batcher.flushes, 2)
+
+    done = []
+    b1.add_callback(done.append)
+    self._barrier(b1)
+    self.assertEqual(done, [b1])
+    self.assertTrue(b1.ok)
+    self.assertFalse(b3.done)
+
+    # Callbacks added later are called right away
+    b1.add_callback(done.append)
+    self.assertEqual(done, [b1, b1])
+
+    # A barrier for someone else's XID doesn't matter
+    self._barrier(b4)
+    self.assertFalse(b4.done)
+    self.assertEqual(self.batcher.stats['messages'], 4)
+    self.assertEqual(self.batcher.stats['ok'], 1)
+
+  def test_max_batch (self):
+    self.batcher.max_batch = 3
+    con = self.openflow.connections[1]
+    b1 = self.batcher.send(1, [of.ofp_flow_mod(), of.ofp_flow_mod()])
+    b2 = self.batcher.send(1, of.ofp_flow_mod())
+    self.assertTrue(b1 is b2)
+    self.assertEqual(len(con.sent), 1)
+    b3 = self.batcher.send(1, of.ofp_flow_mod())
+    self.assertFalse(b3 is b1)
+    self.batcher.flush()
+    self.assertEqual([len(m) for m in con.sent], [4, 2])
+
+  def test_error (self):
+    con = self.openflow.connections[1]
+    b = self.batcher.send(1, of.ofp_flow_mod())
+    self.batcher.flush()
+    event = ErrorIn(con, of.ofp_error(xid = b.xid))
+    self.batcher._handle_openflow_ErrorIn(event)
+    self.assertTrue(b.done)
+    self.assertFalse(b.ok)
+    self.assertTrue(b.error is event)
+    self.assertFalse(event.should_log)
+
+    # Barrier still comes back, but we're already done with it
+    self._barrier(b)
+    self.assertEqual(self.batcher.stats['ok'], 0)
+    self.assertEqual(self.batcher.stats['errors'], 1)
+
+  def test_disconnect (self):
+    con = self.openflow.connections[1]
+    b1 = self.batcher.send(1, of.ofp_flow_mod())
+    self.batcher.flush()
+    b2 = self.batcher.send(1, of.ofp_flow_mod())
+    self.batcher._handle_openflow_ConnectionDown(ConnectionDown(con))
+    self.assertTrue(b1.disconnected and b1.done)
+    self.assertTrue(b2.disconnected and b2.done)
+
+    # Switches which are gone when we flush fail right away
+    b3 = self.batcher.send(3, of.ofp_flow_mod())
+    self.batcher.flush()
+    self.assertTrue(b3.disconnected and b3.done)
+    self.assertEqual(self.batcher.stats['disconnected'], 3)
+    self.assertEqual(self.batcher._pending, {})
+
+  def test_timeout (self):
+    b1 = self.batcher.send(1, of.ofp_flow_mod())
+    self.batcher.flush()
+    b2 = self.batcher.send(2, of.ofp_flow_mod())
+    self.batcher.flush()
+    b2.sent_at = b1.sent_at + 10
+    done = []
+    b1.add_callback(done.append)
+
+    self.batcher.expire_pending(now=b1.sent_at + 5)
+    self.assertFalse(b1.done)
+    self.batcher.expire_pending(now=b1.sent_at + self.batcher.batch_timeout + 1)
+    self.assertEqual(done, [b1])
+    self.assertTrue(b1.timed_out)
+    self.assertFalse(b1.ok)
+    self.assertFalse(b2.done)
+    self.assertEqual(self.batcher._pending.values(), [b2])
+    self.assertEqual(self.batcher.stats['timed_out'], 1)
+
+    # A late barrier doesn't count
+    self._barrier(b1)
+    self.assertEqual(self.batcher.stats['ok'], 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+import unittest
+import sys
+import os.path
+import threading
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.core import core
+from pox.openflow import ConnectionUp, FlowStatsReceived, BarrierIn
+from pox.openflow import FlowRemoved, ErrorIn
+from pox.openflow.flow_shadow import FlowShadow, ShadowFlowTable
+from pox.openflow.libopenflow_01 import *
+from pox.openflow.libopenflow_01 import _message_type_to_class
+from pox.lib.addresses import EthAddr
+
+class FakeConnection (object):
+  def __init__ (self, dpid):
+    self.dpid = dpid
+    self.flow_shadow = None
+    self.sent = []
+  def send (self, msg):
+    # Like the real thing, only flow_mod objects get recorded
+    if self.flow_shadow is not None and isinstance(msg, ofp_flow_mod):
+      self.flow_shadow.record_flow_mod(msg)
+    if type(msg) is bytes:
+      msg = _message_type_to_class[ord(msg[1])].unpack_new(msg)[1]
+    self.sent.append(msg)
+  def send_many (self, msgs):
+    for msg in msgs:
+      self.send(msg)
+
+class FakeOpenFlow (object):
+  clear_flows_on_connect = True
+
+def _flow (n, **kw):
+  return ofp_flow_mod(match=ofp_match(dl_dst=EthAddr("00:00:00:00:00:%02x"%n)),
+                      actions=[ofp_action_output(port=n)], **kw)
+
+def _wire (match):
+  """ match as a switch would report it """
+  m = ofp_match()
+  m.unpack(match.pack(flow_mod=True))
+  return m
+
+def _stats (fm, **kw):
+  kw.setdefault('actions', fm.actions)
+  return ofp_flow_stats(match=_wire(fm.match), priority=fm.priority, **kw)
+
+
+class ShadowFlowTableTest (unittest.TestCase):
+  def test_record (self):
+    t = ShadowFlowTable()
+    t.record_flow_mod(_flow(1))
+    t.record_flow_mod(_flow(2, flags=OFPFF_CHECK_OVERLAP))
+    t.record_flow_mod(_flow(1))
+    self.assertEqual(len(t), 2)
+    t.record_flow_mod(ofp_flow_mod(command=OFPFC_DELETE, match=ofp_match(),
+                                   out_port=2))
+    self.assertEqual([e.actions[0].port for e in t.entries], [1])
+
+  def test_modify_as_add (self):
+    t = ShadowFlowTable()
+    t.record_flow_mod(_flow(1, command=OFPFC_MODIFY, idle_timeout=10,
+                            hard_timeout=30, cookie=7,
+                            flags=OFPFF_SEND_FLOW_REM|OFPFF_CHECK_OVERLAP))
+    e = t.entries[0]
+    self.assertEqual((e.idle_timeout, e.hard_timeout, e.cookie, e.flags),
+                     (10, 30, 7, OFPFF_SEND_FLOW_REM))
+    # It's timed, so it's not put back on reconnect
+    adds, modifies, deletes, forget = t.diff([])
+    self.assertEqual((adds, forget), ([], [e]))
+    self.assertEqual(t.remove_expired_entries(now=e.counters['created'] + 31),
+                     [e])
+
+  def test_threads (self):
+    """ recording from another thread doesn't mess up the table """
+    t = ShadowFlowTable()
+    flows = [_flow(n % 200, idle_timeout=n % 2) for n in range(2000)]
+    def sender ():
+      for fm in flows:
+        t.record_flow_mod(fm)
+    thread = threading.Thread(target=sender)
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    try:
+      thread.start()
+      n = 0
+      while thread.is_alive():
+        t.forget(_wire(flows[n % 200].match), OFP_DEFAULT_PRIORITY)
+        t.remove_expired_entries(now=0)
+        n += 7
+    finally:
+      sys.setcheckinterval(interval)
+    self.assertEqual(len(t._table), len(t._entry_info))
+    self.assertEqual(sum(g.count for g in t._groups.values()), len(t))
+    t.remove_entries(list(t.entries))
+    self.assertEqual(len(t), 0)
+
+  def test_diff (self):
+    t = ShadowFlowTable()
+    keep = _flow(1)
+    changed = _flow(2)
+    missing = _flow(3)
+    expired = _flow(4, idle_timeout=10)
+    for fm in (keep, changed, missing, expired):
+      t.record_flow_mod(fm)
+
+    arp = ofp_flow_mod(match=ofp_match(dl_type=0x806, nw_proto=1,
+                                       nw_dst="10.0.0.1"))
+    t.record_flow_mod(arp)
+
+    unknown = _flow(5)
+    unknown_timed = _flow(6)
+
+    adds, modifies, deletes, forget = t.diff([
+        _stats(keep),
+        _stats(changed, actions=[ofp_action_output(port=9)]),
+        _stats(unknown),
+        _stats(unknown_timed, hard_timeout=5),
+        _stats(arp),
+    ])
+    self.assertEqual(len(t), 5)
+    self.assertEqual([fm.match for fm in adds], [missing.match])
+    self.assertEqual(adds[0].command, OFPFC_ADD)
+    self.assertEqual(adds[0].actions, missing.actions)
+    self.assertEqual([fm.match for fm in modifies], [changed.match])
+    self.assertEqual(modifies[0].command, OFPFC_MODIFY_STRICT)
+    self.assertEqual(modifies[0].actions, changed.actions)
+    self.assertEqual([fm.match for fm in deletes], [_wire(unknown.match)])
+    self.assertEqual(deletes[0].command, OFPFC_DELETE_STRICT)
+    self.assertEqual([e.match for e in forget], [expired.match])
+
+
+class FlowShadowTest (unittest.TestCase):
+  def setUp (self):
+    core.components['openflow'] = FakeOpenFlow()
+    self.shadow = FlowShadow()
+
+  def tearDown (self):
+    del core.components['openflow']
+
+  def _connect (self):
+    con = FakeConnection(1)
+    self.shadow._handle_openflow_ConnectionUp(ConnectionUp(con, None))
+    return con
+
+  def test_reconnect (self):
+    self.assertEqual(self.shadow.clear_on_first_connect, True)
+    self.assertEqual(core.openflow.clear_flows_on_connect, False)
+
+    con = self._connect()
+    self.assertEqual([m.command for m in con.sent], [OFPFC_DELETE])
+    for n in (1, 2, 3):
+      con.send(_flow(n))
+    fm = _flow(2)
+    fr = ofp_flow_removed(match=_wire(fm.match), priority=fm.priority)
+    self.shadow._handle_openflow_FlowRemoved(FlowRemoved(con, fr))
+
+    # It comes back with one of ours and one we don't know about
+    con = self._connect()
+    self.assertEqual(len(con.sent), 1)
+    sr = con.sent[0]
+    self.assertTrue(isinstance(sr.body, ofp_flow_stats_request))
+    reply = ofp_stats_reply(xid=sr.xid, type=OFPST_FLOW,
+                            body=[_stats(_flow(1)), _stats(_flow(4))])
+    self.shadow._handle_openflow_FlowStatsReceived(
+        FlowStatsReceived(con, [reply]))
+    sent = con.sent[1:]
+    self.assertEqual([(m.command, [a.port for a in m.actions])
+                      for m in sent[:-1]],
+                     [(OFPFC_DELETE_STRICT, []), (OFPFC_ADD, [3])])
+    self.assertTrue(isinstance(sent[-1], ofp_barrier_request))
+    self.assertEqual(len(self.shadow.tables[1]), 2)
+
+    self.shadow._handle_openflow_BarrierIn(
+        BarrierIn(con, ofp_barrier_reply(xid=sent[-1].xid)))
+    self.assertEqual(self.shadow.stats['reconciles'], 1)
+    self.assertEqual(self.shadow._finishing, {})
+
+  def test_stats_failed (self):
+    con = self._connect()
+    for n in (1, 2):
+      con.send(_flow(n))
+    con = self._connect()
+    sr = con.sent[0]
+    # Something else installs a flow before the switch says no
+    con.send(_flow(3, idle_timeout=10))
+    err = ofp_error(xid=sr.xid, type=OFPET_BAD_REQUEST,
+                    code=OFPBRC_BAD_STAT)
+    self.shadow._handle_openflow_ErrorIn(ErrorIn(con, err))
+
+    sent = con.sent[2:]
+    self.assertEqual(sent[0].command, OFPFC_DELETE)
+    self.assertEqual(sorted((m.command, m.actions[0].port, m.idle_timeout)
+                            for m in sent[1:-1]),
+                     [(OFPFC_ADD, 1, 0), (OFPFC_ADD, 2, 0), (OFPFC_ADD, 3, 10)])
+    self.assertTrue(isinstance(sent[-1], ofp_barrier_request))
+    table = self.shadow.tables[1]
+    self.assertTrue(con.flow_shadow is table)
+    self.assertEqual(sorted(e.actions[0].port for e in table.entries),
+                     [1, 2, 3])
+    self.assertEqual(self.shadow._reconciling, {})
+
+  def test_flow_mod_failed (self):
+    con = self._connect()
+    fm = _flow(1)
+    con.send(fm)
+    con.send(_flow(2))
+    err = ofp_error(type=OFPET_FLOW_MOD_FAILED, code=OFPFMFC_ALL_TABLES_FULL,
+                    data=fm.pack()[:64])
+    self.shadow._handle_openflow_ErrorIn(ErrorIn(con, err))
+    self.assertEqual([e.actions[0].port for e in self.shadow.tables[1].entries],
+                     [2])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -8,6 +8,7 @@ Implementation of an OpenFlow flow table
 from collections import namedtuple
 
 import time
+import random
 
 import unittest
 import sys
@@ -83,6 +84,22 @@ class FlowTableTest(unittest.TestCase):
       t.remove_matching_entries(match, priority=priority, strict=strict)
       self.assertEqual([e.cookie for e in t._table], remaining)
 
+  def test_add_twice(self):
+    """ adding an entry that's already there doesn't duplicate it """
+    t = FlowTable()
+    e1 = TableEntry(now=0, priority=5, cookie=1, idle_timeout=5,
+                    match=ofp_match(in_port=1))
+    e2 = TableEntry(priority=5, cookie=2, match=ofp_match(in_port=2))
+    t.add_entry(e1)
+    t.add_entry(e2)
+    t.add_entry(e1)
+    self.assertEqual([e.cookie for e in t.entries], [2, 1])
+    self.assertEqual(t.remove_expired_entries(now=10), [e1])
+    t.remove_entry(e2)
+    self.assertEqual(len(t), 0)
+    self.assertEqual(t._entry_info, {})
+    self.assertRaises(ValueError, t.remove_entry, e2)
+
   def test_remove_expired_entries(self):
     """ test that flow can get expired as time passes """
     t = FlowTable()
@@ -101,6 +118,101 @@ class FlowTableTest(unittest.TestCase):
       t.remove_expired_entries(now=time)
       self.assertEqual([e.cookie for e in t.entries ], remaining)
 
+  def test_expiry_heap(self):
+    """ expiry only looks at due entries but agrees with is_expired """
+    rng = random.Random(2)
+    t = FlowTable()
+    entries = []
+    for i in range(200):
+      e = TableEntry(now=0, cookie=i, idle_timeout=rng.choice([0, 5, 10]),
+                     hard_timeout=rng.choice([0, 20, 30]),
+                     match=ofp_match(in_port=i))
+      t.add_entry(e)
+      entries.append(e)
+    # Take some out and put one back
+    for e in entries[:50]:
+      t.remove_entry(e)
+    t.add_entry(entries[0])
+
+    for now in range(1, 40):
+      for e in rng.sample(t.entries, len(t.entries) // 4):
+        e.touch_packet(1, now=now)
+      expected = [e for e in t.entries if e.is_expired(now)]
+      self.assertEqual(t.expired_entries(now=now), expected)
+      self.assertEqual(t.remove_expired_entries(now=now), expected)
+      self.assertEqual([e for e in t.entries if e.is_expired(now)], [])
+      n = t.next_expiry_time()
+      if n is not None: self.assertTrue(n >= now)
+    self.assertTrue(len(t._expiry_heap) <= 2 * len(t) + 1)
+    t.remove_expired_entries(now=1000)
+    self.assertTrue(all(e.idle_timeout == 0 and e.hard_timeout == 0
+                        for e in t.entries))
+    self.assertEqual(t.next_expiry_time(), None)
+
+  def test_indexed_lookups(self):
+    """ indexed lookups agree with scanning the table in order """
+    from pox.lib.packet import ethernet, ipv4, tcp
+    rng = random.Random(1)
+    macs = [EthAddr("00:00:00:00:00:0%i" % i) for i in range(1,4)]
+    ips = ["10.0.0.1", "10.0.1.2", "10.1.0.3", "11.0.0.4"]
+
+    def packet():
+      t = tcp(srcport=rng.choice([1000, 2000]), dstport=rng.choice([22, 80]))
+      ip = ipv4(srcip=IPAddr(rng.choice(ips)), dstip=IPAddr(rng.choice(ips)),
+                protocol=ipv4.TCP_PROTOCOL, payload=t)
+      return ethernet(src=rng.choice(macs), dst=rng.choice(macs),
+                      type=ethernet.IP_TYPE, payload=ip)
+
+    def random_match():
+      if rng.random() < 0.2:
+        # exact match
+        return ofp_match.from_packet(packet(), rng.choice([1, 2]))
+      m = ofp_match()
+      if rng.random() < 0.5: m.in_port = rng.choice([1, 2])
+      if rng.random() < 0.5: m.dl_src = rng.choice(macs)
+      if rng.random() < 0.5:
+        m.dl_type = ethernet.IP_TYPE
+        if rng.random() < 0.7:
+          m.nw_src = rng.choice(["10.0.0.0/8", "10.0.0.0/16", "10.0.1.0/24",
+                                 "10.0.0.1/32"])
+        if rng.random() < 0.5: m.nw_dst = rng.choice(ips)
+        if rng.random() < 0.5:
+          m.nw_proto = ipv4.TCP_PROTOCOL
+          m.tp_dst = rng.choice([22, 80])
+      return m
+
+    t = FlowTable()
+    added = []
+    for i in range(300):
+      e = TableEntry(priority=rng.randint(1, 5), cookie=i, match=random_match())
+      t.add_entry(e)
+      added.append(e)
+    for e in rng.sample(added, 100):
+      t.remove_entry(e)
+      added.remove(e)
+
+    # table order is by priority (exact matches first), then age
+    rank = lambda e: e.priority if e.match.is_wildcarded else (1<<16) + 1
+    self.assertEqual(t.entries, sorted(added, key=rank, reverse=True))
+
+    for i in range(500):
+      p = packet()
+      in_port = rng.choice([1, 2])
+      pm = ofp_match.from_packet(p, in_port)
+      expected = None
+      for e in t.entries:
+        if e.match.matches_with_wildcards(pm, consider_other_wildcards=False):
+          expected = e
+          break
+      self.assertTrue(t.entry_for_packet(p, in_port) is expected)
+
+    for i in range(100):
+      m = rng.choice(added).match if i % 2 else random_match()
+      prio = rng.randint(1, 5)
+      for strict in (False, True):
+        expected = [e for e in t.entries if e.is_matched_by(m, prio, strict)]
+        self.assertEqual(t.matching_entries(m, prio, strict), expected)
+
 class SwitchFlowTableTest(unittest.TestCase):
   def test_process_flow_mod_add(self):
     """ test that simple insertion of a flow works"""
@@ -156,6 +268,29 @@ class SwitchFlowTableTest(unittest.TestCase):
     self.assertEquals([e.cookie for e in t.entries if e.actions == [ofp_action_output(port=8)] ], [2])
     self.assertEquals(len(t.entries), 3)
 
+  def test_process_flow_mod_delete(self):
+    """ test that deletes remove what they should """
+    def table():
+      t = SwitchFlowTable()
+      t.add_entry(TableEntry(priority=6, cookie=0x1, match=ofp_match(dl_src=EthAddr("00:00:00:00:00:01"),nw_src="1.2.3.4"), actions=[ofp_action_output(port=5)]))
+      t.add_entry(TableEntry(priority=5, cookie=0x2, match=ofp_match(dl_src=EthAddr("00:00:00:00:00:02"), nw_src="1.2.3.0/24"), actions=[ofp_action_output(port=6)]))
+      t.add_entry(TableEntry(priority=1, cookie=0x3, match=ofp_match(), actions=[]))
+      return t
+
+    t = table()
+    t.process_flow_mod(ofp_flow_mod(command = OFPFC_DELETE, match=ofp_match(nw_src="1.2.0.0/16")))
+    self.assertEquals([e.cookie for e in t.entries], [3])
+
+    t = table()
+    t.process_flow_mod(ofp_flow_mod(command = OFPFC_DELETE, match=ofp_match(), out_port=6))
+    self.assertEquals([e.cookie for e in t.entries], [1, 3])
+
+    t = table()
+    t.process_flow_mod(ofp_flow_mod(command = OFPFC_DELETE_STRICT, priority=5, match=ofp_match(nw_src="1.2.0.0/16")))
+    self.assertEquals(len(t.entries), 3)
+    t.process_flow_mod(ofp_flow_mod(command = OFPFC_DELETE_STRICT, priority=1, match=ofp_match()))
+    self.assertEquals([e.cookie for e in t.entries], [1, 2])
+
 
 if __name__ == '__main__':
   unittest.main()
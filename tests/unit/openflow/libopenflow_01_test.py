@@ -120,6 +120,83 @@ class ofp_match_test(unittest.TestCase):
     assertMatch(create(nw_src="10.0.0.0/25"), create(nw_src="10.0.0.127"))
     assertNoMatch(create(nw_src="10.0.0.0/25"), create(nw_src="10.0.0.128"))
 
+  def _random_frames (self, rng):
+    """
+    Generates random frames, some of them truncated or mangled
+    """
+    from pox.lib.packet import ethernet, vlan, ipv4, arp, tcp, udp, icmp
+    from pox.lib.addresses import EthAddr, IPAddr
+    def eth_addr ():
+      return EthAddr("".join(chr(rng.randint(0, 255)) for i in range(6)))
+    def ip_addr ():
+      return IPAddr(rng.randint(0, 0xffffffff))
+
+    for i in range(2000):
+      kind = rng.choice(["tcp", "tcp_opts", "udp", "icmp", "ip", "arp",
+                         "other"])
+      if kind == "arp":
+        p = arp(opcode=rng.choice([1, 2, 300]), hwsrc=eth_addr(),
+                protosrc=ip_addr(), protodst=ip_addr())
+        eth_type = ethernet.ARP_TYPE
+      elif kind == "other":
+        p = "x" * rng.randint(0, 40)
+        eth_type = rng.choice([0x1234, 0x88cc, 0x40])
+      else:
+        if kind.startswith("tcp"):
+          tp = tcp(srcport=rng.randint(0, 0xffff),
+                   dstport=rng.randint(0, 0xffff), off=5)
+          if kind == "tcp_opts":
+            tp.off = 6
+            tp.payload = "\x01\x01\x01\x00" # NOP NOP NOP EOL
+          tp.payload += "y" * rng.randint(0, 20)
+          proto = ipv4.TCP_PROTOCOL
+        elif kind == "udp":
+          tp = udp(srcport=rng.randint(1024, 0xffff),
+                   dstport=rng.randint(1024, 0xffff),
+                   payload="z" * rng.randint(0, 20))
+          proto = ipv4.UDP_PROTOCOL
+        elif kind == "icmp":
+          tp = icmp(type=rng.choice([3, 13, 42]), code=rng.randint(0, 15),
+                    payload="w" * rng.randint(0, 40))
+          proto = ipv4.ICMP_PROTOCOL
+        else:
+          tp = "v" * rng.randint(0, 20)
+          proto = rng.choice([2, 47, 99])
+        p = ipv4(srcip=ip_addr(), dstip=ip_addr(), protocol=proto,
+                 tos=rng.randint(0, 255), payload=tp)
+        eth_type = ethernet.IP_TYPE
+
+      if rng.random() < 0.3:
+        p = vlan(id=rng.randint(0, 4095), pcp=rng.randint(0, 7),
+                 eth_type=eth_type, payload=p)
+        eth_type = ethernet.VLAN_TYPE
+      data = ethernet(src=eth_addr(), dst=eth_addr(), type=eth_type,
+                      payload=p).pack()
+
+      if rng.random() < 0.2:
+        data = data[:rng.randint(0, len(data))]
+      if rng.random() < 0.2:
+        # Mangle a header byte
+        pos = rng.randint(0, min(len(data), 60))
+        data = data[:pos] + chr(rng.randint(0, 255)) + data[pos+1:]
+      yield data
+
+  def test_from_raw (self):
+    """ ofp_match: from_raw() agrees with from_packet() """
+    import random
+    from pox.lib.packet import ethernet
+    rng = random.Random(22)
+    for data in self._random_frames(rng):
+      in_port = rng.choice([None, 1])
+      try:
+        expected = ofp_match.from_packet(ethernet(data), in_port)
+      except Exception:
+        # The packet library choked on it
+        continue
+      m = ofp_match.from_raw(data, in_port)
+      self.assertEqual(m, expected)
+      self.assertEqual(m.pack(), expected.pack())
+
 class ofp_command_test(unittest.TestCase):
   # custom map of POX class to header type, for validation
   ofp_type = {
@@ -340,5 +417,48 @@ class ofp_action_test(unittest.TestCase):
 #    c(ofp_action_mpls_tc, OFPAT_SET_MPLS_TC, {'mpls_tc': 0xac}, 8)
 #    c(ofp_action_mpls_ttl, OFPAT_SET_MPLS_TTL, {'mpls_ttl': 0xaf}, 8)
 
+class ofp_lazy_unpack_test(unittest.TestCase):
+  def test_stats_reply(self):
+    """ lazily unpacked stats bodies match eagerly unpacked ones """
+    flows = [ofp_flow_stats(match=ofp_match(in_port=i, dl_type=0x800),
+                            priority=i, packet_count=i * 10,
+                            actions=[ofp_action_output(port=i)])
+             for i in range(1, 4)]
+    packed = ofp_stats_reply(xid=7, type=OFPST_FLOW, body=flows).pack()
+
+    _, eager = ofp_stats_reply.unpack_new(packed)
+    _, lazy = ofp_stats_reply.unpack_new_lazy(packed)
+    self.assertEqual(lazy._body_raw, packed[12:])
+    self.assertEqual(len(lazy), len(packed))
+    self.assertEqual(lazy.pack(), packed)
+    self.assertEqual(lazy.xid, 7)
+    self.assertEqual(lazy._body_raw, packed[12:])
+
+    self.assertEqual(lazy.body, flows)
+    self.assertEqual(lazy, eager)
+    self.assertEqual(lazy._body_raw, None)
+    self.assertEqual(lazy.pack(), packed)
+
+  def test_features_reply(self):
+    """ lazily unpacked port lists match eagerly unpacked ones """
+    ports = [ofp_phy_port(port_no=i, name="eth%s" % (i,),
+                          hw_addr=EthAddr("00:00:00:00:00:%02x" % (i,)))
+             for i in range(1, 5)]
+    packed = ofp_features_reply(datapath_id=42, ports=ports).pack()
+
+    _, lazy = ofp_features_reply.unpack_new_lazy(packed)
+    self.assertEqual(lazy.datapath_id, 42)
+    self.assertEqual(len(lazy), len(packed))
+    self.assertEqual(lazy.pack(), packed)
+    self.assertEqual(lazy.ports, ports)
+    self.assertEqual(lazy, ofp_features_reply.unpack_new(packed)[1])
+
+  def test_unsupported(self):
+    """ classes without lazy support unpack normally """
+    packed = ofp_echo_request(xid=3, body="hello").pack()
+    _, o = ofp_echo_request.unpack_new_lazy(packed)
+    self.assertEqual(o.body, "hello")
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.openflow.libopenflow_01 import *
+from pox.openflow.of_01 import Connection, sendBatcher
+import pox.openflow.of_01 as of_01
+from pox.openflow import PacketIn, PortStatus, ConnectionCongestion
+from pox.openflow import OpenFlowNexus
+from pox.lib.mock_socket import MockSocket
+import socket
+import struct
+import threading
+from errno import EAGAIN
+
+class MockNexus (object):
+  def raiseEventNoErrors (self, event, *args, **kw):
+    return None
+  def _disconnect (self, dpid):
+    pass
+
+class ConnectionTestBase (unittest.TestCase):
+  def setUp (self):
+    self.switch, sock = MockSocket.pair()
+    self.con = Connection(sock)
+    self.con.ofnexus = MockNexus()
+    # Connection starts by sending a HELLO
+    hello = self.switch.recv()
+    self.assertEqual(ord(hello[1]), OFPT_HELLO)
+
+  def feed (self, data, chunk):
+    """ send data to the Connection, chunk bytes at a time """
+    while data:
+      self.switch.send(data[:chunk])
+      data = data[chunk:]
+      while self.con.sock.ready_to_recv():
+        self.assertTrue(self.con.read())
+
+  def replies (self):
+    data = self.switch.recv()
+    r = []
+    while data:
+      offset, msg = ofp_echo_reply.unpack_new(data)
+      r.append(msg.xid)
+      data = data[offset:]
+    return r
+
+class ConnectionReadTest (ConnectionTestBase):
+  def test_split_messages (self):
+    """ messages that straddle reads are reassembled """
+    data = b''.join(ofp_echo_request(xid=x).pack() for x in range(1,101))
+    for chunk in (1, 3, 8, 13, 100, 2048, len(data)):
+      self.feed(data, chunk)
+      self.assertEqual(self.replies(), range(1,101))
+      self.assertEqual(self.con._buf_start, self.con._buf_end)
+
+  def test_large_message (self):
+    """ a message larger than the receive buffer grows the buffer """
+    got = []
+    self.con.addListener(PacketIn, lambda e: got.append(e.ofp.data))
+    payload = "".join(chr(i % 256) for i in range(3 * Connection.recv_size))
+    pi = ofp_packet_in(in_port=1, data=payload)
+    data = ofp_echo_request(xid=7).pack() + pi.pack()
+    data += ofp_echo_request(xid=8).pack()
+    self.feed(data, 1000)
+    self.assertEqual(got, [payload])
+    self.assertEqual(type(got[0]), bytes)
+    self.assertEqual(self.replies(), [7, 8])
+
+  def test_bad_length (self):
+    """ messages shorter than a header drop the connection """
+    # PACKET_IN is skipped (nobody's listening); ECHO_REQUEST is handled
+    for ofp_type in (OFPT_PACKET_IN, OFPT_ECHO_REQUEST):
+      for length in (0, 4):
+        self.setUp()
+        self.switch.send(struct.pack("!BBHL", OFP_VERSION, ofp_type,
+                                     length, 1) + "\x00" * 8)
+        self.assertFalse(self.con.read())
+
+class ConnectionDispatchTest (ConnectionTestBase):
+  def setUp (self):
+    ConnectionTestBase.setUp(self)
+    self.unpacked = []
+    def unpack (raw, offset):
+      self.unpacked.append(raw[offset+1])
+      return unpack_new(raw, offset)
+    unpack_new = of_01.unpackers[OFPT_PACKET_IN]
+    of_01.unpackers[OFPT_PACKET_IN] = unpack
+    self.addCleanup(of_01.unpackers.__setitem__, OFPT_PACKET_IN, unpack_new)
+
+  def test_unwatched (self):
+    """ messages nobody listens for aren't unpacked """
+    self.feed(ofp_packet_in(in_port=1, data="x"*60).pack(), 1000)
+    self.assertEqual(self.unpacked, [])
+
+    got = []
+    self.con.addListener(PacketIn, lambda e: got.append(e.port))
+    self.feed(ofp_packet_in(in_port=2, data="x"*60).pack(), 1000)
+    self.assertEqual(got, [2])
+    self.assertEqual(len(self.unpacked), 1)
+
+  def test_nexus_listeners (self):
+    """ listeners on the nexus count too """
+    nexus = OpenFlowNexus()
+    self.con.dpid = 1
+    self.con.ofnexus = nexus
+    nexus._connect(self.con)
+    self.feed(ofp_packet_in(in_port=1, data="x"*60).pack(), 1000)
+    self.assertEqual(self.unpacked, [])
+
+    got = []
+    listener = nexus.addListener(PacketIn, lambda e: got.append(e.port))
+    self.feed(ofp_packet_in(in_port=2, data="x"*60).pack(), 1000)
+    self.assertEqual(got, [2])
+
+    nexus.removeListener(listener)
+    self.feed(ofp_packet_in(in_port=3, data="x"*60).pack(), 1000)
+    self.assertEqual(got, [2])
+    self.assertEqual(len(self.unpacked), 1)
+
+  def test_quiet_handler (self):
+    """ port status still updates ports with nobody listening """
+    port = ofp_phy_port(port_no=5, name="eth5")
+    self.feed(ofp_port_status(reason=OFPPR_ADD, desc=port).pack(), 1000)
+    self.assertEqual(self.con.ports[5].name, "eth5")
+
+    got = []
+    self.con.addListener(PortStatus, lambda e: got.append(e.port))
+    self.feed(ofp_port_status(reason=OFPPR_DELETE, desc=port).pack(), 1000)
+    self.assertEqual(got, [5])
+
+class ThrottledSocket (object):
+  """ a socket that only takes as much as it's told to """
+  def __init__ (self):
+    self.room = 1000000
+    self.sent = []
+  def send (self, data):
+    if self.room == 0:
+      raise socket.error(EAGAIN, "Resource temporarily unavailable")
+    l = min(self.room, len(data))
+    self.room -= l
+    self.sent.append(data[:l])
+    return l
+  def shutdown (self, how):
+    pass
+
+class ConnectionSendTest (unittest.TestCase):
+  def setUp (self):
+    self.sock = ThrottledSocket()
+    self.con = Connection(self.sock)
+    self.con.ofnexus = MockNexus()
+    self.sock.sent = [] # Forget the HELLO
+    self.events = []
+    self.con.addListener(ConnectionCongestion,
+                         lambda e: self.events.append(e.congested))
+
+  def test_queue_and_flush (self):
+    msgs = [ofp_echo_request(xid=x, body="x"*100).pack()
+            for x in range(1,3001)]
+    self.sock.room = 50
+    for m in msgs:
+      self.con.send(m)
+    # The rest is queued, in order, and the connection is congested
+    self.assertTrue(self.con.congested)
+    self.assertEqual(self.events, [True])
+    self.assertEqual(len(self.sock.sent), 1)
+
+    self.sock.room = 1000000
+    self.assertTrue(self.con._flush())
+    self.assertFalse(self.con.congested)
+    self.assertEqual(self.events, [True, False])
+    self.assertEqual("".join(self.sock.sent), "".join(msgs))
+    # Coalesced into few sends
+    self.assertTrue(len(self.sock.sent) < 10)
+
+  def test_partial_flush (self):
+    self.sock.room = 0
+    self.con.send(ofp_echo_request(xid=1).pack())
+    self.con.send(ofp_echo_request(xid=2).pack())
+    self.sock.room = 12
+    self.assertFalse(self.con._flush())
+    self.sock.room = 100
+    self.assertTrue(self.con._flush())
+    self.assertEqual("".join(self.sock.sent),
+                     ofp_echo_request(xid=1).pack() +
+                     ofp_echo_request(xid=2).pack())
+    self.assertEqual(self.events, [])
+
+  def test_send_many (self):
+    msgs = [ofp_echo_request(xid=x) for x in range(1,6)]
+    self.con.send_many(msgs)
+    self.assertEqual(self.sock.sent, ["".join(m.pack() for m in msgs)])
+
+  def test_cork (self):
+    with self.con.cork():
+      self.con.send(ofp_echo_request(xid=1))
+      with self.con.cork():
+        self.con.send(ofp_echo_request(xid=2))
+      self.assertEqual(self.sock.sent, [])
+      self.con.send(ofp_echo_request(xid=3))
+    self.assertEqual(self.sock.sent, [ofp_echo_request(xid=1).pack() +
+                                      ofp_echo_request(xid=2).pack() +
+                                      ofp_echo_request(xid=3).pack()])
+
+  def test_batch (self):
+    sock2 = ThrottledSocket()
+    con2 = Connection(sock2)
+    sock2.sent = []
+    sendBatcher.begin()
+    try:
+      for x in range(1,4):
+        self.con.send(ofp_echo_request(xid=x))
+        con2.send(ofp_echo_request(xid=x))
+      self.assertEqual(self.sock.sent, [])
+    finally:
+      sendBatcher.end()
+    expected = [''.join(ofp_echo_request(xid=x).pack() for x in range(1,4))]
+    self.assertEqual(self.sock.sent, expected)
+    self.assertEqual(sock2.sent, expected)
+
+  def test_batch_other_thread (self):
+    """ sends from other threads aren't held by a batch """
+    sendBatcher.begin()
+    try:
+      t = threading.Thread(target=self.con.send,
+                           args=(ofp_echo_request(xid=1),))
+      t.start()
+      t.join()
+      self.assertEqual(self.sock.sent, [ofp_echo_request(xid=1).pack()])
+    finally:
+      sendBatcher.end()
+
+  def test_threads (self):
+    """ messages sent from several threads don't get mixed up """
+    self.sock.room = 5000
+    # (Making messages isn't thread-safe, so they're made up front)
+    msgs = {}
+    corked = {}
+    for x in range(1000, 5000):
+      msgs[x] = ofp_echo_request(xid=x, body="x"*50)
+      corked[x] = ofp_echo_request(xid=x, body="y")
+    def sender (first):
+      for x in range(first, first + 500):
+        self.con.send(msgs[x])
+        if x % 50 == 0:
+          with self.con.cork():
+            self.con.send(corked[x])
+    threads = [threading.Thread(target=sender, args=(n * 1000,))
+               for n in range(1, 5)]
+    # Switch threads as often as possible
+    interval = sys.getcheckinterval()
+    sys.setcheckinterval(1)
+    try:
+      for t in threads: t.start()
+      while any(t.is_alive() for t in threads):
+        self.sock.room = 5000
+        self.con._flush()
+    finally:
+      sys.setcheckinterval(interval)
+    self.sock.room = 1000000
+    self.assertTrue(self.con._flush())
+
+    data = "".join(self.sock.sent)
+    xids = []
+    while data:
+      offset, msg = ofp_echo_request.unpack_new(data)
+      self.assertTrue(msg.body in ("x"*50, "y"))
+      xids.append(msg.xid)
+      data = data[offset:]
+    self.assertEqual(len(xids), 4 * 510)
+    for n in range(1, 5):
+      mine = [x for x in xids if x // 1000 == n]
+      self.assertEqual(mine, sorted(mine))
+
+if __name__ == '__main__':
+  unittest.main()
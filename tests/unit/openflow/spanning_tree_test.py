@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+import unittest
+import sys
+import os.path
+
+sys.path.append(os.path.dirname(__file__) + "/../../..")
+
+from pox.core import core
+import pox.openflow.spanning_tree as st
+from pox.openflow.discovery import Discovery
+import pox.openflow.libopenflow_01 as of
+
+class FakePort (object):
+  def __init__ (self, port_no):
+    self.port_no = port_no
+    self.hw_addr = None
+
+class FakeConnection (object):
+  def __init__ (self, dpid, ports):
+    self.dpid = dpid
+    self.connect_time = 0
+    self.ports = dict((p, FakePort(p)) for p in range(1, ports + 1))
+    self.ports[of.OFPP_LOCAL] = FakePort(of.OFPP_LOCAL)
+    self.sent = []
+  def send (self, msg):
+    self.sent.append(msg)
+
+class FakeOpenFlow (object):
+  def __init__ (self):
+    self.connections = {}
+  def getConnection (self, dpid):
+    return self.connections.get(dpid)
+
+class FakeDiscovery (object):
+  send_cycle_time = 5
+  def __init__ (self):
+    self.adjacency = {}
+  def link (self, dpid1, port1, dpid2, port2):
+    l = Discovery.Link(dpid1, port1, dpid2, port2)
+    self.adjacency[l] = 0
+    self.adjacency[st._flip(l)] = 0
+    return [l, st._flip(l)]
+  def unlink (self, dpid1, port1, dpid2, port2):
+    l = Discovery.Link(dpid1, port1, dpid2, port2)
+    del self.adjacency[l]
+    del self.adjacency[st._flip(l)]
+    return [l, st._flip(l)]
+
+class FakeLinksChanged (object):
+  def __init__ (self, added = [], removed = []):
+    self.added = added
+    self.removed = removed
+
+
+class SpanningTreeTest (unittest.TestCase):
+  def test_calc (self):
+    links = [Discovery.Link(1,1, 2,1), Discovery.Link(2,1, 1,1),
+             Discovery.Link(2,2, 3,1), Discovery.Link(3,1, 2,2),
+             Discovery.Link(1,2, 3,2), Discovery.Link(3,2, 1,2),
+             Discovery.Link(4,1, 5,1), Discovery.Link(5,1, 4,1),
+             Discovery.Link(6,1, 7,1)] # One way only
+    adj, link_ports = st._get_adjacency(links)
+    self.assertEqual(adj[1], {2:1, 3:2})
+    self.assertEqual(adj[6], {})
+    self.assertTrue((7,1) in link_ports)
+
+    # Only the parts with a root in them
+    tree = st._calc_spanning_tree(adj, [3])
+    self.assertEqual(tree, {1:set([(2,1), (3,2)]), 2:set([(1,1)]),
+                            3:set([(1,2)])})
+    tree = st._calc_spanning_tree(adj, [5, 6])
+    self.assertEqual(tree, {4:set([(5,1)]), 5:set([(4,1)]), 6:set()})
+
+
+class UpdateTreeTest (unittest.TestCase):
+  def setUp (self):
+    self.openflow = FakeOpenFlow()
+    self.discovery = FakeDiscovery()
+    core.components['openflow'] = self.openflow
+    core.components['openflow_discovery'] = self.discovery
+    self._invalidate_ports = st._invalidate_ports
+    self._debounce_time = st._debounce_time
+    st._invalidate_ports = lambda dpid: None
+    st._debounce_time = 0
+    st._prev.clear()
+    st._dirty.clear()
+
+  def tearDown (self):
+    del core.components['openflow']
+    del core.components['openflow_discovery']
+    st._invalidate_ports = self._invalidate_ports
+    st._debounce_time = self._debounce_time
+    st._prev.clear()
+    st._dirty.clear()
+
+  def _sent (self):
+    r = {}
+    for dpid,con in self.openflow.connections.iteritems():
+      for msg in con.sent:
+        r.setdefault(dpid, {})[msg.port_no] = msg.config == 0
+      del con.sent[:]
+    return r
+
+  def _triangle (self):
+    for dpid in (1,2,3,4):
+      self.openflow.connections[dpid] = FakeConnection(dpid, 3)
+    added = []
+    added += self.discovery.link(1,1, 2,1)
+    added += self.discovery.link(2,2, 3,1)
+    added += self.discovery.link(1,2, 3,2)
+    st._handle_LinksChanged(FakeLinksChanged(added=added))
+    self.assertEqual(self._sent(), {1:{1:True, 2:True, 3:True},
+                                    2:{1:True, 2:False, 3:True},
+                                    3:{1:False, 2:True, 3:True}})
+
+  def test_update (self):
+    self._triangle()
+
+    # Nothing changed, so nothing is sent
+    st._update_tree(force_dpid = 2)
+    self.assertEqual(self._sent(), {})
+
+    # Only ports whose flood bits change get port mods
+    removed = self.discovery.unlink(1,2, 3,2)
+    st._handle_LinksChanged(FakeLinksChanged(removed=removed))
+    self.assertEqual(self._sent(), {2:{2:True}, 3:{1:True}})
+
+    # Switches in other parts of the network aren't looked at
+    self.assertFalse(4 in st._prev)
+
+  def test_isolated (self):
+    self._triangle()
+
+    # A switch which loses all its links floods everywhere again
+    removed = self.discovery.unlink(1,2, 3,2)
+    removed += self.discovery.unlink(2,2, 3,1)
+    st._handle_LinksChanged(FakeLinksChanged(removed=removed))
+    self.assertEqual(self._sent(), {2:{2:True}, 3:{1:True}})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -129,6 +129,55 @@ class SwitchImplTest(unittest.TestCase):
     self.assertEqual(event.port.port_no,3)
     self.assertEqual(event.packet, self.packet)
 
+  def test_microflow_cache(self):
+    c = self.conn
+    s = self.switch
+    lookups = []
+    real_lookup = s.table.entry_for_packet
+    def entry_for_packet(packet, in_port):
+      lookups.append(in_port)
+      return real_lookup(packet, in_port)
+    s.table.entry_for_packet = entry_for_packet
+    received = []
+    s.addListener(DpPacketOut, lambda(event): received.append(event))
+
+    # misses are remembered too
+    s.rx_packet(self.packet, in_port=1)
+    s.rx_packet(self.packet, in_port=1)
+    self.assertEqual(len(c.received), 2)
+    self.assertEqual(lookups, [1])
+
+    # adding a flow clears the cache
+    c.to_switch(ofp_flow_mod(priority=1, match=ofp_match(in_port=1),
+                             actions = [ ofp_action_output(port=3) ]))
+    s.rx_packet(self.packet, in_port=1)
+    s.rx_packet(self.packet, in_port=1)
+    self.assertEqual(lookups, [1, 1])
+    self.assertEqual([e.port.port_no for e in received], [3, 3])
+
+    # so does modifying one
+    c.to_switch(ofp_flow_mod(command=OFPFC_MODIFY, match=ofp_match(in_port=1),
+                             actions = [ ofp_action_output(port=2) ]))
+    s.rx_packet(self.packet, in_port=1)
+    self.assertEqual(received[-1].port.port_no, 2)
+
+    # different headers are different microflows
+    s.rx_packet(self.packet, in_port=2)
+    self.assertEqual(lookups, [1, 1, 1, 2])
+
+    # and removing them brings back the packet_ins
+    c.received = []
+    c.to_switch(ofp_flow_mod(command=OFPFC_DELETE_STRICT, priority=1,
+                             match=ofp_match(in_port=1)))
+    s.rx_packet(self.packet, in_port=1)
+    self.assertTrue(isinstance(c.last, ofp_packet_in))
+
+    # the cache doesn't grow past its size
+    s.microflow_cache_size = 2
+    for port in (1, 2, 3, 4):
+      s.rx_packet(self.packet, in_port=port)
+    self.assertEqual(len(s._microflows), 2)
+
   def test_delete_port(self):
     c = self.conn
     s = self.switch
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures EthAddr and IPAddr construction, hashing and dictionary lookup
+
+Addresses are made from raw bytes the way the packet library does it,
+drawn from a pool of "hosts" much like a busy MAC table would see.  Each
+test is run with the address cache off and with it on.
+
+Run from the top level:
+  ./tools/benchmarks/addresses_bench.py [host counts...]
+"""
+
+import sys
+import os.path
+import time
+import random
+import struct
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from pox.lib.addresses import EthAddr, IPAddr, set_cache_size
+
+ROUNDS = 200000
+
+
+def timed (f, items):
+  t = time.time()
+  f(items)
+  return (time.time() - t) / len(items) * 1e9
+
+def make_eth (raws):
+  for r in raws: EthAddr(r)
+
+def make_ip (raws):
+  for r in raws: IPAddr(r)
+
+def make_eth_str (strs):
+  for s in strs: EthAddr(s)
+
+def hash_all (addrs):
+  for a in addrs: hash(a)
+
+def to_unsigned (addrs):
+  for a in addrs: a.toUnsigned()
+
+def lookup (table, raws):
+  for r in raws: table.get(EthAddr(r))
+
+
+def main (counts):
+  print "%6s %6s %9s %9s %9s %9s %9s %9s" % ("hosts", "cache",
+      "eth (ns)", "ip (ns)", "str (ns)", "hash (ns)", "uint (ns)",
+      "dict (ns)")
+  for count in counts:
+    rng = random.Random(count)
+    eth_pool = [struct.pack("!HI", 0, rng.randint(0, 0xffffffff))
+                for i in range(count)]
+    ip_pool = [struct.pack("!I", rng.randint(0, 0xffffffff))
+               for i in range(count)]
+    eth_raws = [rng.choice(eth_pool) for i in xrange(ROUNDS)]
+    ip_raws = [rng.choice(ip_pool) for i in xrange(ROUNDS)]
+    strs = [str(EthAddr(r)) for r in eth_raws[:ROUNDS // 10]]
+
+    for cache in (None, count):
+      set_cache_size(cache)
+      eth = timed(make_eth, eth_raws)
+      ip = timed(make_ip, ip_raws)
+      s = timed(make_eth_str, strs)
+      addrs = [EthAddr(r) for r in eth_raws]
+      h = timed(hash_all, addrs)
+      u = timed(to_unsigned, [IPAddr(r) for r in ip_raws])
+      table = dict((EthAddr(r), i) for i,r in enumerate(eth_pool))
+      d = timed(lambda raws: lookup(table, raws), eth_raws)
+      print "%6i %6s %9.0f %9.0f %9.0f %9.0f %9.0f %9.0f" % (count,
+          "on" if cache else "off", eth, ip, s, h, u, d)
+    set_cache_size(None)
+
+
+if __name__ == "__main__":
+  counts = [int(x) for x in sys.argv[1:]] or [100, 10000]
+  main(counts)
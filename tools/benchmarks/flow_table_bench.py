@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures FlowTable insertion and lookup as the table grows
+
+The table is filled mostly with exact-match (microflow) entries like a
+reactive controller would install, plus some wildcarded ones spread over
+a handful of masks.  For each size, we time adding the entries, looking
+up packets with entry_for_packet(), and a strict matching_entries() like
+a flow_mod does.  Lookups are also timed with a linear scan of the table
+in order (what FlowTable used to do) for comparison.
+
+Run from the top level:
+  ./tools/benchmarks/flow_table_bench.py [sizes...]
+"""
+
+import sys
+import os.path
+import time
+import random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from pox.openflow.flow_table import FlowTable, TableEntry
+import pox.openflow.libopenflow_01 as of
+from pox.lib.packet import ethernet, ipv4, tcp
+from pox.lib.addresses import EthAddr, IPAddr
+
+LOOKUPS = 2000
+LINEAR_LOOKUPS = 20
+
+
+def make_packet (i):
+  t = tcp(srcport=1024 + i % 50000, dstport=80)
+  ip = ipv4(srcip=IPAddr(0x0a000000 + i), dstip=IPAddr(0x0b000000 + i % 256),
+            protocol=ipv4.TCP_PROTOCOL, payload=t)
+  return ethernet(src=EthAddr("00:00:00:00:%02x:%02x" % (i>>8 & 0xff, i&0xff)),
+                  dst=EthAddr("00:00:00:00:00:01"), type=ethernet.IP_TYPE,
+                  payload=ip)
+
+
+def make_entries (size, rng):
+  entries = []
+  for i in xrange(size):
+    if i % 10 == 0:
+      # Wildcarded: one of a few shapes
+      m = of.ofp_match(dl_type = ethernet.IP_TYPE)
+      shape = i % 4
+      if shape == 0:
+        m.nw_dst = IPAddr(0x0b000000 + rng.randint(0, 255))
+      elif shape == 1:
+        m.nw_src = "10.%i.0.0/16" % (rng.randint(0, 255),)
+      elif shape == 2:
+        m.nw_proto = ipv4.TCP_PROTOCOL
+        m.tp_dst = rng.randint(1, 1000)
+      else:
+        m.in_port = rng.randint(1, 48)
+      entries.append(TableEntry(priority=rng.randint(1, 100), match=m))
+    else:
+      m = of.ofp_match.from_packet(make_packet(i), 1)
+      entries.append(TableEntry(match=m))
+  return entries
+
+
+def linear_lookup (table, packet, in_port):
+  packet_match = of.ofp_match.from_packet(packet, in_port)
+  for entry in table.entries:
+    if entry.match.matches_with_wildcards(packet_match,
+                                          consider_other_wildcards=False):
+      return entry
+  return None
+
+
+def main (sizes):
+  print "%8s %10s %12s %12s %12s" % ("entries", "add (us)", "lookup (us)",
+                                     "strict (us)", "linear (us)")
+  for size in sizes:
+    rng = random.Random(size)
+    entries = make_entries(size, rng)
+    table = FlowTable()
+
+    t = time.time()
+    for e in entries:
+      table.add_entry(e)
+    add = (time.time() - t) / size
+
+    packets = [make_packet(rng.randint(0, size * 2)) for i in range(LOOKUPS)]
+    t = time.time()
+    for p in packets:
+      table.entry_for_packet(p, 1)
+    lookup = (time.time() - t) / LOOKUPS
+
+    matches = [rng.choice(entries).match for i in range(LOOKUPS)]
+    t = time.time()
+    for m in matches:
+      table.matching_entries(m, of.OFP_DEFAULT_PRIORITY, strict=True)
+    strict = (time.time() - t) / LOOKUPS
+
+    t = time.time()
+    for p in packets[:LINEAR_LOOKUPS]:
+      linear_lookup(table, p, 1)
+    linear = (time.time() - t) / LINEAR_LOOKUPS
+
+    print "%8i %10.1f %12.1f %12.1f %12.1f" % (size, add * 1e6, lookup * 1e6,
+                                               strict * 1e6, linear * 1e6)
+
+
+if __name__ == "__main__":
+  sizes = [int(x) for x in sys.argv[1:]] or [1000, 10000, 100000]
+  main(sizes)
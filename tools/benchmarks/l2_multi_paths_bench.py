@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures how long forwarding.l2_multi takes to recover paths after a flap
+
+We build a leaf-spine fabric, warm up paths between random pairs of
+switches, and then take a link down and bring it back up.  After each
+change, we time answering the same path queries again.  This is done
+with l2_multi's lazily computed shortest path trees, with its NumPy
+DensePaths (if NumPy is available), and with the Floyd-Warshall that
+l2_multi used to run over the whole network after every link event.
+
+Run from the top level:
+  ./tools/benchmarks/l2_multi_paths_bench.py [switch counts...]
+"""
+
+import sys
+import os.path
+import time
+import random
+from collections import defaultdict
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+import pox.forwarding.l2_multi as l2m
+
+QUERIES = 200
+FLAPS = 5
+
+
+def floyd_warshall (sws, adjacency):
+  """
+  What l2_multi._calc_paths() used to do
+  """
+  path_map = defaultdict(lambda:defaultdict(lambda:(None,None)))
+  for k in sws:
+    for j,port in adjacency[k].iteritems():
+      if port is None: continue
+      path_map[k][j] = (1,None)
+    path_map[k][k] = (0,None)
+  for k in sws:
+    for i in sws:
+      for j in sws:
+        if path_map[i][k][0] is not None:
+          if path_map[k][j][0] is not None:
+            ikj_dist = path_map[i][k][0]+path_map[k][j][0]
+            if path_map[i][j][0] is None or ikj_dist < path_map[i][j][0]:
+              path_map[i][j] = (ikj_dist, k)
+  return path_map
+
+
+def fw_raw_path (path_map, src, dst):
+  if src is dst: return []
+  if path_map[src][dst][0] is None: return None
+  intermediate = path_map[src][dst][1]
+  if intermediate is None: return []
+  return (fw_raw_path(path_map, src, intermediate) + [intermediate] +
+          fw_raw_path(path_map, intermediate, dst))
+
+
+def make_fabric (count):
+  """
+  Makes a leaf-spine fabric with about count switches
+  """
+  l2m.adjacency.clear()
+  l2m.switches.clear()
+  l2m.path_trees.clear()
+  spines = max(2, count // 10)
+  sws = []
+  for i in range(count):
+    sw = l2m.Switch()
+    sw.dpid = i + 1
+    l2m.switches[sw.dpid] = sw
+    sws.append(sw)
+  links = []
+  for leaf in sws[spines:]:
+    for spine in sws[:spines]:
+      l2m.adjacency[leaf][spine] = spine.dpid
+      l2m.adjacency[spine][leaf] = leaf.dpid
+      links.append((leaf, spine))
+  return sws, links
+
+
+def time_flaps (sws, queries, flaps):
+  """
+  Average time to answer the queries after each link change
+  """
+  for src,dst in queries: l2m._get_raw_path(src, dst)
+  elapsed = 0
+  for sw1,sw2 in flaps:
+    for up in (False, True):
+      t = time.time()
+      if up:
+        l2m.adjacency[sw1][sw2] = sw2.dpid
+        l2m.adjacency[sw2][sw1] = sw1.dpid
+        l2m._link_added(sw1, sw2)
+      else:
+        del l2m.adjacency[sw1][sw2]
+        del l2m.adjacency[sw2][sw1]
+        l2m._link_removed(sw1, sw2)
+      for src,dst in queries: l2m._get_raw_path(src, dst)
+      elapsed += time.time() - t
+  return elapsed / (len(flaps) * 2)
+
+
+def main (counts):
+  print "%8s %16s %16s %16s" % ("switches", "trees (ms)", "dense (ms)",
+                                "floyd (ms)")
+  for count in counts:
+    rng = random.Random(count)
+    sws, links = make_fabric(count)
+    queries = [rng.sample(sws, 2) for i in range(QUERIES)]
+    flaps = [rng.choice(links) for i in range(FLAPS)]
+
+    # Lazily computed trees
+    trees = time_flaps(sws, queries, flaps)
+
+    # NumPy matrices
+    if l2m.numpy is not None:
+      l2m.dense_paths = l2m.DensePaths()
+      dense = "%16.2f" % (time_flaps(sws, queries, flaps) * 1000,)
+      l2m.dense_paths = None
+    else:
+      dense = "%16s" % ("n/a",)
+
+    # Floyd-Warshall over everything after every change
+    elapsed = 0
+    for sw1,sw2 in flaps:
+      for up in (False, True):
+        t = time.time()
+        if up:
+          l2m.adjacency[sw1][sw2] = sw2.dpid
+          l2m.adjacency[sw2][sw1] = sw1.dpid
+        else:
+          del l2m.adjacency[sw1][sw2]
+          del l2m.adjacency[sw2][sw1]
+        path_map = floyd_warshall(sws, l2m.adjacency)
+        for src,dst in queries: fw_raw_path(path_map, src, dst)
+        elapsed += time.time() - t
+    floyd = elapsed / (FLAPS * 2)
+
+    print "%8i %16.2f %s %16.2f" % (count, trees * 1000, dense, floyd * 1000)
+
+
+if __name__ == "__main__":
+  counts = [int(x) for x in sys.argv[1:]] or [25, 50, 100]
+  main(counts)
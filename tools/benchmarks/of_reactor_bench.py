@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compares the per-wakeup cost of of_01's select and epoll reactors
+
+For increasing numbers of idle "switch" sockets, one socket is made
+readable and we time how long it takes each reactor to wake up and find
+it.  The select reactor has to hand every socket to select() each time
+(and can't go past FD_SETSIZE at all); the epoll reactor only selects on
+the listener and the epoll fd, then asks epoll for what's ready.
+
+Run from the top level:
+  ./tools/benchmarks/of_reactor_bench.py [counts...]
+"""
+
+import sys
+import os.path
+import socket
+import select
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from pox.lib.epoll_select import EpollSelect
+
+ROUNDS = 2000
+
+
+def wakeup_select (pairs, ready):
+  socks = [a for a,b in pairs]
+  t = time.time()
+  for i in xrange(ROUNDS):
+    rl,wl,xl = select.select(list(socks), [], socks, 0)
+    assert rl == [ready]
+  return (time.time() - t) / ROUNDS
+
+
+def wakeup_epoll (poller, pairs, ready):
+  for a,b in pairs:
+    poller.register(a)
+  fds = [poller]
+  t = time.time()
+  for i in xrange(ROUNDS):
+    rl,wl,xl = select.select(fds, [], [], 0)
+    assert rl == fds
+    r = poller.poll(0)
+    assert r[0][0] is ready
+  t = (time.time() - t) / ROUNDS
+  for a,b in pairs:
+    poller.unregister(a)
+  return t
+
+
+def main (counts):
+  # Like in of_01, the epoll object is created before the connections, so
+  # its own fd stays low enough to select() on.
+  poller = EpollSelect()
+  print "%8s %14s %14s" % ("sockets", "select (us)", "epoll (us)")
+  for n in counts:
+    pairs = [socket.socketpair() for i in xrange(n)]
+    ready = pairs[n // 2][0]
+    pairs[n // 2][1].send("x")
+    try:
+      s = "%14.2f" % (wakeup_select(pairs, ready) * 1e6,)
+    except ValueError:
+      s = "%14s" % ("FD_SETSIZE",)
+    e = wakeup_epoll(poller, pairs, ready) * 1e6
+    print "%8i %s %14.2f" % (n, s, e)
+    for a,b in pairs:
+      a.close()
+      b.close()
+  poller.close()
+
+
+if __name__ == '__main__':
+  counts = [int(x) for x in sys.argv[1:]]
+  if not counts:
+    counts = [10, 100, 250, 500, 1000, 2000, 4000]
+  main(counts)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+# Copyright 2013 James McCauley
+#
+# This file is part of POX.
+#
+# POX is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# POX is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with POX.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Measures the cost of EventMixin.raiseEvent()
+
+For each number of listeners, times raising an event by class (so the
+event is only constructed if there are listeners) and raising an event
+object (which the caller always constructs).
+
+Run from the top level:
+  ./tools/benchmarks/revent_bench.py [listener counts...]
+"""
+
+import sys
+import os.path
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from pox.lib.revent.revent import Event, EventMixin
+
+ROUNDS = 100000
+
+
+class Ping (Event):
+  def __init__ (self, n):
+    Event.__init__(self)
+    self.n = n
+
+class Source (EventMixin):
+  _eventMixin_events = set([Ping])
+
+
+def handler (event):
+  pass
+
+
+def by_class (source):
+  raiseEvent = source.raiseEvent
+  t = time.time()
+  for i in xrange(ROUNDS):
+    raiseEvent(Ping, i)
+  return time.time() - t
+
+def by_object (source):
+  raiseEvent = source.raiseEvent
+  t = time.time()
+  for i in xrange(ROUNDS):
+    raiseEvent(Ping(i))
+  return time.time() - t
+
+
+def main (counts):
+  print "%9s %14s %14s" % ("listeners", "by class (us)", "by object (us)")
+  for count in counts:
+    source = Source()
+    for i in range(count):
+      source.addListener(Ping, handler)
+    c = by_class(source) / ROUNDS * 1000000
+    o = by_object(source) / ROUNDS * 1000000
+    print "%9i %14.3f %14.3f" % (count, c, o)
+
+
+if __name__ == "__main__":
+  counts = [int(x) for x in sys.argv[1:]] or [0, 1, 5, 20]
+  main(counts)